@@ -17,6 +17,11 @@
 #include <ostream>
 #include <iomanip>
 #include <sstream>
+#include <algorithm>
+#include <functional>
+#include <utility>
+#include <pthread.h>
+#include <cmath>
 
 #include "util/CommandOptions.h"
 
@@ -1,11 +1,47 @@
 using namespace std;
 
+#ifndef SWIG
+/* Scoped holds on a pthread read/write lock. */
+class ReadLock {
+public:
+  ReadLock(pthread_rwlock_t *lock) : _lock(lock) {
+    pthread_rwlock_rdlock(_lock);
+  }
+  ~ReadLock() {
+    pthread_rwlock_unlock(_lock);
+  }
+private:
+  pthread_rwlock_t *_lock;
+};
+
+class WriteLock {
+public:
+  WriteLock(pthread_rwlock_t *lock) : _lock(lock) {
+    pthread_rwlock_wrlock(_lock);
+  }
+  ~WriteLock() {
+    pthread_rwlock_unlock(_lock);
+  }
+private:
+  pthread_rwlock_t *_lock;
+};
+#endif
+
+/* Threads: the wrapper releases the GIL for every call. The methods that
+ * only read the estimated model (vocabIndices, tokenLogprobsIds,
+ * tokenLogprobs, xentropyBatch, xentropyBatchIds, predictTopK,
+ * predictBatch, params and save) can run in any number of threads at once.
+ * The ones that go through MITLM's evaluators (xentropy, predict) or change
+ * the model (optimize) take the instance's lock exclusively. */
 class PyMitlm {
 public:
-  PyMitlm(string corpus, int order, string smoothing, bool unk) 
-     : _eval(_lm, (order < 4 ? order : 4)),
+  PyMitlm(string corpus, int order, string smoothing, bool unk,
+          vector<double> params = vector<double>())
+     : _base(&_lm),
+     _eval(_lm, (order < 4 ? order : 4)),
      _params(_lm.defParams())
   {
+    pthread_rwlock_init(&_rwlock, NULL);
     Logger::SetVerbosity(1);
     _order = order;
     _smoothing = smoothing;
@@ -17,10 +53,37 @@ public:
                 corpus.c_str(), NULL, 
                 smoothing.c_str(), NULL);
     _params = ParamVector(_lm.defParams());
+    /* Reuse previously tuned parameters if we were given some that fit
+     * this smoothing. */
+    if (params.size() == _params.length()) {
+      for (size_t i = 0; i < params.size(); i++)
+        _params[i] = params[i];
+    }
     Logger::Log(1, "Parameters:\n");
     _lm.Estimate(_params);
   }
+  PyMitlm(string snapshot, int order)
+     : _base(&_arpa),
+     _eval(_arpa, (order < 4 ? order : 4)),
+     _params(_arpa.defParams())
+  {
+    /* Load a model written by save() instead of estimating one. The
+     * probabilities and backoff weights are already final, so there are
+     * no parameters left to tune. */
+    pthread_rwlock_init(&_rwlock, NULL);
+    Logger::SetVerbosity(1);
+    _order = order;
+    _smoothing = "snapshot";
+    _unk = true;
+    Logger::Log(1, "[LL] Loading snapshot %s...\n", snapshot.c_str());
+    _arpa = ArpaNgramLM(order);
+    ZFile lmFile(snapshot.c_str(), "rb");
+    _arpa.LoadLM(lmFile);
+    _params = ParamVector(_arpa.defParams());
+    _arpa.Estimate(_params);
+  }
   virtual ~PyMitlm() {
+    pthread_rwlock_destroy(&_rwlock);
   }
   int order() {
     return _order;
@@ -31,11 +94,40 @@ public:
   bool unk() {
     return _unk;
   }
+  vector<double> params() {
+      ReadLock lock(&_rwlock);
+      vector<double> result(_params.length());
+      for (size_t i = 0; i < result.size(); i++)
+        result[i] = _params[i];
+      return result;
+  }
+  double optimize(string devCorpus) {
+      /* Tune the smoothing parameters to minimize the entropy of devCorpus
+       * and re-estimate the model with them. Returns that entropy. */
+      WriteLock lock(&_rwlock);
+      PerplexityOptimizer perpEval(*_base, _order);
+      ZFile devFile(devCorpus.c_str(), "r");
+      Logger::Log(1, "[LL] Tuning on %s...\n", devCorpus.c_str());
+      perpEval.LoadCorpus(devFile);
+      if (_params.length() == 0)
+        return perpEval.ComputeEntropy(_params);
+      double entropy = perpEval.Optimize(_params, PowellOpt);
+      _base->Estimate(_params);
+      return entropy;
+  }
+  void save(string path) {
+      /* Write the estimated model in MITLM's binary LM format, which the
+       * snapshot constructor reads back without touching the corpus. */
+      ReadLock lock(&_rwlock);
+      ZFile lmFile(path.c_str(), "wb");
+      _base->SaveLM(lmFile, true);
+  }
   double xentropy(string datas) {
+      WriteLock lock(&_rwlock);
       const char * data = datas.c_str();
       double p = 70.0;
       vector<const char *> Zords;
-      PerplexityOptimizer perpEval(_lm, _order);
+      PerplexityOptimizer perpEval(*_base, _order);
 
       Zords.push_back(data);
       FakeZFile *zfile = new FakeZFile(Zords);
@@ -52,7 +144,94 @@ public:
       delete zfile;
       return p;
   }
+  vector<double> xentropyBatch(vector<string> datas) {
+      /* Same as xentropy, but for many strings at once, scored straight
+       * from the estimated model like xentropyBatchIds. */
+      ReadLock lock(&_rwlock);
+      vector<double> results;
+
+      results.reserve(datas.size());
+      for (size_t i = 0; i < datas.size(); i++) {
+        std::istringstream in(datas[i]);
+        vector<string> words;
+        string word;
+        while (in >> word)
+          words.push_back(word);
+        vector<int> ids = _vocabIndices(words);
+        results.push_back(_xentropy(ids.begin(), ids.end()));
+      }
+      return results;
+  }
+  vector<double> tokenLogprobs(string datas) {
+      /* Natural log-probability of every token in datas, each conditioned
+       * on the tokens before it (up to the model order). The first token is
+       * conditioned on the start of a sentence, like xentropy. Tokens the
+       * model can't score at all get -70, our "practically infinite"
+       * surprisal. */
+      std::istringstream in(datas);
+      vector<string> words;
+      string word;
+      while (in >> word)
+        words.push_back(word);
+      ReadLock lock(&_rwlock);
+      vector<int> ids = _vocabIndices(words);
+      vector<double> results;
+      _logprobs(ids.begin(), ids.end(), false, results);
+      return results;
+  }
+  vector<int> vocabIndices(vector<string> words) {
+      /* This model's vocabulary index for every word, <unk> for words it
+       * has never seen, and -1 if it doesn't even have <unk>. Indices are
+       * only good for this instance. */
+      ReadLock lock(&_rwlock);
+      return _vocabIndices(words);
+  }
+  vector<double> tokenLogprobsIds(vector<int> ids) {
+      /* Same as tokenLogprobs, for words already looked up with
+       * vocabIndices. */
+      ReadLock lock(&_rwlock);
+      vector<double> results;
+      _logprobs(ids.begin(), ids.end(), false, results);
+      return results;
+  }
+  vector<double> xentropyBatchIds(vector<int> ids, vector<int> lengths) {
+      /* Same as xentropyBatch, for a batch of sentences given as
+       * vocabIndices. ids holds all of the sentences end to end and
+       * lengths says where each one ends. */
+      ReadLock lock(&_rwlock);
+      vector<double> results;
+      vector<int>::iterator start = ids.begin();
+
+      results.reserve(lengths.size());
+      for (size_t i = 0; i < lengths.size(); i++) {
+        results.push_back(_xentropy(start, start + lengths[i]));
+        start += lengths[i];
+      }
+      return results;
+  }
+  vector<pair<string, double> > predictTopK(vector<int> context, int k) {
+      /* The k most likely words to follow context (vocabIndices), most
+       * likely first, with their natural log-probabilities. */
+      ReadLock lock(&_rwlock);
+      return _predict(context.begin(), context.end(), k);
+  }
+  vector<vector<pair<string, double> > > predictBatch(vector<int> contexts,
+                                                      vector<int> lengths,
+                                                      int k) {
+      /* predictTopK for many contexts at once, laid out end to end like
+       * xentropyBatchIds. */
+      ReadLock lock(&_rwlock);
+      vector<vector<pair<string, double> > > results;
+      vector<int>::iterator start = contexts.begin();
+      results.reserve(lengths.size());
+      for (size_t i = 0; i < lengths.size(); i++) {
+        results.push_back(_predict(start, start + lengths[i], k));
+        start += lengths[i];
+      }
+      return results;
+  }
   string predict(string data) {
+      WriteLock lock(&_rwlock);
       Logger::Log(2, "Live Guess Input: %s\n", data.c_str());
 
       /* Fun fact! The prediction arugment is ignored, so I'm passing an arbitrary
@@ -84,10 +263,125 @@ public:
       return output_str;
   }
 private:
+  vector<int> _vocabIndices(const vector<string> &words) {
+      const Vocab &vocab = _base->model().vocab();
+      const VocabIndex unk = vocab.Find("<unk>", 5);
+      vector<int> results(words.size());
+      for (size_t i = 0; i < words.size(); i++) {
+        VocabIndex w = vocab.Find(words[i].c_str(), words[i].length());
+        if (w == Vocab::Invalid)
+          w = unk;
+        results[i] = (w == Vocab::Invalid ? -1 : (int)w);
+      }
+      return results;
+  }
+  void _startHistories(vector<NgramIndex> &hists) {
+      /* Histories ending at the sentence start. */
+      std::fill(hists.begin(), hists.end(), NgramVector::Invalid);
+      hists[0] = 0;
+      if (_order > 1)
+        hists[1] = _base->model().vectors(1).Find(0, Vocab::EndOfSentence);
+  }
+  double _prob(const vector<NgramIndex> &hists, VocabIndex w) {
+      /* Probability of w after hists, backing off as far as needed. */
+      const NgramModel &model = _base->model();
+      double bow = 1.0;
+      if (w == Vocab::Invalid)
+        return 0.0;
+      for (size_t o = _order; o >= 1; o--) {
+        if (hists[o-1] == NgramVector::Invalid)
+          continue;
+        NgramIndex index = model.vectors(o).Find(hists[o-1], w);
+        if (index != NgramVector::Invalid)
+          return bow * _base->probs(o)[index];
+        bow *= _base->bows(o-1)[hists[o-1]];
+      }
+      return 0.0;
+  }
+  void _advance(vector<NgramIndex> &hists, vector<NgramIndex> &prevHists,
+                VocabIndex w) {
+      /* Slide the histories forward by one token. */
+      const NgramModel &model = _base->model();
+      prevHists.swap(hists);
+      hists[0] = 0;
+      for (size_t o = 1; o < _order; o++) {
+        if (prevHists[o-1] == NgramVector::Invalid || w == Vocab::Invalid)
+          hists[o] = NgramVector::Invalid;
+        else
+          hists[o] = model.vectors(o).Find(prevHists[o-1], w);
+      }
+  }
+  static VocabIndex _index(int id) {
+      return (id < 0 ? Vocab::Invalid : (VocabIndex)id);
+  }
+  void _logprobs(vector<int>::iterator begin, vector<int>::iterator end,
+                 bool endOfSentence, vector<double> &results) {
+      vector<NgramIndex> hists(_order);
+      vector<NgramIndex> prevHists(_order);
+
+      _startHistories(hists);
+      for (vector<int>::iterator it = begin; it != end; ++it) {
+        VocabIndex w = _index(*it);
+        double p = _prob(hists, w);
+        Logger::Log(2, "Token %d p %e\n", *it, p);
+        results.push_back(p > 0.0 ? std::max(log(p), -70.0) : -70.0);
+        _advance(hists, prevHists, w);
+      }
+      if (endOfSentence) {
+        double p = _prob(hists, Vocab::EndOfSentence);
+        results.push_back(p > 0.0 ? std::max(log(p), -70.0) : -70.0);
+      }
+  }
+  double _xentropy(vector<int>::iterator begin, vector<int>::iterator end) {
+      /* Cross-entropy in nats per token, the end of the sentence counting
+       * as a token, like xentropy. */
+      vector<double> logprobs;
+      double total = 0.0;
+
+      logprobs.reserve(end - begin + 1);
+      _logprobs(begin, end, true, logprobs);
+      for (size_t i = 0; i < logprobs.size(); i++)
+        total -= logprobs[i];
+      return total / logprobs.size();
+  }
+  vector<pair<string, double> > _predict(vector<int>::iterator begin,
+                                         vector<int>::iterator end,
+                                         size_t k) {
+      const Vocab &vocab = _base->model().vocab();
+      const VocabIndex unk = vocab.Find("<unk>", 5);
+      vector<NgramIndex> hists(_order);
+      vector<NgramIndex> prevHists(_order);
+      vector<pair<double, VocabIndex> > scored;
+      vector<pair<string, double> > results;
+
+      _startHistories(hists);
+      for (vector<int>::iterator it = begin; it != end; ++it)
+        _advance(hists, prevHists, _index(*it));
+      scored.reserve(vocab.size());
+      for (VocabIndex w = 0; w < vocab.size(); w++) {
+        if (w == unk)
+          continue;
+        double p = _prob(hists, w);
+        if (p > 0.0)
+          scored.push_back(make_pair(p, w));
+      }
+      k = std::min(k, scored.size());
+      std::partial_sort(scored.begin(), scored.begin() + k, scored.end(),
+                        std::greater<pair<double, VocabIndex> >());
+      results.reserve(k);
+      for (size_t i = 0; i < k; i++)
+        results.push_back(make_pair(string(vocab[scored[i].second]),
+                                    std::max(log(scored[i].first), -70.0)));
+      return results;
+  }
   int _order;
   string _smoothing;
   bool _unk;
   NgramLM _lm;
+  ArpaNgramLM _arpa;
+  /* Whichever of _lm or _arpa this instance was built with. */
+  NgramLMBase *_base;
   ParamVector _params;
   LiveGuess _eval;
+  pthread_rwlock_t _rwlock;
 };
\ No newline at end of file
@@ -1,7 +1,8 @@
-%module pymitlm
+%module(threads="1") pymitlm
 
 %include <std_string.i>
 %include <std_vector.i>
+%include <std_pair.i>
 
 %{
 #include "includes.h"
@@ -10,6 +11,11 @@
 
 namespace std {
    %template(StringVector) vector<string>;
+   %template(DoubleVector) vector<double>;
+   %template(IntVector) vector<int>;
+   %template(Prediction) pair<string, double>;
+   %template(PredictionVector) vector<pair<string, double> >;
+   %template(PredictionVectorVector) vector<vector<pair<string, double> > >;
 }
 
 %include "pymitlm.h"
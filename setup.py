@@ -99,7 +99,7 @@ setup(
                            include_dirs=['pymitlm/mitlm/src'],
                            #library_dirs=['pymitlm/mitlm/.libs'],
                            #runtime_library_dirs=['pymitlm/mitlm/.libs'],
-                           libraries=['gfortran'],
+                           libraries=['gfortran', 'pthread'],
                            swig_opts=['-c++'],
                            extra_compile_args=['-std=gnu++11', '-fPIC']
                           )],
@@ -0,0 +1,105 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from unnaturalcode.unnaturalCode import *
+from unnaturalcode.sourceModel import *
+from unnaturalcode.pythonSource import *
+from unnaturalcode.numpyCorpus import *
+
+import os, os.path, shutil, math
+from tempfile import *
+
+from unnaturalcode.ucTestData import *
+
+class testNumpyCorpus(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.corpus = os.path.join(self.td, 'ucCorpus')
+        self.cm = numpyCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        self.sm = sourceModel(cm=self.cm, language=pythonSource)
+        self.sm.trainString(lotsOfPythonCode)
+        self.query = self.sm.stringifyAll(ucSource(someLexemes))
+    def testQueryCorpus(self):
+        r = self.cm.queryCorpus(self.query)
+        self.assertTrue(r > 0.0)
+        self.assertTrue(r < 70.0)
+    def testQueryCorpusBatch(self):
+        queries = [self.query, self.query[1:], self.query[:3]]
+        batch = self.cm.queryCorpusBatch(queries)
+        for query, r in zip(queries, batch):
+            self.assertAlmostEqual(r, self.cm.queryCorpus(query))
+    def testTokenLogprobs(self):
+        logprobs = self.cm.tokenLogprobs(self.query)
+        self.assertEquals(len(logprobs), len(self.query))
+        self.assertTrue(all(lp <= 0.0 for lp in logprobs))
+    def testPredictCorpus(self):
+        predictions = self.cm.predictCorpus(self.query[:2], k=len(self.cm.words))
+        # Everything but <s> and <unk> is a candidate; together with <unk>
+        # they should make up the whole distribution.
+        unk = self.cm.tokenLogprobs(self.query[:2] + [u'never-seen'])[-1]
+        total = sum(math.exp(lp) for token, lp in predictions) + math.exp(unk)
+        self.assertAlmostEqual(total, 1.0)
+        self.assertEquals(self.cm.predictCorpus(self.query[:2], k=3),
+                          predictions[:3])
+        self.assertEquals(self.cm.predictCorpusBatch([self.query[:2]], k=3),
+                          [predictions[:3]])
+    def testInternedQueries(self):
+        ids = self.cm.internAll(self.query)
+        self.assertEquals(len(ids), len(self.query))
+        self.assertAlmostEqual(self.cm.queryCorpusIds(ids),
+                               self.cm.queryCorpus(self.query))
+        # Query-only strings are <unk>, and don't grow the vocabulary.
+        size = len(self.cm.words)
+        unk = list(self.cm.internAll([u'<unk>']))
+        self.assertEquals(list(self.cm.internAll([u'never-seen', u'nor-this'])),
+                          unk * 2)
+        self.assertEquals(len(self.cm.words), size)
+        self.sm.trainString(u'never_seen = 1')
+        self.assertNotEqual(list(self.cm.internAll([u'never_seen'])), unk)
+        lexemes = self.sm.sourceToScrubbed(lotsOfPythonCode)
+        windows = self.sm.windowedQuery(lexemes)
+        self.assertAlmostEqual(windows[0][1],
+            self.cm.queryCorpus(self.sm.stringifyAll(windows[0][0])))
+    def testWindowCache(self):
+        lexemes = self.sm.sourceToScrubbed(lotsOfPythonCode)
+        first = self.sm.windowedQuery(lexemes)
+        misses = self.cm.windowCache.misses
+        self.assertEquals(self.sm.windowedQuery(lexemes), first)
+        self.assertEquals(self.cm.windowCache.misses, misses)
+        self.assertEquals(self.cm.windowCache.hits, len(first))
+        self.sm.trainString(somePythonCode)
+        self.sm.windowedQuery(lexemes)
+        self.assertEquals(self.cm.windowCache.misses, misses + len(first))
+    def testOnlineUpdate(self):
+        before = self.cm.queryCorpus(self.query)
+        generation = self.cm.generation
+        self.sm.trainString(somePythonCode)
+        after = self.cm.queryCorpus(self.query)
+        self.assertEquals(self.cm.generation, generation + 1)
+        self.assertTrue(after < before)
+        # Reading the corpus back gives the same model.
+        cm = numpyCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        self.assertAlmostEqual(cm.queryCorpus(self.query), after)
+        cm.release()
+    def tearDown(self):
+        self.sm.release()
+        shutil.rmtree(self.td)
+
+if __name__ == '__main__':
+    unittest.main()
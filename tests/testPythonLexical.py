@@ -165,3 +165,24 @@ class testPythonLexical(unittest.TestCase):
         r.check()
         self.assertEquals(x.value, ':')
 
+    def testExpected(self):
+        r = pythonSource(lotsOfPythonCode).scrubbed()
+        self.assertEquals(r.expected(), (None, set()))
+        colon = [i for i, l in enumerate(r) if l.value == ':'][0]
+        r.pop(colon)
+        at, expected = r.expected()
+        self.assertEquals(at, colon)
+        self.assertEquals(expected, set([('OP', ':'), ('OP', '->')]))
+        r = pythonSource("print mul(1, 2\n")
+        at, expected = r.expected()
+        # The newline is inside the brackets, so it doesn't end the line.
+        self.assertEquals(r[at].type, 'ENDMARKER')
+        self.assertTrue(('OP', ')') in expected)
+        self.assertTrue(('OP', ',') in expected)
+        self.assertFalse(('NEWLINE', None) in expected)
+    def testRestarts(self):
+        r = pythonSource(lotsOfPythonCode).scrubbed()
+        self.assertEquals([r[i].value for i in r.restarts()], ['def', 'print'])
+        # Lexing carries on past a bracket that was never opened.
+        r = pythonSource("x = 1)\ny = 2\nz = 3\n").scrubbed()
+        self.assertEquals([r[i].value for i in r.restarts()], ['x'])
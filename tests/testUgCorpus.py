@@ -0,0 +1,149 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from unnaturalcode.unnaturalCode import *
+from unnaturalcode.sourceModel import *
+from unnaturalcode.pythonSource import *
+from unnaturalcode.ugCorpus import *
+
+import os, os.path, shutil, math
+from tempfile import *
+
+from unnaturalcode.ucTestData import *
+
+try:
+    loadLibrary()
+    haveLibrary = True
+except OSError:
+    haveLibrary = False
+
+@unittest.skipUnless(haveLibrary, "libunnaturalgrams isn't built")
+class testUgCorpus(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.corpus = os.path.join(self.td, 'ucCorpus')
+        self.cm = ugCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        self.sm = sourceModel(cm=self.cm, language=pythonSource)
+        self.sm.trainString(lotsOfPythonCode)
+        self.query = self.sm.stringifyAll(ucSource(someLexemes))
+    def testQueryCorpus(self):
+        r = self.cm.queryCorpus(self.query)
+        self.assertTrue(r > 0.0)
+        self.assertTrue(r < 70.0)
+        backwards = self.cm.queryCorpus(list(reversed(self.query)))
+        self.assertTrue(r < backwards)
+    def testQueryCorpusBatch(self):
+        queries = [self.query, self.query[1:], self.query[:3]]
+        batch = self.cm.queryCorpusBatch(queries)
+        for query, r in zip(queries, batch):
+            self.assertAlmostEqual(r, self.cm.queryCorpus(query))
+    def testTokenLogprobs(self):
+        logprobs = self.cm.tokenLogprobs(self.query)
+        self.assertEquals(len(logprobs), len(self.query))
+        self.assertTrue(all(lp <= 0.0 for lp in logprobs))
+        # The end of the sentence counts towards the cross-entropy too.
+        self.assertTrue(-sum(logprobs) / (len(self.query) + 1)
+                        < self.cm.queryCorpus(self.query))
+    def testInternUnknown(self):
+        size = len(self.cm.words)
+        unk = [UNK]
+        self.assertEquals(list(self.cm.internAll([u'never-seen', u'nor-this'])),
+                          unk * 2)
+        self.assertEquals(len(self.cm.words), size)
+        self.assertAlmostEqual(self.cm.queryCorpus([u'never-seen']),
+                               self.cm.queryCorpus([u'nor-this']))
+        # Known to the database, even though another process trained on it.
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.sm.trainString(u'never_seen = 1')
+                status = 0
+            finally:
+                os._exit(status)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        self.assertNotEqual(list(self.cm.internAll([u'never_seen'])), unk)
+    def testPredictCorpus(self):
+        predictions = self.cm.predictCorpus(self.query[:2], k=3)
+        self.assertEquals(len(predictions), 3)
+        self.assertEquals(predictions, sorted(predictions,
+                                              key=lambda p: -p[1]))
+        logprobs = self.cm.tokenLogprobs(self.query[:2] + [predictions[0][0]])
+        self.assertAlmostEqual(predictions[0][1], logprobs[-1])
+        self.assertEquals(self.cm.predictCorpusBatch([self.query[:2]], k=3),
+                          [predictions])
+    def testOnlineUpdate(self):
+        before = self.cm.queryCorpus(self.query)
+        generation = self.cm.generation
+        self.sm.trainString(somePythonCode)
+        after = self.cm.queryCorpus(self.query)
+        self.assertNotEqual(self.cm.generation, generation)
+        self.assertTrue(after < before)
+        # Nothing is lost by closing the database.
+        self.cm.release()
+        cm = ugCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        self.assertAlmostEqual(cm.queryCorpus(self.query), after)
+        cm.release()
+    def testOtherProcess(self):
+        before = self.cm.queryCorpus(self.query)
+        generation = self.cm.generation
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.sm.trainString(somePythonCode)
+                status = 0
+            finally:
+                os._exit(status)
+        self.assertEquals(os.waitpid(pid, 0)[1], 0)
+        # Nothing cached before is used now.
+        self.assertNotEqual(self.cm.generation, generation)
+        self.assertTrue(self.cm.queryCorpus(self.query) < before)
+    def testBulkLoad(self):
+        corpus = os.path.join(self.td, 'bulkCorpus')
+        cm = ugCorpus(readCorpus=corpus, writeCorpus=corpus, order=4)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        with cm.bulkLoad():
+            sm.trainString(lotsOfPythonCode)
+            self.assertRaises(RuntimeError, cm.predictCorpus, self.query[:2])
+        self.assertAlmostEqual(cm.queryCorpus(self.query),
+                               self.cm.queryCorpus(self.query))
+        self.assertEquals(cm.predictCorpus(self.query[:2], k=3),
+                          self.cm.predictCorpus(self.query[:2], k=3))
+        sm.release()
+    def testBulkLoadConflict(self):
+        before = self.cm.queryCorpus(self.query)
+        cm = ugCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        def load():
+            with self.cm.bulkLoad():
+                self.sm.trainString(lotsOfPythonCode)
+                sm.trainString(somePythonCode)
+        # The other handle's training isn't overwritten by the load.
+        self.assertRaises(RuntimeError, load)
+        after = self.cm.queryCorpus(self.query)
+        self.assertAlmostEqual(after, cm.queryCorpus(self.query))
+        self.assertTrue(after < before)
+        sm.release()
+    def tearDown(self):
+        self.sm.release()
+        shutil.rmtree(self.td)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#    Copyright 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from unnaturalcode.pythonSource import *
+from unnaturalcode.uniqueTokens import uniqueTokens
+
+import os, os.path, shutil, pickle
+from tempfile import *
+
+from unnaturalcode.ucTestData import *
+
+class testUniqueTokens(unittest.TestCase):
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.path = os.path.join(self.td, 'ucCorpus.uniqueTokens')
+        self.lexemes = pythonSource(lotsOfPythonCode).scrubbed()
+    def testAdd(self):
+        tokens = uniqueTokens(self.path)
+        tokens.add(self.lexemes)
+        tokens.add(pythonSource(somePythonCode).scrubbed())
+        self.assertEquals(tokens['def'], self.lexemes[0])
+        self.assertTrue('print' in tokens)
+        self.assertFalse('lambda' in tokens)
+        self.assertEquals(tokens.count('r'), 3)
+        self.assertEquals(tokens.count('print'), 2)
+        # The next one reads what we wrote.
+        again = uniqueTokens(self.path)
+        self.assertEquals(sorted(again.items()), sorted(tokens.items()))
+        self.assertEquals(again.count('r'), 3)
+    def testLazy(self):
+        tokens = uniqueTokens(self.path)
+        tokens.add(self.lexemes)
+        self.assertEquals(tokens.tokens, None)
+        self.assertEquals(len(tokens), len(set(l[4] for l in self.lexemes)))
+    def testReload(self):
+        tokens = uniqueTokens(self.path)
+        self.assertFalse('print' in tokens)
+        # Another process trains.
+        uniqueTokens(self.path).add(pythonSource(somePythonCode).scrubbed())
+        self.assertFalse('print' in tokens)
+        tokens.reload()
+        self.assertTrue('print' in tokens)
+        self.assertEquals(tokens.count('print'), 1)
+    def testCompact(self):
+        tokens = uniqueTokens(self.path)
+        for i in range(0, 10):
+            tokens.add(self.lexemes)
+        before = os.path.getsize(tokens.writeLog)
+        tokens.compact()
+        self.assertTrue(os.path.getsize(tokens.writeLog) * 5 < before)
+        again = uniqueTokens(self.path)
+        self.assertEquals(again.count('r'), 30)
+        self.assertEquals(again['def'], self.lexemes[0])
+    def testCompactWhileOthersAppend(self):
+        tokens = uniqueTokens(self.path)
+        # Another process, training on the same corpus.
+        other = uniqueTokens(self.path)
+        for i in range(0, 4):
+            tokens.add(self.lexemes)
+        readRecords = tokens.readRecords
+        def appendMeanwhile(path, end=None):
+            other.add(self.lexemes)
+            return readRecords(path, end)
+        tokens.readRecords = appendMeanwhile
+        tokens.compact()
+        other.add(self.lexemes)
+        self.assertEquals(other.size, os.path.getsize(other.writeLog))
+        self.assertEquals(uniqueTokens(self.path).count('r'), 18)
+    def testBackgroundCompact(self):
+        tokens = uniqueTokens(self.path)
+        tokens.COMPACT_AFTER = 1
+        tokens.add(self.lexemes)
+        tokens.waitForCompaction()
+        size = os.path.getsize(tokens.writeLog)
+        self.assertEquals(tokens.compactedSize, size)
+        tokens.add(self.lexemes)
+        tokens.waitForCompaction()
+        self.assertEquals(os.path.getsize(tokens.writeLog), 2 * size)
+        tokens.add(self.lexemes)
+        tokens.add(self.lexemes)
+        tokens.waitForCompaction()
+        self.assertEquals(os.path.getsize(tokens.writeLog), size)
+        self.assertEquals(uniqueTokens(self.path).count('r'), 12)
+    def testMigrate(self):
+        legacy = dict((l[4], l) for l in reversed(self.lexemes))
+        with open(self.path, 'wb') as f:
+            pickle.dump(legacy, f)
+        tokens = uniqueTokens(self.path)
+        self.assertTrue(os.path.exists(self.path + ".log"))
+        self.assertEquals(sorted(tokens.items()), sorted(legacy.items()))
+        tokens.add(pythonSource(somePythonCode).scrubbed())
+        self.assertEquals(uniqueTokens(self.path).count('print'), 2)
+    def testReadOnly(self):
+        uniqueTokens(self.path).add(self.lexemes)
+        other = os.path.join(self.td, 'otherCorpus.uniqueTokens')
+        tokens = uniqueTokens(self.path, other)
+        tokens.add(pythonSource(somePythonCode).scrubbed())
+        self.assertTrue('def' in uniqueTokens(other))
+        self.assertTrue('**' in uniqueTokens(other))
+        self.assertFalse('**' in uniqueTokens(self.path))
+    def tearDown(self):
+        shutil.rmtree(self.td)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,9 +30,12 @@ from unnaturalcode.unnaturalCode import *
 from unnaturalcode.sourceModel import *
 from unnaturalcode.pythonSource import *
 from unnaturalcode.mitlmCorpus import *
+from unnaturalcode.numpyCorpus import numpyCorpus
 from unnaturalcode.modelValidator import *
+from unnaturalcode.fixSearch import fixSearch
+from unnaturalcode.documentSession import documentSessions
 
-import os, os.path, zmq, sys, shutil, token, gc
+import os, os.path, zmq, sys, shutil, token, gc, threading
 from glob import glob
 from tempfile import *
 
@@ -40,6 +43,15 @@ from unnaturalcode.ucTestData import *
 
 ucGlobal = None
 
+class compiledPythonSource(pythonSource):
+    """pythonSource that checks itself by compiling."""
+    def check_syntax(self):
+        try:
+            compile(self.deLex(), '<fix>', 'exec')
+        except SyntaxError as e:
+            return (e.filename, e.lineno, None, e.text, type(e).__name__)
+        return (None, None, None, None, None)
+
 logging.getLogger(__name__).setLevel(logging.DEBUG)
 
 def setUpModule():
@@ -50,6 +62,48 @@ class testUcUtil(unittest.TestCase):
     def testToBool(self):
         self.assertFalse(toBool("false"), 'toBool false not false')
         self.assertTrue(toBool("true"), 'toBool true not true')
+    def testLruCache(self):
+        cache = lruCache(2)
+        computed = []
+        def compute(requests):
+            computed.extend(requests)
+            return [sum(r) for r in requests]
+        self.assertEquals(cache.lookup([[1, 2], [3], [1, 2]], 0, compute),
+                          [3, 3, 3])
+        self.assertEquals(computed, [[1, 2], [3]])
+        self.assertEquals((cache.hits, cache.misses), (0, 3))
+        self.assertEquals(cache.lookup([[3]], 0, compute), [3])
+        self.assertEquals(cache.hits, 1)
+        # [1, 2] is the least recently used, so it goes first.
+        cache.lookup([[4]], 0, compute)
+        self.assertEquals(len(cache), 2)
+        cache.lookup([[3], [1, 2]], 0, compute)
+        self.assertEquals(computed, [[1, 2], [3], [4], [1, 2]])
+        # A new generation starts from scratch.
+        cache.lookup([[3]], 1, compute)
+        self.assertEquals(computed[-1], [3])
+        self.assertEquals(len(cache), 1)
+    def testRwLock(self):
+        lock = rwLock()
+        with lock.reader():
+            with lock.reader():
+                self.assertEquals(lock.readers, 2)
+        written = []
+        def write():
+            with lock.writer():
+                written.append(True)
+        with lock.reader():
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer.join(0.1)
+            # The writer waits for the reader to finish.
+            self.assertEquals(written, [])
+            self.assertEquals(lock.writersWaiting, 1)
+            # Which can still read again without deadlocking.
+            with lock.reader():
+                self.assertEquals(lock.readers, 2)
+        writer.join()
+        self.assertEquals(written, [True])
 
 class testUnnaturalCode(unittest.TestCase):
     @classmethod
@@ -91,20 +145,6 @@ class testMitlmCorpus(unittest.TestCase):
         sm = sourceModel(cm=mitlmCorpus())
         self.assertEquals(sm.corpify(pythonSource(someLexemes)), 'print ( 1 + 2 ** 2 ) <ENDMARKER>')
 
-    def testParsePredictionResult(self):
-        parse = mitlmCorpus.parsePredictionResult
-        empty = ""
-        self.assertEquals(parse(empty, 2), [])
-        standard_results = (
-                "3.0\timport os <NEWLINE> import sys <NEWLINE> <COMMENT>\n"
-                "1.0\timport os <NEWLINE> import random <NEWLINE> print")
-        self.assertEquals(parse(standard_results, 2), [
-            (3.0, ['<NEWLINE>', 'import', 'sys', '<NEWLINE>', '<COMMENT>']),
-            (1.0, ['<NEWLINE>', 'import', 'random', '<NEWLINE>', 'print'])])
-        self.assertEquals(parse(standard_results, 3), [
-            (3.0, ['import', 'sys', '<NEWLINE>', '<COMMENT>']),
-            (1.0, ['import', 'random', '<NEWLINE>', 'print'])])
-
 
 class testSourceModelWithFiles(unittest.TestCase):
     @classmethod
@@ -140,6 +180,91 @@ class testSourceModelWithFiles(unittest.TestCase):
         self.sm.trainString(somePythonCode)
     def testTrainFile(self):
         self.sm.trainFile(testProject1File)
+    def testIncrementalTraining(self):
+        corpus = os.path.join(self.td, 'ucIncrementalCorpus')
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus,
+                         incremental=True, rebuildEvery=2)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        query = sm.stringifyAll(ucSource(someLexemes))
+        sm.trainString(lotsOfPythonCode)
+        cm.queryCorpus(query)
+        model = cm.mitlm
+        sm.trainString(somePythonCode)
+        self.assertEquals(cm.pending, 1)
+        cm.queryCorpus(query)
+        self.assertTrue(cm.mitlm is model)
+        sm.trainString(somePythonCode)
+        cm.queryCorpus(query)
+        self.assertFalse(cm.mitlm is model)
+        self.assertEquals(cm.pending, 0)
+        sm.release()
+    def testBackgroundRebuild(self):
+        corpus = os.path.join(self.td, 'ucBackgroundCorpus')
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus,
+                         background=True, debounce=0.1)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        query = sm.stringifyAll(ucSource(someLexemes))
+        sm.trainString(lotsOfPythonCode)
+        cm.waitForRebuild()
+        generation = cm.generation
+        model = cm.mitlm
+        sm.trainString(somePythonCode)
+        sm.trainString(somePythonCode)
+        # Still served by the old model until the rebuild lands.
+        cm.queryCorpus(query)
+        cm.waitForRebuild()
+        self.assertEquals(cm.generation, generation + 1)
+        self.assertFalse(cm.mitlm is model)
+        self.assertEquals(cm.pending, 0)
+        sm.release()
+    def testStaleRebuild(self):
+        corpus = os.path.join(self.td, 'ucStaleCorpus')
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus,
+                         background=True, debounce=0.1)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        sm.trainString(lotsOfPythonCode)
+        cm.waitForRebuild()
+        stale = cm.estimate()
+        sm.trainString(somePythonCode)
+        cm.waitForRebuild()
+        current = cm.current
+        # An estimate that finishes last but saw less doesn't replace it.
+        self.assertTrue(cm.swapMitlm(*stale) is current[0])
+        self.assertEquals(cm.current, current)
+        self.assertEquals(cm.pending, 0)
+        sm.release()
+    def testSnapshot(self):
+        corpus = os.path.join(self.td, 'ucSnapshotCorpus')
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        query = sm.stringifyAll(ucSource(someLexemes))
+        sm.trainString(lotsOfPythonCode)
+        estimated = cm.queryCorpus(query)
+        sm.release()
+        self.assertEquals(len(glob(corpus + '.*.lm')), 1)
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus)
+        self.assertAlmostEqual(cm.queryCorpus(query), estimated)
+        self.assertEquals(cm.mitlm.smoothing(), "snapshot")
+        cm.release()
+    def testTunedParameters(self):
+        corpus = os.path.join(self.td, 'ucTunedCorpus')
+        devCorpus = os.path.join(self.td, 'ucDevCorpus')
+        cm = mitlmCorpus(readCorpus=devCorpus, writeCorpus=devCorpus)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        sm.trainString(somePythonCode)
+        sm.release()
+        cm = mitlmCorpus(readCorpus=corpus, writeCorpus=corpus,
+                         devCorpus=devCorpus)
+        sm = sourceModel(cm=cm, language=pythonSource)
+        sm.trainString(lotsOfPythonCode)
+        cm.queryCorpus(sm.stringifyAll(ucSource(someLexemes)))
+        tuning = cm.loadTuning()
+        self.assertEquals(tuning['order'], cm.order)
+        self.assertEquals(list(cm.mitlm.params()), tuning['params'])
+        self.assertFalse(cm.needsTuning(tuning))
+        sm.trainString(lotsOfPythonCode)
+        self.assertTrue(cm.needsTuning(tuning))
+        sm.release()
     @unittest.skipIf(os.getenv("FAST", False), "Skipping slow tests...")
     def testTrainProject(self):
         self.sm.trainFile(testProjectFiles)
@@ -177,6 +302,65 @@ class testTrainedSourceModel(unittest.TestCase):
         r = self.cm.queryCorpus(self.sm.stringifyAll(ucSource(someLexemes)))
         self.assertGreater(r, 0.1)
         self.assertLess(r, 70.0)
+    def testQueryCorpusBatch(self):
+        ls = self.sm.stringifyAll(ucSource(someLexemes))
+        r = self.cm.queryCorpusBatch([ls, ls[1:]])
+        self.assertEquals(len(r), 2)
+        self.assertAlmostEqual(r[0], self.cm.queryCorpus(ls))
+        self.assertAlmostEqual(r[1], self.cm.queryCorpus(ls[1:]))
+        self.assertEquals(self.cm.queryCorpusBatch([]), [])
+        ids = self.cm.queryCorpusBatchIds([self.cm.internAll(ls),
+                                           self.cm.internAll(ls[1:])])
+        for entropy, expected in zip(ids, r):
+            self.assertAlmostEqual(entropy, expected)
+        # Strings are looked up in the same cache as ids.
+        hits = self.cm.windowCache.hits
+        self.cm.queryCorpus(ls)
+        self.assertEquals(self.cm.windowCache.hits, hits + 1)
+    def testQueryCorpusIds(self):
+        ls = self.sm.stringifyAll(ucSource(someLexemes))
+        ids = self.cm.internAll(ls)
+        self.assertEquals(list(self.cm.internAll(ls)), list(ids))
+        self.assertEquals(self.cm.tokenLogprobsIds(ids),
+                          self.cm.tokenLogprobs(ls))
+        r = self.cm.queryCorpusBatchIds([ids, ids[1:]])
+        self.assertEquals(len(r), 2)
+        self.assertGreater(r[0], 0.1)
+        self.assertLess(r[0], 70.0)
+        # Scored just like MITLM scores the same windows as strings.
+        windowlen = self.sm.windowSize
+        windows = [ls[i:i+windowlen] for i in range(0, len(ls) - windowlen + 1)]
+        r = self.cm.queryCorpusBatchIds([self.cm.internAll(w) for w in windows])
+        for window, entropy in zip(windows, r):
+            self.assertAlmostEqual(entropy, self.cm.mitlm.xentropy(
+                (" ".join(window)).encode("UTF-8")))
+    def testInternUnknown(self):
+        size = len(self.cm.words)
+        unk = list(self.cm.internAll([u'<unk>']))
+        self.assertEquals(list(self.cm.internAll([u'never-seen', u'nor-this'])),
+                          unk * 2)
+        self.assertEquals(len(self.cm.words), size)
+    def testPredictCorpus(self):
+        ls = self.sm.stringifyAll(ucSource(someLexemes))
+        predictions = self.cm.predictCorpus(ls[:3], 5)
+        self.assertEquals(len(predictions), 5)
+        for i in range(0, len(predictions)-1):
+            self.assertTrue(predictions[i][1] >= predictions[i+1][1])
+        self.assertEquals(self.cm.predictCorpusBatch([ls[:3], ls[:2]], 5),
+                          [predictions, self.cm.predictCorpus(ls[:2], 5)])
+    def testConcurrentQueries(self):
+        lexemes = self.sm.sourceToScrubbed(somePythonCodeFromProject)
+        serial = self.sm.windowedQuery(lexemes)
+        self.cm.windowCache = lruCache()
+        results = []
+        def query():
+            results.append(self.sm.windowedQuery(lexemes))
+        threads = [threading.Thread(target=query) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(results, [serial] * 4)
     def testQueryCorpusString(self):
         r = self.sm.queryString(somePythonCodeFromProject)
         self.assertLess(r, 70.0)
@@ -188,6 +372,15 @@ class testTrainedSourceModel(unittest.TestCase):
         debug(type(r[0][0]))
         self.assertLess(r[0][1], 70.0)
         self.assertGreater(r[0][1], 0.1)
+    def testUnwindowedQuery(self):
+        lexemes = pythonSource(somePythonCodeFromProject)
+        windows, tokens = self.sm.unwindowedQuery(lexemes)
+        scrubbed = lexemes.scrubbed()
+        self.assertEquals(len(windows), len(scrubbed))
+        self.assertEquals(len(tokens), len(scrubbed))
+        for i in range(0, len(tokens)-1):
+            self.assertTrue(tokens[i][1] >= tokens[i+1][1])
+            self.assertTrue(windows[i][1] >= windows[i+1][1])
     def testWorst(self):
         r = self.sm.worstWindows(pythonSource(somePythonCodeFromProject))
         for i in range(0, len(r)-2):
@@ -197,6 +390,196 @@ class testTrainedSourceModel(unittest.TestCase):
         self.sm.release()
         shutil.rmtree(self.td)
 
+class testNumpySourceModel(unittest.TestCase):
+    """sourceModel, fixSearch and documentSession on a numpyCorpus."""
+    def setUp(self):
+        self.td = mkdtemp(prefix='ucTest-')
+        self.corpus = os.path.join(self.td, 'ucCorpus')
+        self.cm = numpyCorpus(readCorpus=self.corpus, writeCorpus=self.corpus, order=4)
+        self.sm = sourceModel(cm=self.cm, language=pythonSource)
+        self.sm.trainString(lotsOfPythonCode)
+        self.query = self.sm.stringifyAll(ucSource(someLexemes))
+    def testTrainFiles(self):
+        files = testProjectFiles[:8]
+        models = []
+        for name in ('sequentialCorpus', 'parallelCorpus'):
+            corpus = os.path.join(self.td, name)
+            cm = numpyCorpus(readCorpus=corpus, writeCorpus=corpus, order=4)
+            models.append(sourceModel(cm=cm, language=pythonSource))
+        sequential, parallel = models
+        try:
+            sequential.trainFile(files)
+            parallel.trainFiles(files, workers=2)
+            for path in files:
+                query = self.sm.stringifyAll(
+                    self.sm.sourceToScrubbed(slurp(path)))
+                self.assertAlmostEqual(parallel.cm.queryCorpus(query),
+                                       sequential.cm.queryCorpus(query))
+            tokens = sequential.listOfUniqueTokens
+            self.assertEquals(sorted(parallel.listOfUniqueTokens.items()),
+                              sorted(tokens.items()))
+            for string in tokens.keys():
+                self.assertEquals(parallel.listOfUniqueTokens.count(string),
+                                  tokens.count(string))
+        finally:
+            for sm in models:
+                sm.release()
+    def testCandidates(self):
+        left = self.query[:2]
+        self.sm.candidates = 3
+        strings = self.sm.candidateStrings(left)
+        self.assertEquals(strings, [string for string, logprob
+                                    in self.cm.predictCorpus(left, k=3)])
+        tokens, qattempts = self.sm.candidateAttempts(left, ['2'])
+        self.assertEquals(qattempts.shape, (len(strings), len(left) + 2))
+        self.assertEquals([token[4] for token in tokens], strings)
+        self.sm.candidates = None
+        self.assertEquals(sorted(self.sm.candidateStrings(left)),
+                          sorted(self.sm.listOfUniqueTokens.keys()))
+    def testExpectedStrings(self):
+        lexemes = compiledPythonSource(
+            self.sm.sourceToScrubbed(lotsOfPythonCode))
+        colon = [i for i, l in enumerate(lexemes) if l[4] == ':'][0]
+        broken = copy(lexemes)
+        broken.pop(colon)
+        self.assertEquals(self.sm.expectedStrings(broken, colon), [':'])
+        self.assertEquals(self.sm.expectedStrings(broken, colon+1), [])
+        self.assertEquals(self.sm.expectedStrings(lexemes, colon), [])
+        left, right = self.sm.insertContext(broken, colon)
+        self.assertEquals(self.sm.candidatesAt(broken, colon, left), [':'])
+        self.assertEquals(self.sm.candidatesAt(broken, colon+1, left),
+                          self.sm.candidateStrings(left))
+        fix = self.sm.tryInsert(broken, colon)
+        self.assertEquals(fix[2:5], ("Insert", colon, lexemes[colon]))
+        # Any NAME will do after def, but only the likeliest are tried.
+        name = [i for i, l in enumerate(lexemes) if l[4] == 'def'][0] + 1
+        broken = copy(lexemes)
+        broken.pop(name)
+        names = self.sm.expectedStrings(broken, name)
+        left, right = self.sm.insertContext(broken, name)
+        self.sm.candidates = 2
+        self.assertTrue(len(names) > self.sm.candidates)
+        strings = self.sm.candidatesAt(broken, name, left)
+        self.assertTrue(0 < len(strings) <= self.sm.candidates)
+        self.assertTrue(set(strings) <= set(names))
+        self.assertTrue(lexemes[name][4] in strings)
+    def testFixSearch(self):
+        lexemes = compiledPythonSource(
+            self.sm.sourceToScrubbed(lotsOfPythonCode))
+        loci = [i for i, l in enumerate(lexemes) if l[4] == ')'][-1]
+        broken = copy(lexemes)
+        broken.pop(loci)
+        expected = self.sm.fixQuery(broken, broken[loci])
+        self.assertEquals(expected[2:5], ("Insert", loci, lexemes[loci]))
+        search = fixSearch(self.sm, processes=2, deadline=60)
+        try:
+            fix = search.fixQuery(broken, broken[loci])
+            attempts = search.scoreAttempts(broken, loci, None)
+        finally:
+            search.release()
+        self.assertFalse(("Replace", broken[loci][4])
+                         in [(op, string) for entropy, op, string in attempts])
+        self.assertTrue(fix[0])
+        self.assertEquals(fix[2:5], expected[2:5])
+        self.assertAlmostEqual(fix[5], expected[5])
+        self.assertEquals(fix[1].check_syntax()[4], None)
+    def testBeamFixQuery(self):
+        lexemes = compiledPythonSource(
+            self.sm.sourceToScrubbed(lotsOfPythonCode))
+        paren = [i for i, l in enumerate(lexemes) if l[4] == ')'][-1]
+        colon = [i for i, l in enumerate(lexemes) if l[4] == ':'][0]
+        broken = copy(lexemes)
+        broken.pop(paren)
+        broken.pop(colon)
+        self.assertFalse(self.sm.beamFixQuery(broken, edits=1)[0])
+        fix = self.sm.beamFixQuery(broken, edits=2)
+        self.assertTrue(fix[0])
+        # Either insert can come first; both put back what was taken out.
+        self.assertEquals([op for op, loci, token in fix[2]],
+                          ["Insert", "Insert"])
+        self.assertEquals([l[4] for l in fix[1]], [l[4] for l in lexemes])
+        self.assertEquals(fix[1].check_syntax()[4], None)
+        self.assertEquals(self.sm.beamFixQuery(broken, budget=0),
+                          (False, None, [], 1e70))
+    def testWindowScores(self):
+        lexemes = pythonSource(lotsOfPythonCode).scrubbed()
+        windowlen = self.sm.windowSize
+        ids = self.cm.internAll(self.sm.paddedStrings(
+            self.sm.stringifyAll(lexemes)))
+        windows, tokens = self.sm.windowEntropies(
+            self.cm.tokenLogprobsIds(ids))
+        windows = windows[windowlen:windowlen+len(lexemes)]
+        tokens = tokens[windowlen:windowlen+len(lexemes)]
+        # Lookups that don't line up with anything.
+        self.sm.SCORE_CHUNK = 7
+        scores = list(self.sm.windowScores(lexemes))
+        self.assertEquals([(start, end) for start, end, entropy in scores],
+                          [(max(0, i+1-windowlen), i+1)
+                           for i in range(0, len(lexemes))])
+        for (start, end, entropy), expected in zip(scores, windows):
+            self.assertAlmostEqual(entropy, expected)
+        scores = list(self.sm.tokenScores(lexemes))
+        self.assertEquals([(start, end) for start, end, entropy in scores],
+                          [(i, i+1) for i in range(0, len(lexemes))])
+        for (start, end, entropy), expected in zip(scores, tokens):
+            self.assertAlmostEqual(entropy, expected)
+        worst = self.sm.worstRegions(lexemes, 3, tokens=True)
+        self.assertEquals(worst, sorted(scores, key=lambda s: s[2],
+                                        reverse=True)[:3])
+        self.assertAlmostEqual(self.sm.worstRegions(lexemes, 1)[0][2],
+                               max(windows))
+    def testDocumentSession(self):
+        def assertSameRanking(ranking, text):
+            expected = self.sm.unwindowedQuery(pythonSource(text))[1]
+            self.assertEquals(len(ranking), len(expected))
+            # Dedents can start and end in the same place.
+            key = lambda (l, e): (l[2:4], l[4], e)
+            for (l, e), (el, ee) in zip(sorted(ranking, key=key),
+                                        sorted(expected, key=key)):
+                self.assertEquals(l, el)
+                self.assertAlmostEqual(e, ee)
+            entropies = [e for l, e in ranking]
+            self.assertEquals(entropies, sorted(entropies, reverse=True))
+            self.assertEquals(ranking[:5], list(ranking)[:5])
+            self.assertEquals(ranking[-1], list(ranking)[-1])
+        sessions = documentSessions(self.sm)
+        text = lotsOfPythonCode
+        assertSameRanking(sessions.update('doc', text), text)
+        session = sessions.sessions['doc']
+        # Small blocks, so that edits span several of them.
+        session.BLOCK = 7
+        assertSameRanking(session.rescore(), text)
+        edits = [
+            # Within a line.
+            (' in ', ' not in '),
+            # A line that becomes two.
+            (':\n', ':\n        r = r\n'),
+            # Opening a bracket that isn't closed until later.
+            ('(', '(\n'),
+            # Closing one that was never opened.
+            ('print', ') print'),
+            ('y\n', 'y\nr = 1\n'),
+            # And everything else.
+            (text, somePythonCode),
+        ]
+        before = sessions.update('doc', text)
+        for old, new in edits:
+            previous = text
+            text = text.replace(old, new, 1)
+            assertSameRanking(sessions.update('doc', text), text)
+            # Rankings don't change once they've been returned.
+            assertSameRanking(before, previous)
+            before = sessions.update('doc', text)
+        self.assertTrue(sessions.sessions['doc'] is session)
+        # Training on something makes everything score differently.
+        self.sm.trainString(somePythonCode)
+        assertSameRanking(sessions.update('doc', text), text)
+        sessions.close('doc')
+        self.assertFalse('doc' in sessions)
+    def tearDown(self):
+        self.sm.release()
+        shutil.rmtree(self.td)
+
 #@unittest.skipIf(os.getenv("FAST", False), "Skipping slow tests...")
 #class testValidatorLong(unittest.TestCase):
     #@classmethod
@@ -2,9 +2,15 @@
 
 import json
 import os
+import signal
 from unnaturalcode.http import make_app
+from unnaturalcode.http.prefork import PreforkServer
 import shutil
 import unittest
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
 
 from sh import pgrep, touch
 
@@ -186,6 +192,26 @@ class UnnaturalHTTPTestCase(unittest.TestCase):
         # ~/.unnaturalcode/pyCorpus!
         pass
 
+    def test_prefork(self):
+        server = PreforkServer(host='127.0.0.1', port=0, workers=2,
+                               interval=0.1)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                server.serve()
+            finally:
+                os._exit(0)
+        server.httpd.server_close()
+
+        try:
+            rv = urlopen('http://127.0.0.1:%d/py/' % server.port)
+            assert rv.getcode() == 200
+            resp = json.loads(rv.read().decode('UTF-8'))
+            assert resp['language'].lower() == 'python'
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            assert os.waitpid(pid, 0)[1] == 0
+
     @classmethod
     def tearDownClass(cls):
         # Delete the test corpus...
@@ -0,0 +1,493 @@
+#    Copyright 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scores documents that are being edited, like sourceModel.unwindowedQuery
+does, without starting over after every keystroke.
+
+A session keeps a document's lines, its scrubbed lexemes, the log-probability
+of each of them and the entropies of the windows over them. After an edit
+only the lines between the last place before it where lexing can start over
+(see ucSource.restarts) and the first one after it are lexed again, and
+only the tokens whose n-grams include a changed token are scored again. The
+windows around them are recomputed and spliced in with the rest, which is
+kept in blocks (see tokenBlocks) so that the tokens after an edit aren't
+copied or moved one by one. Each block keeps its tokens in order of entropy
+too, so ranking them all is a merge that only goes as far as it's read. So
+an edit costs about as much as it's big, not as much as the document is.
+
+documentSessions keeps the sessions of a sourceModel by document id.
+"""
+
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from heapq import merge
+from itertools import chain, islice, izip, repeat
+from logging import debug, info, warning, error
+import numpy as np
+
+from unnaturalcode.unnaturalCode import ucPos
+
+def moved(lexemes, shift):
+    """Copies of lexemes, shift lines further down. Padding stays None."""
+    if shift == 0:
+        return list(lexemes)
+    return [None if l is None else
+            l.__class__((l[0], l[1],
+                         ucPos((l.start.l + shift, l.start.c)),
+                         ucPos((l.end.l + shift, l.end.c)),
+                         l[4]))
+            for l in lexemes]
+
+def restartFlags(count, restarts):
+    """Which of count lexemes are in restarts, as an array."""
+    flags = np.zeros(count, dtype=bool)
+    flags[np.asarray([r for r in restarts if r < count],
+                     dtype=np.int64)] = True
+    return flags
+
+class tokenBlocks(object):
+    """
+    What a session knows about each token of a padded document: its lexeme
+    (None for padding), whether lexing can start over from it, its id,
+    log-probability, window entropy and unwindowed entropy. They are kept in
+    blocks of about size tokens, so replacing a run of tokens only copies the
+    blocks it's in. The lexemes in a block are stored shift lines above where
+    they really are, so moving everything after an edit down only changes
+    the shift of each block after it. orders has the indices of each
+    block's tokens, highest unwindowed entropy first.
+    """
+
+    FIELDS = ('lexemes', 'restarts', 'ids', 'logprobs', 'windows', 'unwindows')
+
+    def __init__(self, fields, size):
+        self.size = size
+        self.blocks = self.chunk(fields)
+        self.shifts = [0] * len(self.blocks['ids'])
+        self.orders = map(self.order, self.blocks['unwindows'])
+        self.locate()
+
+    def chunk(self, fields):
+        """fields cut into blocks, as a list of blocks for each field."""
+        cuts = range(0, len(fields['ids']), self.size) or [0]
+        return dict((f, [fields[f][i:i+self.size] for i in cuts])
+                    for f in self.FIELDS)
+
+    def order(self, unwindows):
+        """Indices of unwindows, highest first; ties stay in order."""
+        return np.argsort(-unwindows, kind='mergesort')
+
+    def locate(self):
+        """Work out where each block starts."""
+        self.starts = [0]
+        for ids in self.blocks['ids']:
+            self.starts.append(self.starts[-1] + len(ids))
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def find(self, i):
+        """The block token i is in, and where it is in that block."""
+        b = min(bisect_right(self.starts, i), len(self.shifts)) - 1
+        return (b, i - self.starts[b])
+
+    def line(self, i):
+        """The line token i starts on."""
+        b, j = self.find(i)
+        return self.blocks['lexemes'][b][j].start.l + self.shifts[b]
+
+    def lexeme(self, i):
+        """Token i's lexeme, where it really is."""
+        b, j = self.find(i)
+        return moved(self.blocks['lexemes'][b][j:j+1], self.shifts[b])[0]
+
+    def restartBefore(self, i):
+        """The last token before i lexing can start over from, or None."""
+        b, j = self.find(i)
+        while b >= 0:
+            found = np.flatnonzero(self.blocks['restarts'][b][:j])
+            if len(found):
+                return self.starts[b] + int(found[-1])
+            b -= 1
+            j = None
+        return None
+
+    def restartFrom(self, i):
+        """The first token from i on lexing can start over from, or None."""
+        b, j = self.find(i)
+        while b < len(self.shifts):
+            found = np.flatnonzero(self.blocks['restarts'][b][j:])
+            if len(found):
+                return self.starts[b] + j + int(found[0])
+            b += 1
+            j = 0
+        return None
+
+    def get(self, lo, hi):
+        """
+        Tokens lo to hi, as a dict of fields like the constructor takes, with
+        their lexemes where they really are.
+        """
+        first, i = self.find(lo)
+        last, j = self.find(hi)
+        pieces = dict((f, []) for f in self.FIELDS)
+        for b in range(first, last + 1):
+            begin = i if b == first else 0
+            end = j if b == last else len(self.blocks['ids'][b])
+            for f in self.FIELDS:
+                pieces[f].append(self.blocks[f][b][begin:end])
+            pieces['lexemes'][-1] = moved(pieces['lexemes'][-1],
+                                          self.shifts[b])
+        return self.joined(pieces)
+
+    def joined(self, pieces):
+        """Lists of pieces of each field, put together."""
+        return dict((f, list(chain.from_iterable(pieces[f]))
+                        if f == 'lexemes' else np.concatenate(pieces[f]))
+                    for f in self.FIELDS)
+
+    def replace(self, lo, hi, fields, shift):
+        """
+        Replace tokens lo to hi with fields, and move the lexemes after them
+        down shift lines.
+        """
+        first, i = self.find(lo)
+        last, j = self.find(hi)
+        # The rest of the blocks at either end go in with the new tokens.
+        before = self.get(self.starts[first], lo)
+        after = self.get(hi, self.starts[last+1])
+        after['lexemes'] = moved(after['lexemes'], shift)
+        chunks = self.chunk(self.joined(dict(
+            (f, (before[f], fields[f], after[f])) for f in self.FIELDS)))
+        for f in self.FIELDS:
+            self.blocks[f][first:last+1] = chunks[f]
+        added = len(chunks['ids'])
+        self.shifts[first:last+1] = [0] * added
+        self.orders[first:last+1] = map(self.order, chunks['unwindows'])
+        if shift:
+            for b in range(first + added, len(self.shifts)):
+                self.shifts[b] += shift
+        self.locate()
+
+    def ranked(self, lo, hi):
+        """Tokens lo to hi, highest unwindowed entropy first."""
+        return tokenRanking(self, lo, hi)
+
+class tokenRanking(object):
+    """
+    Tokens lo to hi of some tokenBlocks, as (lexeme, unwindowed entropy)
+    pairs, most unnatural first. The blocks are merged, and lexemes made, only
+    as far as it's read, so the first few are cheap however many there are.
+    It doesn't change when the blocks do.
+    """
+
+    def __init__(self, tokens, lo, hi):
+        self.lo = lo
+        self.hi = hi
+        # The blocks are replaced, never changed, so these are enough.
+        self.starts = list(tokens.starts)
+        self.shifts = list(tokens.shifts)
+        self.orders = list(tokens.orders)
+        self.lexemes = list(tokens.blocks['lexemes'])
+        self.unwindows = list(tokens.blocks['unwindows'])
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def block(self, b):
+        """Block b's tokens in range, as (-entropy, index, b, j), in order."""
+        start = self.starts[b]
+        order = self.orders[b]
+        order = order[(order >= self.lo - start) & (order < self.hi - start)]
+        return izip((-self.unwindows[b][order]).tolist(),
+                    (order + start).tolist(), repeat(b), order.tolist())
+
+    def __iter__(self):
+        for e, i, b, j in merge(*map(self.block, range(len(self.orders)))):
+            yield (moved(self.lexemes[b][j:j+1], self.shifts[b])[0], -e)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            start, stop, step = k.indices(len(self))
+            if step < 0:
+                return list(self)[k]
+            return list(islice(self, start, stop, step))
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError("ranking index out of range")
+        return next(islice(self, k, None))
+
+class documentSession(object):
+
+    # How many tokens are kept together; see tokenBlocks.
+    BLOCK = 512
+
+    def __init__(self, sm, text):
+        self.sm = sm
+        self.open(text)
+
+    def open(self, text):
+        """Lex and score all of text."""
+        self.lines = text.splitlines(True)
+        lexemes = self.sm.lang(text).scrubbed()
+        padding = [None] * self.sm.windowSize
+        return self.rescore({
+            'lexemes': padding + list(lexemes) + padding,
+            'restarts': np.concatenate((
+                np.zeros(len(padding), dtype=bool),
+                restartFlags(len(lexemes), lexemes.restarts()),
+                np.zeros(len(padding), dtype=bool))),
+            'ids': self.sm.cm.internAll(self.sm.paddedStrings(
+                self.sm.stringifyAll(lexemes))),
+        })
+
+    def rescore(self, fields=None):
+        """
+        Score every token again, e.g. because the model has changed. fields
+        are the lexemes, restarts and ids of every token, if they've changed
+        too.
+        """
+        if fields is None:
+            fields = self.tokens.get(0, len(self.tokens))
+        self.generation = self.sm.cm.generation
+        fields['logprobs'] = np.asarray(
+            self.sm.cm.tokenLogprobsIds(fields['ids']))
+        windows, unwindows = self.sm.windowEntropies(fields['logprobs'])
+        fields['windows'] = np.asarray(windows)
+        fields['unwindows'] = np.asarray(unwindows)
+        self.tokens = tokenBlocks(fields, self.BLOCK)
+        return self.ranking()
+
+    def ranking(self):
+        """
+        Every lexeme and its entropy, most unnatural first, like the second
+        half of sourceModel.unwindowedQuery. It's a tokenRanking, so only
+        what's read of it costs anything.
+        """
+        padding = self.sm.windowSize
+        return self.tokens.ranked(padding, padding + len(self))
+
+    def __len__(self):
+        """How many lexemes there are."""
+        return len(self.tokens) - 2*self.sm.windowSize
+
+    def lexeme(self, k):
+        """Lexeme k."""
+        return self.tokens.lexeme(self.sm.windowSize + k)
+
+    def firstOnLine(self, line):
+        """The index of the first lexeme that starts on or after line."""
+        padding = self.sm.windowSize
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.tokens.line(padding + mid) < line:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def restartBefore(self, line):
+        """
+        The last lexeme we can start lexing over from, up to line, or 0 for
+        the start of the code if there isn't one.
+        """
+        padding = self.sm.windowSize
+        r = self.tokens.restartBefore(padding + self.firstOnLine(line + 1))
+        if r is None:
+            return 0
+        return r - padding
+
+    def restartAfter(self, line):
+        """
+        The first lexeme after line we can start lexing over from, or the
+        number of lexemes if there isn't one.
+        """
+        padding = self.sm.windowSize
+        r = self.tokens.restartFrom(padding + self.firstOnLine(line + 1))
+        if r is None:
+            return len(self)
+        return r - padding
+
+    def relex(self, lines, start, end, shift):
+        """
+        Lexes lines (the edited document) from where lexeme start is to
+        where lexeme end is, which has moved down shift lines. Returns the
+        new lexemes and where lexing can start over in them, or None if
+        they don't stop where lexeme end starts.
+        """
+        first = self.lexeme(start).start.l if start > 0 else 1
+        if end == len(self):
+            region = self.sm.lang("".join(lines[first-1:])).scrubbed()
+            return (moved(region, first-1), region.restarts())
+        # Lex the line that lexeme end is on too, to check that it still
+        # starts over there.
+        stop = self.lexeme(end)
+        last = stop.start.l + shift
+        try:
+            region = self.sm.lang("".join(lines[first-1:last])).scrubbed()
+        except Exception:
+            return None
+        restart = (last - first + 1, stop.start.c)
+        restarts = region.restarts()
+        for k in restarts:
+            # ucPos's < is really <=.
+            if tuple(region[k].start) < restart:
+                continue
+            # Dedents start in the same place, before it.
+            if (tuple(region[k].start) == restart
+                and region[k][0:2] == stop[0:2]):
+                return (moved(region[:k], first-1),
+                        restarts[:restarts.index(k)])
+            return None
+        return None
+
+    def update(self, text):
+        """
+        Bring the session up to date with text, the whole of the document
+        after an edit, and return the new ranking.
+        """
+        if self.sm.cm.generation != self.generation:
+            return self.open(text)
+        old = self.lines
+        lines = text.splitlines(True)
+        # The lines that changed are the ones after the first p and before
+        # the last s. Lexing has to start over on a line that hasn't.
+        same = min(len(old), len(lines))
+        p = 0
+        while p < same and old[p] == lines[p]:
+            p += 1
+        s = 0
+        while s < same - p and old[-1-s] == lines[-1-s]:
+            s += 1
+        if p == len(old) and p == len(lines):
+            return self.ranking()
+        shift = len(lines) - len(old)
+        start = self.restartBefore(p)
+        end = self.restartAfter(len(old) - s)
+        while True:
+            relexed = self.relex(lines, start, end, shift)
+            if relexed is not None:
+                break
+            end = self.restartAfter(self.lexeme(end).start.l)
+        self.lines = lines
+        self.splice(start, end, relexed, shift)
+        return self.ranking()
+
+    def splice(self, start, end, relexed, shift):
+        """
+        Replace lexemes start to end with the ones relexed, move the ones
+        after down shift lines, and score the tokens that changed. Only the
+        tokens near the change are copied.
+        """
+        region, restarts = relexed
+        sm = self.sm
+        padding = sm.windowSize
+        old = sm.stringifyAll(
+            self.tokens.get(padding + start, padding + end)['lexemes'])
+        new = sm.stringifyAll(region)
+        # Only the tokens between a common prefix and suffix have changed.
+        same = min(len(old), len(new))
+        a = 0
+        while a < same and old[a] == new[a]:
+            a += 1
+        b = 0
+        while b < same - a and old[-1-b] == new[-1-b]:
+            b += 1
+        first = padding + start + a
+        removed = len(old) - a - b
+        added = sm.cm.internAll(new[a:len(new)-b])
+        grown = len(region) - (end - start)
+        # Where things are from here on is in the edited document.
+        n = len(self.tokens) + grown
+        # Tokens up to order-1 after a change have it in their n-grams.
+        context = sm.cm.order - 1
+        changed = min(n, first + len(added) + context)
+        scored = max(0, first - context)
+        # Windows over the changed tokens, and tokens in those windows.
+        windowlen = sm.windowSize
+        windowsEnd = min(n, changed + windowlen - 1)
+        unwindowsStart = max(0, first - windowlen + 1)
+        lo = min(max(0, first - 2*windowlen + 2), padding + start)
+        hi = max(min(n, changed + 2*windowlen - 2),
+                 padding + start + len(region))
+        tokens = self.tokens.get(lo, hi - grown)
+        ids = np.concatenate((tokens['ids'][:first-lo], added,
+                              tokens['ids'][first-lo+removed:]))
+        logprobs = np.asarray(sm.cm.tokenLogprobsIds(
+            ids[scored-lo:changed-lo]))
+        logprobs = np.concatenate((tokens['logprobs'][:first-lo],
+                                   logprobs[first-scored:],
+                                   tokens['logprobs'][changed-grown-lo:]))
+        windows, unwindows = map(np.asarray, sm.windowEntropies(logprobs))
+        self.tokens.replace(lo, hi - grown, {
+            'lexemes': (tokens['lexemes'][:padding+start-lo] + region
+                        + moved(tokens['lexemes'][padding+end-lo:], shift)),
+            'restarts': np.concatenate((
+                tokens['restarts'][:padding+start-lo],
+                restartFlags(len(region), restarts),
+                tokens['restarts'][padding+end-lo:])),
+            'ids': ids,
+            'logprobs': logprobs,
+            'windows': np.concatenate((
+                tokens['windows'][:first-lo],
+                windows[first-lo:windowsEnd-lo],
+                tokens['windows'][windowsEnd-grown-lo:])),
+            'unwindows': np.concatenate((
+                tokens['unwindows'][:unwindowsStart-lo],
+                unwindows[unwindowsStart-lo:windowsEnd-lo],
+                tokens['unwindows'][windowsEnd-grown-lo:])),
+        }, shift)
+
+class documentSessions(object):
+    """
+    The sessions of documents being scored with sm, by document id. Only
+    the size most recently used are kept.
+    """
+
+    def __init__(self, sm, size=64):
+        self.sm = sm
+        self.size = size
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def update(self, document, text):
+        """
+        The ranking of text, the whole of document after an edit, starting a
+        session for it if there isn't one.
+        """
+        with self.lock:
+            session = self.sessions.pop(document, None)
+            if session is None:
+                session = documentSession(self.sm, text)
+                ranking = session.ranking()
+            else:
+                ranking = session.update(text)
+            self.sessions[document] = session
+            while len(self.sessions) > self.size:
+                self.sessions.popitem(last=False)
+            return ranking
+
+    def close(self, document):
+        """Forget document's session, if it has one."""
+        with self.lock:
+            self.sessions.pop(document, None)
+
+    def __contains__(self, document):
+        return document in self.sessions
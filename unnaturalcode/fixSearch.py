@@ -0,0 +1,165 @@
+#    Copyright 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#    
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Searches for fixes like sourceModel.fixQuery, on a pool of worker processes.
+
+The workers are forked from a process that already holds the model, so they
+share it instead of loading their own. The candidate edits at the error are
+scored in chunks across all of them, then the best few are checked for
+validity (which may mean running a compiler) at the same time, and the best
+valid one wins.
+"""
+
+import time
+from multiprocessing import Pool, TimeoutError, cpu_count
+from operator import itemgetter
+from logging import debug, info, warning, error
+
+# The sourceModel of a worker process.
+workerModel = None
+
+def startWorker(sm):
+    global workerModel
+    workerModel = sm
+
+def scoreChunk(task):
+    """Entropies of left, then each string, then right."""
+    left, right, strings = task
+    return list(workerModel.cm.queryCorpusBatchIds(
+        workerModel.attemptIds(left, right, strings)))
+
+def checkAttempt(attempt):
+    return workerModel.isValid(attempt)
+
+class fixSearch(object):
+
+    def __init__(self, sm, processes=None, deadline=None, checks=None):
+        self.sm = sm
+        self.processes = (processes or cpu_count())
+        # Seconds a fixQuery may take, or None to wait for every check. The
+        # best valid fix found by then is returned.
+        self.deadline = deadline
+        # How many of the best scoring attempts are checked for validity.
+        self.checks = (checks or self.processes)
+        self.pool = None
+        self.start()
+
+    def start(self):
+        """
+        Loads the model and forks the workers. They see the model as it is
+        now; MITLM models trained after this need a restart to be seen.
+        """
+        # Any query loads the model, so the workers share it rather than
+        # each loading their own.
+        self.sm.cm.queryCorpus(self.sm.paddedStrings([]))
+        self.pool = Pool(self.processes, startWorker, (self.sm,))
+
+    def restart(self):
+        self.release()
+        self.start()
+
+    def remaining(self, end):
+        if end is None:
+            return None
+        return max(0.0, end - time.time())
+
+    def chunks(self, strings):
+        """strings split into (at most) one chunk per worker, in order."""
+        size = max(1, -(-len(strings) // self.processes))
+        return [strings[i:i+size] for i in range(0, len(strings), size)]
+
+    def scoreAttempts(self, lexemes, loci, end):
+        """
+        Every candidate edit at loci, as (entropy, op, string), or None if
+        the deadline passed first.
+        """
+        sm = self.sm
+        insertLeft, insertRight = sm.insertContext(lexemes, loci)
+        replaceLeft, replaceRight = sm.replaceContext(lexemes, loci)
+        expected = lexemes.expected()
+        inserts = sm.candidatesAt(lexemes, loci, insertLeft, expected)
+        # Replacing a token with itself isn't a fix.
+        current = lexemes[loci][4]
+        replaces = [string
+                    for string in sm.candidatesAt(lexemes, loci, replaceLeft,
+                                                  expected)
+                    if string != current]
+        tasks = ([(insertLeft, insertRight, chunk)
+                  for chunk in self.chunks(inserts)]
+                 + [(replaceLeft, replaceRight, chunk)
+                    for chunk in self.chunks(replaces)])
+        scoring = self.pool.map_async(scoreChunk, tasks)
+        # Deleting is just one query.
+        deleted = sm.cm.queryCorpus(replaceLeft + replaceRight)
+        try:
+            scores = [score for chunk in scoring.get(self.remaining(end))
+                      for score in chunk]
+        except TimeoutError:
+            return None
+        return ([(deleted, "Delete", None)]
+                + [(score, "Insert", string)
+                   for string, score in zip(inserts, scores[:len(inserts)])]
+                + [(score, "Replace", string)
+                   for string, score in zip(replaces, scores[len(inserts):])])
+
+    def fixQuery(self, lexemes, location):
+        """
+        Like sourceModel.fixQuery: (valid, fixed lexemes, op, loci, token,
+        entropy) for the best valid fix, or a "None" fix if there isn't one
+        (or it couldn't be found in time).
+        """
+        sm = self.sm
+        end = None if self.deadline is None else time.time() + self.deadline
+        loci = sm.findLocus(lexemes, location)
+        none = (False, None, "None", loci, None, 1e70)
+        attempts = self.scoreAttempts(lexemes, loci, end)
+        if attempts is None:
+            warning("Ran out of time scoring fixes at %s" % (location.start,))
+            # Don't leave the next request queued behind this one.
+            self.restart()
+            return none
+        attempts = sorted(attempts, key=itemgetter(0))[:self.checks]
+        checking = []
+        for entropy, op, string in attempts:
+            token = (lexemes[loci] if op == "Delete"
+                     else sm.listOfUniqueTokens[string])
+            attempt = sm.applyFix(lexemes, op, loci, token)
+            if op != "Delete":
+                token = attempt[loci]
+            checking.append(((True, attempt, op, loci, token, entropy),
+                             self.pool.apply_async(checkAttempt, (attempt,))))
+        best = none
+        timedOut = False
+        for fix, result in checking:
+            try:
+                if result.get(self.remaining(end)):
+                    best = fix
+                    break
+            except TimeoutError:
+                timedOut = True
+        if timedOut:
+            warning("Ran out of time checking fixes at %s" % (location.start,))
+            self.restart()
+        return best
+
+    def release(self):
+        """Stops the workers."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
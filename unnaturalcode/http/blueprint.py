@@ -26,7 +26,7 @@ import shutil
 import os
 
 from api_utils import get_corpus_or_404, get_string_content
-from flask import Flask, make_response, jsonify, Blueprint
+from flask import Flask, make_response, jsonify, Blueprint, abort, request
 from flask.ext.cors import cross_origin, CORS
 from token_fmt import parse_tokens
 
@@ -90,15 +90,48 @@ def cross_entropy(corpus_name):
 def windowed_cross_entropy(corpus_name):
     """
     POST /{corpus}/xentropy/
+    POST /{corpus}/wxentropy?k=...
 
     Calculate the cross-entropy of the uploaded file with respect to the
-    corpus.
+    corpus. With k, only the k worst windows, which works for files of any
+    size.
     """
     corpus = get_corpus_or_404(corpus_name)
     content = get_string_content()
     tokens = corpus.tokenize(content)
+    k = request.values.get('k', type=int)
+    if k is not None:
+        return jsonify(worst_windows=corpus.worst_windows(tokens, k))
     return jsonify(windowed_cross_entropy=corpus.windowed_cross_entropy(tokens))
 
+@app.route('/<corpus_name>/session/<document>', methods=('POST',))
+@cross_origin()
+def session_entropy(corpus_name, document):
+    """
+    POST /{corpus}/session/{document}
+    POST /{corpus}/session/{document}?k=...
+
+    Calculate the entropy of each token of the uploaded file, which is the
+    whole of document after an edit. Only what changed since the document
+    was last uploaded is scored again. With k, only the k worst tokens.
+    """
+    corpus = get_corpus_or_404(corpus_name)
+    if not hasattr(corpus, 'session_entropy'):
+        abort(404)
+    content = get_string_content()
+    k = request.values.get('k', type=int)
+    return jsonify(entropies=corpus.session_entropy(document, content, k))
+
+@app.route('/<corpus_name>/session/<document>', methods=('DELETE',))
+def close_session(corpus_name, document):
+    corpus = get_corpus_or_404(corpus_name)
+    if not hasattr(corpus, 'close_session'):
+        abort(404)
+    corpus.close_session(document)
+
+    # Successful response with no content.
+    return '', 204, {}
+
 @app.route('/<corpus_name>/', methods=('POST',))
 def train(corpus_name):
     """
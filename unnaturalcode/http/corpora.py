@@ -26,6 +26,7 @@ import os
 import shutil
 
 from unnaturalcode import ucUser
+from unnaturalcode.documentSession import documentSessions
 
 from flask.json import loads as unjson
 
@@ -48,7 +49,8 @@ class GenericCorpus(object):
     # Get the singleton instance of the underlying Python language (source)
     # model.
     # [sigh]... this API.
-    _user = ucUser.genericUser(ngram_order=CAMPBELL_NGRAM_ORDER)
+    _user = ucUser.genericUser(ngram_order=CAMPBELL_NGRAM_ORDER,
+                               incremental=True, background=True)
     _sourceModel = _user.sm
     _lang = _sourceModel.lang()
     _mitlm = _sourceModel.cm
@@ -79,10 +81,11 @@ class GenericCorpus(object):
         """
         Trains the language model with tokens -- precious tokens!
         Updates last_updated as a side-effect.
+
+        The model is re-estimated in the background shortly after training
+        stops; predictions keep using the previous model until then.
         """
-        returnv = self._sourceModel.trainLexemes(tokens)
-        self._mitlm.stopMitlm()
-        return returnv
+        return self._sourceModel.trainLexemes(tokens)
 
     def predict(self, tokens):
         """
@@ -122,6 +125,17 @@ class GenericCorpus(object):
         """
         return self._sourceModel.windowedQuery(tokens, returnWindows=False)
 
+    def worst_windows(self, tokens, k):
+        """
+        Returns the k windows of the given token string with the highest
+        cross entropy, worst first, as dicts of where each starts and ends
+        and its entropy. Only k of them are ever kept.
+        """
+        return [{'start': tokens[start][2], 'end': tokens[end-1][3],
+                 'entropy': entropy}
+                for start, end, entropy
+                in self._sourceModel.worstRegions(tokens, k)]
+
     def reset(self):
         # Ask MITLM politely to relinquish its resources and halt.
         self._mitlm.release()
@@ -144,7 +158,8 @@ class PythonCorpus(GenericCorpus):
     # Get the singleton instance of the underlying Python language (source)
     # model.
     # [sigh]... this API.
-    _user = ucUser.pyUser(ngram_order=GOOD_ENOUGH_NGRAM_ORDER)
+    _user = ucUser.pyUser(ngram_order=GOOD_ENOUGH_NGRAM_ORDER,
+                          incremental=True, background=True)
     _sourceModel = _user.sm
     _lang = _sourceModel.lang()
     _mitlm = _sourceModel.cm
@@ -153,6 +168,10 @@ class PythonCorpus(GenericCorpus):
     # Hard-coded because "it's the best! the best a language model can get!"
     smoothing = 'ModKN'
 
+    # Documents being edited, which are only rescored where they change.
+    # Every worker has its own.
+    _sessions = documentSessions(_sourceModel)
+
     def tokenize(self, string, mid_line=True):
         """
         Tokenizes the given string in the manner appropriate for this
@@ -160,6 +179,24 @@ class PythonCorpus(GenericCorpus):
         """
         return self._lang.lex(string, mid_line)
 
+    def session_entropy(self, document, string, k=None):
+        """
+        Returns a list of each token in string, the whole of document after
+        an edit, and its entropy, most unnatural first; with k, only the
+        first k. Only what changed since the last time document was sent is
+        scored again.
+        """
+        ranking = self._sessions.update(document, string)
+        if k is not None:
+            return ranking[:k]
+        return list(ranking)
+
+    def close_session(self, document):
+        """
+        Forgets document.
+        """
+        self._sessions.close(document)
+
 CORPORA = {
     'py': PythonCorpus(),
     'generic' : GenericCorpus()
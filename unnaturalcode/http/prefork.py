@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014  Eddie Antonio Santos
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Serves the HTTP API from a pool of pre-forked workers.
+
+The models of every corpus are estimated (or loaded from their snapshots)
+once, in the supervisor, before any worker is forked. Workers share those
+pages copy-on-write instead of each building a copy of their own, so memory
+no longer grows with the number of workers.
+
+Workers never re-estimate a model. Training they receive is appended to the
+corpus, and once the corpus has been quiet for a moment the supervisor
+rebuilds the models and replaces the workers with ones forked from the new
+models. SIGHUP does the same right away. Workers that die are restarted.
+
+    python -m unnaturalcode.http.prefork --workers 4 --port 5000
+"""
+
+import argparse
+import errno
+import logging
+import os
+import signal
+import sys
+import time
+from logging import info, warning, error
+from wsgiref.simple_server import make_server
+
+from .app import make_app
+from .corpora import CORPORA
+
+__all__ = ['PreforkServer', 'main']
+
+
+class PreforkServer(object):
+    """
+    Supervises a pool of workers that all accept connections on one
+    listening socket.
+    """
+
+    def __init__(self, app=None, host='0.0.0.0', port=5000, workers=4,
+                 corpora=None, interval=1.0, debounce=None):
+        self.app = app if app is not None else make_app()
+        self.corpora = corpora if corpora is not None else CORPORA
+        self.workers = workers
+        # How often the supervisor checks on workers and corpora.
+        self.interval = interval
+        # How long a corpus must go untouched before it's re-estimated.
+        if debounce is None:
+            debounce = max([model.debounce for model in self.models()] + [0])
+        self.debounce = debounce
+
+        # Bound before forking; every worker accepts on this socket.
+        self.httpd = make_server(host, port, self.app)
+        self.httpd.timeout = interval
+        self.port = self.httpd.server_port
+
+        # pid -> the generation of models the worker was forked with.
+        self.pids = {}
+        self.generation = 0
+        self.stats = {}
+        self.running = False
+        self.reload_requested = False
+
+    def models(self):
+        "Returns the mitlmCorpus behind every corpus we serve."
+        return [corpus._mitlm for corpus in self.corpora.values()]
+
+    def unique_tokens(self):
+        "Returns the unique tokens of every corpus we serve."
+        return [corpus._sourceModel.listOfUniqueTokens
+                for corpus in self.corpora.values()]
+
+    def corpus_stats(self):
+        "Returns the size and mtime of every corpus file."
+        stats = {}
+        for model in self.models():
+            try:
+                st = os.stat(model.readCorpus)
+                stats[model.readCorpus] = (st.st_size, st.st_mtime)
+            except OSError:
+                stats[model.readCorpus] = None
+        return stats
+
+    def warm(self):
+        """
+        Estimates (or loads) every model here, so that workers inherit them
+        instead of building their own.
+        """
+        for model in self.models():
+            model.handOffRebuilds()
+        self.stats = self.corpus_stats()
+        for model in self.models():
+            model.startMitlm()
+        for tokens in self.unique_tokens():
+            tokens.load()
+
+    def stale(self):
+        """
+        Whether the corpora have been trained on since the models were
+        estimated, and have been quiet for long enough to estimate them again.
+        """
+        stats = self.corpus_stats()
+        if stats == self.stats:
+            return False
+        mtimes = [stat[1] for stat in stats.values() if stat is not None]
+        return not mtimes or time.time() - max(mtimes) >= self.debounce
+
+    def reload(self):
+        """
+        Re-estimates the models, re-reads the unique tokens the workers
+        appended, and replaces every worker.
+        """
+        # Anything written while we estimate will trigger another reload.
+        stats = self.corpus_stats()
+        try:
+            for model in self.models():
+                model.rebuild()
+            for tokens in self.unique_tokens():
+                tokens.reload()
+        except Exception:
+            error("Rebuilding the models failed; keeping the old workers.",
+                  exc_info=sys.exc_info())
+            self.stats = stats
+            return
+        self.stats = stats
+        self.generation += 1
+        retired = list(self.pids)
+        self.fill()
+        # Old workers finish the request they're on, then exit.
+        for pid in retired:
+            self.signal_worker(pid, signal.SIGTERM)
+        info("Reloaded models; now on generation %d." % self.generation)
+
+    def fill(self):
+        "Forks workers until there are enough on the current generation."
+        current = [pid for pid, generation in self.pids.items()
+                   if generation == self.generation]
+        for i in range(self.workers - len(current)):
+            self.spawn()
+
+    def spawn(self):
+        "Forks a worker."
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = self.generation
+            return pid
+        status = 0
+        try:
+            self.work()
+        except Exception:
+            error("Worker crashed.", exc_info=sys.exc_info())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def work(self):
+        "The worker's main loop."
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.pids = {}
+        self.running = True
+        while self.running:
+            # Returns after at most self.interval, so we notice SIGTERM.
+            self.httpd.handle_request()
+
+    def reap(self):
+        "Collects workers that have exited."
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            generation = self.pids.pop(pid, None)
+            if generation == self.generation and self.running:
+                warning("Worker %d died with status %d; restarting it."
+                        % (pid, status))
+
+    def signal_worker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def stop(self, signum=None, frame=None):
+        self.running = False
+
+    def request_reload(self, signum=None, frame=None):
+        self.reload_requested = True
+
+    def serve(self):
+        "Warms up the models, forks the workers and supervises them."
+        self.warm()
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.request_reload)
+        self.fill()
+        info("Serving on port %d with %d workers." % (self.port, self.workers))
+        try:
+            while self.running:
+                time.sleep(self.interval)
+                self.reap()
+                if not self.running:
+                    break
+                if self.reload_requested or self.stale():
+                    self.reload_requested = False
+                    self.reload()
+                self.fill()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        "Stops every worker and waits for them."
+        for pid in list(self.pids):
+            self.signal_worker(pid, signal.SIGTERM)
+        for pid in list(self.pids):
+            try:
+                os.waitpid(pid, 0)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+            del self.pids[pid]
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the UnnaturalCode HTTP API from pre-forked workers.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Number of worker processes')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    PreforkServer(host=args.host, port=args.port,
+                  workers=args.workers).serve()
+
+if __name__ == '__main__':
+    exit(main())
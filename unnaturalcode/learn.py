@@ -27,10 +27,12 @@ def main():
 
   parser.add_argument('files', metavar='file', type=str, nargs='+',
                     help='A file to be added.')
+  parser.add_argument('-j', '--workers', type=int, default=None,
+                    help='Lex files on this many processes (default: one per core).')
 
   args = parser.parse_args()
 
-  ucpy.sm.trainFile(args.files)
+  ucpy.sm.trainFiles(args.files, workers=args.workers)
 
   ucpy.release()
   
@@ -23,6 +23,14 @@ from unnaturalcode.unnaturalCode import *
 import logging
 from logging import debug, info, warning, error, getLogger
 import codecs
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from glob import glob
+import numpy as np
 import pymitlm
 
 allWhitespace = re.compile('^\s+$')
@@ -36,23 +44,367 @@ mitlmLogger.setLevel(logging.DEBUG)
 class mitlmCorpus(object):
     """
     Interface to an MITLM corpus.
+
+    Incremental mode is deferred rebuilding, not incremental training: the
+    counts of the model in memory are never updated. Trained lines are only
+    appended to the corpus on disk, and queries keep being answered by the
+    old model, which is stale by up to rebuildEvery lines, until the model
+    is re-estimated from the whole corpus.
     """
 
-    def __init__(self, readCorpus=None, writeCorpus=None, uc=unnaturalCode(), order=10):
+    # How many lines addManyToCorpus writes each time it takes corpusLock.
+    WRITE_BATCH = 1024
+
+    def __init__(self, readCorpus=None, writeCorpus=None, uc=unnaturalCode(), order=10,
+                 incremental=None, rebuildEvery=None, background=None,
+                 debounce=None, snapshots=None, devCorpus=None,
+                 retuneDrift=None, windowCache=None, threads=None):
         self.readCorpus = (readCorpus or os.getenv("ucCorpus", "/tmp/ucCorpus"))
         self.writeCorpus = (writeCorpus or os.getenv("ucWriteCorpus", self.readCorpus))
         self.corpusFile = False
         self.order = order
         self.mitlm = None
+        # The model and its generation, swapped together.
+        self.current = (None, 0)
+        # In incremental mode training doesn't throw the model away: lines
+        # are appended to the corpus and the old model keeps serving queries
+        # until rebuildEvery lines have piled up, then it is re-estimated
+        # once for the whole batch. 0 re-estimates before the next query.
+        if incremental is None:
+            incremental = toBool(os.getenv("ucIncremental", "false"))
+        self.incremental = incremental
+        if rebuildEvery is None:
+            rebuildEvery = int(os.getenv("ucRebuildEvery", "100"))
+        self.rebuildEvery = rebuildEvery
+        # Lines appended to the corpus by this process, and how many of them
+        # the current model was estimated from. Both under corpusLock.
+        self.appended = 0
+        self.estimated = 0
+        # In background mode the new model is estimated on a worker thread
+        # while queries are still answered by the old one, and swapped in
+        # when it is ready. A burst of training calls within debounce seconds
+        # of each other only causes one rebuild.
+        if background is None:
+            background = toBool(os.getenv("ucBackgroundRebuild", "false"))
+        self.background = background
+        if debounce is None:
+            debounce = float(os.getenv("ucRebuildDebounce", "1.0"))
+        self.debounce = debounce
+        self.rebuildTimer = None
+        # Only one background rebuild runs at a time. Training while it runs
+        # starts the timer again once it's done.
+        self.rebuilding = False
+        self.rescheduled = False
+        # Set by handOffRebuilds in processes that share a model estimated
+        # by somebody else.
+        self.handedOff = False
+        # Bumped every time a new model is swapped in.
+        self.generation = 0
+        self.corpusLock = threading.Lock()
+        self.swapLock = threading.Lock()
+        self.rebuildLock = threading.RLock()
+        # Queries hold this for reading while they use the model, swaps hold
+        # it for writing, so a model is never replaced under a query.
+        self.modelLock = rwLock()
+        # Estimated models are saved next to the corpus, named after a hash
+        # of its contents, so the next process to start on an unchanged
+        # corpus can load one instead of estimating it again.
+        if snapshots is None:
+            snapshots = toBool(os.getenv("ucSnapshots", "true"))
+        self.snapshots = snapshots
+        # Tuned smoothing parameters are cached next to the corpus and
+        # reused until the corpus size drifts by more than retuneDrift
+        # (a fraction of the size it was tuned at). Tuning needs a held out
+        # development corpus; without one the default parameters are used.
+        self.devCorpus = (devCorpus or os.getenv("ucDevCorpus", None))
+        if retuneDrift is None:
+            retuneDrift = float(os.getenv("ucRetuneDrift", "0.5"))
+        self.retuneDrift = retuneDrift
+        # Every lexeme string the model knows gets a permanent id, so
+        # callers can look strings up once and pass arrays of ids around.
+        # Strings it doesn't know all get the id of <unk>. modelIndices maps
+        # ids to the vocabulary indices of the model in indexedMitlm, and is
+        # rebuilt when a new model is swapped in.
+        self.vocab = {u'<unk>': 0}
+        self.words = [u'<unk>']
+        self.modelIndices = np.zeros(0, dtype=np.int64)
+        self.indexedMitlm = None
+        # Scores of recently queried windows, for this generation.
+        self.windowCache = lruCache(windowCache)
+        self.vocabLock = threading.Lock()
+        # Big batches of windows are split across this many threads. PyMitlm
+        # releases the GIL and scores them holding its lock for reading, so
+        # the threads really do run at the same time.
+        self.threads = (threads or int(os.getenv("ucQueryThreads", "1")))
+        self.pool = None
+        self.poolLock = threading.Lock()
 
     def startMitlm(self):
         """
         Called automatically. Initializes MITLM, however we're interfacing to
-        it nowadays.
+        it nowadays. Returns the model that queries should use.
+        """
+        mitlm = self.mitlm
+        if mitlm is None or self.due():
+            with self.rebuildLock:
+                # Another thread may have rebuilt it while we were waiting.
+                mitlm = self.mitlm
+                if mitlm is None or self.due():
+                    mitlm = self.rebuild()
+        return mitlm
+
+    @property
+    def pending(self):
+        """Lines appended since the lines the current model was estimated from."""
+        with self.corpusLock:
+            return self.appended - self.estimated
+
+    def due(self):
+        """Whether enough training has piled up to rebuild right away."""
+        if self.background or self.handedOff:
+            return False
+        pending = self.pending
+        return pending > 0 and pending >= self.rebuildEvery
+
+    @contextmanager
+    def reading(self):
+        """
+        Gives the model and its generation, and keeps them from being swapped
+        out until the with block is done.
+        """
+        while True:
+            self.startMitlm()
+            with self.modelLock.reader():
+                mitlm, generation = self.current
+                if mitlm is not None:
+                    yield (mitlm, generation)
+                    return
+
+    def estimate(self, tune=False):
+        """
+        Estimate a new model from the corpus as it is on disk now. If tune is
+        set (or the corpus has drifted too far from the one the cached
+        parameters were tuned on) the smoothing parameters are tuned against
+        the development corpus first.
+        """
+        with self.corpusLock:
+            if self.corpusFile:
+                self.corpusFile.flush()
+            appended = self.appended
+        tuning = self.loadTuning()
+        params = tuning and tuning['params']
+        tune = tune or self.needsTuning(tuning)
+        snapshot = None
+        if self.snapshots and not tune:
+            snapshot = self.snapshotPath(self.corpusDigest(params))
+            if os.path.exists(snapshot):
+                try:
+                    return (pymitlm.PyMitlm(snapshot, self.order), appended)
+                except Exception:
+                    warning("Couldn't load snapshot %s, re-estimating." % snapshot,
+                            exc_info=sys.exc_info())
+        mitlm = pymitlm.PyMitlm(self.readCorpus, self.order,
+                                "KN", True, params or [])
+        if tune:
+            params = self.tune(mitlm)
+            snapshot = None
+        if self.snapshots:
+            snapshot = snapshot or self.snapshotPath(self.corpusDigest(params))
+            self.saveSnapshot(mitlm, snapshot)
+        return (mitlm, appended)
+
+    def tuningPath(self):
+        return self.readCorpus + ".params"
+
+    def loadTuning(self):
+        """
+        Returns the cached tuning for this corpus and order, or None if
+        there is none.
+        """
+        try:
+            with open(self.tuningPath()) as f:
+                tuning = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if tuning.get('order') != self.order or tuning.get('smoothing') != "KN":
+            return None
+        return tuning
+
+    def needsTuning(self, tuning):
+        """
+        Whether the cached parameters are missing or were tuned on a corpus
+        that has since grown or shrunk by more than retuneDrift. Never true
+        without a development corpus to tune against.
+        """
+        if self.devCorpus is None:
+            return False
+        if tuning is None:
+            return True
+        tunedSize = tuning['corpusSize']
+        size = os.path.getsize(self.readCorpus)
+        return abs(size - tunedSize) > self.retuneDrift * max(tunedSize, 1)
+
+    def tune(self, mitlm):
+        """Tune mitlm on the development corpus and cache the parameters."""
+        assert self.devCorpus is not None, "No development corpus to tune on."
+        entropy = mitlm.optimize(self.devCorpus)
+        params = list(mitlm.params())
+        info("Tuned %s on %s: entropy %f" % (self.readCorpus, self.devCorpus,
+                                             entropy))
+        tuning = {
+            'order': self.order,
+            'smoothing': "KN",
+            'corpusSize': os.path.getsize(self.readCorpus),
+            'devCorpus': self.devCorpus,
+            'entropy': entropy,
+            'params': params,
+        }
+        tmp = "%s.%d.tmp" % (self.tuningPath(), os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(tuning, f)
+        os.rename(tmp, self.tuningPath())
+        return params
+
+    def tuneParameters(self, devCorpus=None):
         """
-        if self.mitlm == None:
-            self.mitlm = pymitlm.PyMitlm(self.readCorpus, self.order,
-                                         "KN", True)
+        Tune the smoothing parameters now, on devCorpus if given, and swap in
+        the re-estimated model.
+        """
+        if devCorpus is not None:
+            self.devCorpus = devCorpus
+        return self.swapMitlm(*self.estimate(tune=True))
+
+    def corpusDigest(self, params=None):
+        """
+        Hash of the corpus contents and of everything else the estimated
+        model depends on.
+        """
+        h = hashlib.sha1()
+        h.update("order=%d smoothing=KN params=%s\n" % (self.order,
+            ",".join(repr(float(p)) for p in (params or []))))
+        with open(self.readCorpus, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def snapshotPath(self, digest):
+        return "%s.%s.lm" % (self.readCorpus, digest)
+
+    def saveSnapshot(self, mitlm, snapshot):
+        """
+        Save mitlm as snapshot and remove snapshots of older versions of the
+        corpus. Written to a temporary file first so that another process
+        never loads half a snapshot.
+        """
+        tmp = "%s.%d.tmp" % (snapshot, os.getpid())
+        try:
+            mitlm.save(tmp)
+            os.rename(tmp, snapshot)
+        except Exception:
+            warning("Couldn't save snapshot %s." % snapshot,
+                    exc_info=sys.exc_info())
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        for stale in glob(self.snapshotPath('*')):
+            if stale != snapshot:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def swapMitlm(self, mitlm, appended):
+        """
+        Atomically replace the model queries are using with mitlm, estimated
+        from the first appended lines this process added to the corpus.
+        Waits for queries that are using the old one. A model estimated from
+        less of the corpus than the one in use is thrown away instead, and
+        the one in use is returned.
+        """
+        with self.modelLock.writer():
+            with self.corpusLock:
+                if appended < self.estimated and self.mitlm is not None:
+                    return self.mitlm
+                self.estimated = appended
+            self.mitlm = mitlm
+            self.generation += 1
+            self.current = (mitlm, self.generation)
+        return mitlm
+
+    def rebuild(self):
+        """
+        Re-estimate the model from the corpus right now, picking up any lines
+        that were added since it was last estimated.
+        """
+        with self.rebuildLock:
+            return self.swapMitlm(*self.estimate())
+
+    def scheduleRebuild(self):
+        """
+        Start (or restart) the debounce timer for a background rebuild. If
+        one is already running the timer is started again when it's done.
+        """
+        with self.swapLock:
+            if self.rebuilding:
+                self.rescheduled = True
+                return
+            self.startTimer()
+
+    def startTimer(self):
+        """Called with swapLock held."""
+        if self.rebuildTimer is not None:
+            self.rebuildTimer.cancel()
+        self.rebuildTimer = threading.Timer(self.debounce,
+                                            self.backgroundRebuild)
+        self.rebuildTimer.daemon = True
+        self.rebuildTimer.start()
+
+    def backgroundRebuild(self):
+        """Runs on the timer thread."""
+        with self.swapLock:
+            if self.rebuilding:
+                self.rescheduled = True
+                return
+            self.rebuilding = True
+        try:
+            self.rebuild()
+        except Exception:
+            error("Background MITLM rebuild failed.", exc_info=sys.exc_info())
+        finally:
+            with self.swapLock:
+                self.rebuilding = False
+                if self.rescheduled:
+                    self.rescheduled = False
+                    self.startTimer()
+
+    def waitForRebuild(self):
+        """
+        Block until scheduled background rebuilds (if any), including the
+        ones scheduled while they ran, are done.
+        """
+        while True:
+            with self.swapLock:
+                timer = self.rebuildTimer
+            if timer is None:
+                return
+            timer.join()
+            with self.swapLock:
+                if self.rebuildTimer is timer:
+                    return
+
+    def handOffRebuilds(self):
+        """
+        Stop re-estimating the model in this process. Training is still
+        appended to the corpus, and flushed right away so that the process
+        that does estimate the model (see unnaturalcode.http.prefork) sees it.
+        """
+        self.handedOff = True
+
+    def stopMitlm(self):
+        """Throw out the model. The next query will re-estimate it."""
+        with self.modelLock.writer():
+            self.mitlm = None
+            self.current = (None, self.generation)
 
     def corpify(self, lexemes):
         """Stringify lexed source: produce space-seperated sequence of lexemes"""
@@ -82,30 +434,224 @@ class mitlmCorpus(object):
         cl = self.corpify(lexemes)
         assert(len(cl))
         assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
-        print(cl, file=self.corpusFile)
-        self.corpusFile.flush()
-        # MITLM cannot (as of now) update its model, so just throw out the old
-        # one.
-        self.mitlm = None
+        with self.corpusLock:
+            # Flushed when the model is rebuilt or the corpus is closed.
+            print(cl, file=self.corpusFile)
+            self.appended += 1
+        if self.handedOff:
+            with self.corpusLock:
+                self.corpusFile.flush()
+        elif self.background:
+            self.scheduleRebuild()
+        elif not self.incremental:
+            self.corpusFile.flush()
+            # MITLM cannot (as of now) update its model, so just throw out
+            # the old one.
+            self.stopMitlm()
+
+    def appendLines(self, lines):
+        """
+        Write lines to the corpus in one go, holding corpusLock only while
+        writing, not while the caller works out what they are. Returns how
+        many there were.
+        """
+        if len(lines) == 0:
+            return 0
+        with self.corpusLock:
+            for cl in lines:
+                print(cl, file=self.corpusFile)
+            self.appended += len(lines)
+        return len(lines)
+
+    def addManyToCorpus(self, sentences):
+        """
+        Adds every string of lexemes in sentences (which may be a generator)
+        to the corpus, in big buffered writes, and only flushes and throws
+        out the model once at the end. Queries and rebuilds can go on in
+        between batches of lines.
+        """
+        self.openCorpus()
+        added = 0
+        batch = []
+        for lexemes in sentences:
+            assert isinstance(lexemes, list)
+            assert len(lexemes)
+            cl = self.corpify(lexemes)
+            assert(len(cl))
+            assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
+            batch.append(cl)
+            if len(batch) >= self.WRITE_BATCH:
+                added += self.appendLines(batch)
+                batch = []
+        added += self.appendLines(batch)
+        if added == 0:
+            return
+        if self.handedOff:
+            with self.corpusLock:
+                self.corpusFile.flush()
+        elif self.background:
+            self.scheduleRebuild()
+        elif not self.incremental:
+            self.corpusFile.flush()
+            self.stopMitlm()
 
     def queryCorpus(self, request):
-        self.startMitlm()
-        r = self.mitlm.xentropy((" ".join(request)).encode("UTF-8"))
-        if r >= 1.0e70:
-          qString = self.corpify(request)
-          warning("Infinity: %s" % qString)
-          warning(str(r))
-          self.checkMitlm()
-        return r
-
-    def predictCorpus(self, lexemes):
-        return self.parsePredictionResult(
-            self.mitlm.predict(lexemes),
-            remove_prefix=len(lexemes)
-        )
+        return self.queryCorpusBatch([request])[0]
+
+    def queryCorpusBatch(self, requests):
+        """
+        Like queryCorpus, but for a list of requests. All of them are scored
+        by a single call into MITLM, apart from the ones in windowCache.
+        Returns a list of entropies in the same order as requests.
+        """
+        return self.queryCorpusBatchIds([self.internAll(r) for r in requests])
+
+    def tokenLogprobs(self, request):
+        """
+        Returns the natural log-probability of every token in request given
+        the tokens before it, as computed by a single pass through MITLM.
+        """
+        return self.tokenLogprobsIds(self.internAll(request))
+
+    def internAll(self, strings):
+        """
+        Ids of strings, as an array. Strings we haven't seen before are added
+        to the vocabulary if the model knows them, and looked up as <unk>
+        otherwise, so querying never grows the vocabulary with strings that
+        were never trained on. Ids don't change when the model is rebuilt.
+        """
+        vocab = self.vocab
+        ids = np.empty(len(strings), dtype=np.int64)
+        unseen = OrderedDict()
+        with self.vocabLock:
+            for i, string in enumerate(strings):
+                j = vocab.get(string)
+                if j is None:
+                    unseen.setdefault(string, []).append(i)
+                else:
+                    ids[i] = j
+        if len(unseen) == 0:
+            return ids
+        words = list(unseen.keys())
+        with self.reading() as (mitlm, generation):
+            indices = mitlm.vocabIndices(
+                [w.encode("UTF-8") for w in [u'<unk>'] + words])
+        unk = indices[0]
+        with self.vocabLock:
+            for string, index in zip(words, indices[1:]):
+                j = vocab[u'<unk>']
+                if index != unk:
+                    j = vocab.get(string)
+                    if j is None:
+                        j = len(self.words)
+                        vocab[string] = j
+                        self.words.append(string)
+                ids[unseen[string]] = j
+        return ids
+
+    def toModel(self, mitlm, ids):
+        """Translate interned ids to mitlm's vocabulary indices."""
+        with self.vocabLock:
+            if self.indexedMitlm is not mitlm:
+                self.modelIndices = np.zeros(0, dtype=np.int64)
+                self.indexedMitlm = mitlm
+            known = len(self.modelIndices)
+            if known < len(self.words):
+                self.modelIndices = np.concatenate((self.modelIndices,
+                    np.array(mitlm.vocabIndices(
+                        [w.encode("UTF-8") for w in self.words[known:]]),
+                        dtype=np.int64)))
+            modelIndices = self.modelIndices
+        return modelIndices[ids]
+
+    def queryCorpusIds(self, ids):
+        """Like queryCorpus, for an array of ids from internAll."""
+        return self.queryCorpusBatchIds([ids])[0]
+
+    def queryCorpusBatchIds(self, requests):
+        """
+        Like queryCorpusBatch, for arrays of ids from internAll. The whole
+        batch goes to MITLM as one flat array.
+        """
+        if len(requests) == 0:
+            return []
+        with self.reading() as (mitlm, generation):
+            def compute(requests):
+                lengths = [len(request) for request in requests]
+                flat = self.toModel(mitlm, np.concatenate(requests))
+                rs = self.xentropyParallel(mitlm, flat, lengths)
+                for request, r in zip(requests, rs):
+                    if r >= 1.0e70:
+                        warning("Infinity: %s" % self.corpify(
+                            [self.words[i] for i in request]))
+                        warning(str(r))
+                return rs
+            # Windows we've already scored with this model are just looked
+            # up.
+            return self.windowCache.lookup(requests, generation, compute)
+
+    def xentropyParallel(self, mitlm, flat, lengths):
+        """
+        mitlm.xentropyBatchIds, with the batch split across self.threads
+        threads if it's big enough to be worth it.
+        """
+        if self.threads <= 1 or len(lengths) < 2 * self.threads:
+            return list(mitlm.xentropyBatchIds(flat.tolist(), lengths))
+        with self.poolLock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.threads)
+            pool = self.pool
+        ends = np.cumsum(lengths)
+        cuts = np.linspace(0, len(lengths), self.threads + 1).astype(int)
+        chunks = []
+        for first, last in zip(cuts[:-1], cuts[1:]):
+            start = ends[first - 1] if first > 0 else 0
+            chunks.append((flat[start:ends[last - 1]].tolist(),
+                           lengths[first:last]))
+        results = pool.map(
+            lambda chunk: list(mitlm.xentropyBatchIds(*chunk)), chunks)
+        return [r for chunk in results for r in chunk]
+
+    def tokenLogprobsIds(self, ids):
+        """Like tokenLogprobs, for an array of ids from internAll."""
+        with self.reading() as (mitlm, generation):
+            return list(mitlm.tokenLogprobsIds(
+                self.toModel(mitlm, ids).tolist()))
+
+    def predictCorpus(self, lexemes, k=10):
+        """
+        The k most likely next tokens after lexemes, as a list of
+        (token, logprob), most likely first.
+        """
+        return self.predictCorpusBatch([lexemes], k)[0]
+
+    def predictCorpusBatch(self, requests, k=10):
+        """predictCorpus for a list of prefixes, in a single call into MITLM."""
+        return self.predictCorpusBatchIds(
+            [self.internAll(request) for request in requests], k)
+
+    def predictCorpusBatchIds(self, requests, k=10):
+        """Like predictCorpusBatch, for arrays of ids from internAll."""
+        if len(requests) == 0:
+            return []
+        lengths = [len(request) for request in requests]
+        with self.reading() as (mitlm, generation):
+            flat = self.toModel(mitlm, np.concatenate(requests))
+            return [[(token.decode("UTF-8"), logprob) for token, logprob in r]
+                    for r in mitlm.predictBatch(flat.tolist(), lengths, k)]
 
     def release(self):
         """Close files and stop MITLM"""
+        with self.swapLock:
+            self.rescheduled = False
+            timer = self.rebuildTimer
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        with self.poolLock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
         self.closeCorpus()
 
     def __del__(self):
@@ -20,6 +20,8 @@ from unnaturalcode.ucUtil import *
 from unnaturalcode.unnaturalCode import *
 from unnaturalcode.pythonSource import *
 from unnaturalcode.mitlmCorpus import *
+from unnaturalcode.numpyCorpus import numpyCorpus
+from unnaturalcode.ugCorpus import ugCorpus
 from unnaturalcode.sourceModel import *
 from unnaturalcode.mutators import Mutators
 from unnaturalcode.ucUser import pyUser
@@ -276,7 +278,8 @@ class ModelValidation(object):
                  resultsDir=None,
                  corpus=mitlmCorpus,
                  keep=False,
-                 retry_valid=False):
+                 retry_valid=False,
+                 candidates=sourceModel.DEFAULT_CANDIDATES):
         self.resultsDir = ((resultsDir or os.getenv("ucResultsDir", None)) or mkdtemp(prefix='ucValidation-'))
         self.retry_valid = retry_valid
         if isinstance(test, str):
@@ -314,11 +317,15 @@ class ModelValidation(object):
             os.remove(self.corpusPath)
         if keep:
             pass
-        elif os.path.exists(self.corpusPath + ".uniqueTokens"):
-            os.remove(self.corpusPath + ".uniqueTokens")
+        else:
+            for tokens in (self.corpusPath + ".uniqueTokens",
+                           self.corpusPath + ".uniqueTokens.log"):
+                if os.path.exists(tokens):
+                    os.remove(tokens)
         self.cm = corpus(readCorpus=self.corpusPath, writeCorpus=self.corpusPath, order=10)
         self.lm = language
-        self.sm = sourceModel(cm=self.cm, language=self.lm)
+        self.sm = sourceModel(cm=self.cm, language=self.lm,
+                              candidates=candidates)
         self.trainFiles = list()
         self.testFiles = list()
         self.addValidationFile(self.trainFileNames, testing=False, training=True)
@@ -355,6 +362,9 @@ class ValidationMain(object):
         parser.add_argument('-o', '--output-dir', help='Location to store output files', default='.')
         parser.add_argument('-m', '--mutation', help='Mutation to use', required=True, action='append')
         parser.add_argument('-r', '--retry-valid', action='store_true', help='Retry until a syntactically incorrect mutation is found')
+        parser.add_argument('--numpy', action='store_true', help='Use the NumPy n-gram model instead of MITLM')
+        parser.add_argument('--unnaturalgrams', action='store_true', help='Use the unnaturalgrams n-gram model instead of MITLM')
+        parser.add_argument('-c', '--candidates', type=int, default=sourceModel.DEFAULT_CANDIDATES, help='Number of predicted tokens to try inserting or replacing; 0 tries every token')
         self.add_args(parser) # get more args from subclasses
         args=parser.parse_args()
         logging.getLogger().setLevel(logging.DEBUG)
@@ -369,9 +379,12 @@ class ValidationMain(object):
         v = self.validation(test=testProjectFiles,
                             train=trainProjectFiles,
                             keep=args.keep_corpus,
-                            corpus=mitlmCorpus,
+                            corpus=(numpyCorpus if args.numpy
+                                    else ugCorpus if args.unnaturalgrams
+                                    else mitlmCorpus),
                             resultsDir=args.output_dir,
-                            retry_valid=args.retry_valid)
+                            retry_valid=args.retry_valid,
+                            candidates=(args.candidates or None))
         mutations=[getattr(Mutators, mutation) for mutation in args.mutation]
         v.validate(mutations=mutations, n=args.iterations)
         # TODO: assert csvs
@@ -0,0 +1,454 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An n-gram language model in NumPy, with the same interface as mitlmCorpus.
+
+Counts live in one sorted integer array per order, so lookups for a whole
+batch of queries are a single searchsorted. Scores are interpolated modified
+Kneser-Ney (Chen & Goodman 1998), in natural logs like MITLM. Unlike MITLM
+the model can be updated in place: training only appends to the counts.
+"""
+
+from __future__ import print_function
+import os
+import os.path
+import codecs
+from unnaturalcode.unnaturalCode import *
+from logging import debug, info, warning, error
+import numpy as np
+
+allWhitespace = re.compile('^\s+$')
+
+# Token ids are packed into the low bits of an n-gram key, so there can be at
+# most this many distinct tokens.
+BASE = 1 << 24
+UNK, BOS, EOS = 0, 1, 2
+# Log-probabilities are clamped to this, like MITLM's "practically infinite".
+MIN_LOGPROB = -70.0
+
+class ngramTable(object):
+    """
+    The n-grams of one order.
+
+    Each n-gram is keyed by history * BASE + word, where history is the id of
+    its (n-1)-gram prefix in the table one order down (always 0 for
+    unigrams). keys is sorted, and ids[i] is the id of the n-gram keys[i].
+    Ids are handed out in insertion order and never change, so the table one
+    order up can refer to them; everything else is indexed by id.
+    """
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        # Number of occurrences.
+        self.counts = np.zeros(0, dtype=np.int64)
+        # Number of distinct tokens seen to the left of this n-gram.
+        self.cont = np.zeros(0, dtype=np.int64)
+        # Filled in by prepare().
+        self.used = None
+        self.discount = None
+        self.histTotal = None
+        self.histWeight = None
+
+    def __len__(self):
+        return len(self.counts)
+
+    def lookup(self, keys):
+        """Ids of keys, or -1 for keys that aren't in the table."""
+        if len(self.keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self.keys, keys)
+        pos = np.minimum(pos, len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.ids[pos], -1)
+
+    def add(self, keys):
+        """
+        Count every occurrence in keys. Returns the id of each occurrence and
+        the indices (into keys) of one occurrence of every new n-gram.
+        """
+        uniq, first, inverse, counts = np.unique(keys, return_index=True,
+                                                 return_inverse=True,
+                                                 return_counts=True)
+        ids = self.lookup(uniq)
+        new = ids < 0
+        nNew = int(new.sum())
+        ids[new] = np.arange(len(self), len(self) + nNew)
+        grow = np.zeros(nNew, dtype=np.int64)
+        self.counts = np.concatenate((self.counts, grow))
+        self.cont = np.concatenate((self.cont, grow))
+        self.counts[ids] += counts
+        pos = np.searchsorted(self.keys, uniq[new])
+        self.keys = np.insert(self.keys, pos, uniq[new])
+        self.ids = np.insert(self.ids, pos, ids[new])
+        return (ids[inverse], first[new])
+
+    def histories(self):
+        """The history of every n-gram, by id."""
+        hist = np.empty(len(self), dtype=np.int64)
+        hist[self.ids] = self.keys // BASE
+        return hist
+
+    def prepare(self, used, nHistories):
+        """
+        Precompute everything scoring needs from the counts the model uses at
+        this order (raw counts for the highest order, continuation counts
+        below it).
+        """
+        self.used = used
+        # Modified Kneser-Ney discounts from the count-of-counts.
+        n = np.bincount(used, minlength=5)[1:5].astype(np.float64)
+        discount = np.zeros(4)
+        if n[0] > 0 and n[1] > 0:
+            y = n[0] / (n[0] + 2.0 * n[1])
+            for c in (1, 2, 3):
+                if n[c - 1] > 0:
+                    discount[c] = c - (c + 1) * y * n[c] / n[c - 1]
+        else:
+            discount[1:] = 0.5
+        self.discount = np.clip(discount, 0.0, np.arange(4))
+        hist = self.histories()
+        self.histTotal = np.bincount(hist, weights=used,
+                                     minlength=nHistories)
+        clipped = np.minimum(used, 3)
+        self.histWeight = np.bincount(hist,
+                                      weights=self.discount[clipped] * (used > 0),
+                                      minlength=nHistories)
+
+
+class numpyCorpus(object):
+    """
+    NumPy n-gram model. Drop-in replacement for mitlmCorpus.
+    """
+
+    def __init__(self, readCorpus=None, writeCorpus=None, uc=unnaturalCode(), order=10,
+                 windowCache=None):
+        self.readCorpus = (readCorpus or os.getenv("ucCorpus", "/tmp/ucCorpus"))
+        self.writeCorpus = (writeCorpus or os.getenv("ucWriteCorpus", self.readCorpus))
+        self.corpusFile = False
+        self.order = order
+        self.vocab = {u"<unk>": UNK, u"<s>": BOS, u"</s>": EOS}
+        self.words = [u"<unk>", u"<s>", u"</s>"]
+        # Which ids have been seen in training. Ids that have only been seen
+        # in queries are scored as <unk>.
+        self.trained = np.ones(3, dtype=bool)
+        self.vocabSize = 3
+        self.tables = [ngramTable() for i in range(0, order + 1)]
+        # The empty history that unigrams hang off.
+        self.tables[0].counts = np.zeros(1, dtype=np.int64)
+        # Sentences added since the counts were last merged.
+        self.pending = []
+        self.loaded = False
+        # Bumped every time sentences are added, before they're merged into
+        # the counts, so callers can tell as soon as scores will change.
+        self.generation = 0
+        # Scores of recently queried windows, for this generation.
+        self.windowCache = lruCache(windowCache)
+
+    def corpify(self, lexemes):
+        """Stringify lexed source: produce space-seperated sequence of lexemes"""
+        assert isinstance(lexemes, list)
+        assert len(lexemes)
+        return u" ".join(lexemes)
+
+    def openCorpus(self):
+        """Opens the corpus (if necessary)"""
+        if (self.corpusFile):
+            assert not self.corpusFile.closed
+            return
+        self.corpusFile = codecs.open(self.writeCorpus, 'a', encoding='UTF-8')
+
+    def closeCorpus(self):
+        """Closes the corpus (if necessary)"""
+        if (self.corpusFile):
+            self.corpusFile.close()
+            assert self.corpusFile.closed
+            self.corpusFile = None
+
+    def load(self):
+        """Read the existing corpus, the first time the model is needed."""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.readCorpus):
+            return
+        with codecs.open(self.readCorpus, 'r', encoding='UTF-8') as f:
+            for line in f:
+                words = line.split()
+                if len(words):
+                    self.pending.append(self.learn(words))
+
+    def learn(self, strings):
+        """
+        Ids of strings that are about to be trained on, as an array, adding
+        the ones we haven't seen before to the vocabulary.
+        """
+        vocab = self.vocab
+        ids = np.empty(len(strings), dtype=np.int64)
+        for i, string in enumerate(strings):
+            j = vocab.get(string)
+            if j is None:
+                j = len(self.words)
+                assert j < BASE, "Vocabulary too large."
+                vocab[string] = j
+                self.words.append(string)
+            ids[i] = j
+        return ids
+
+    def internAll(self, strings):
+        """
+        Ids of strings, as an array. Strings that have never been trained on
+        are <unk>, so querying never grows the vocabulary.
+        """
+        self.load()
+        vocab = self.vocab
+        return np.array([vocab.get(string, UNK) for string in strings],
+                        dtype=np.int64)
+
+    def known(self, ids):
+        """ids, with <unk> for the ones that haven't been trained on."""
+        if len(self.trained) < len(self.words):
+            self.trained = np.concatenate((self.trained,
+                np.zeros(len(self.words) - len(self.trained), dtype=bool)))
+        return np.where(self.trained[ids], ids, UNK)
+
+    def flatten(self, sentences):
+        """
+        Lay out sentences (lists of ids) end to end, each wrapped in <s> and
+        </s>. Returns the ids and each id's position in its sentence.
+        """
+        lengths = np.array([len(s) + 2 for s in sentences], dtype=np.int64)
+        words = np.empty(lengths.sum(), dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        i = 0
+        for s in sentences:
+            words[i] = BOS
+            words[i + 1:i + 1 + len(s)] = s
+            words[i + 1 + len(s)] = EOS
+            i += len(s) + 2
+        offsets = np.arange(len(words)) - np.repeat(starts, lengths)
+        return (words, offsets)
+
+    def merge(self):
+        """Add the pending sentences to the counts."""
+        self.load()
+        if len(self.pending) == 0:
+            return
+        words, offsets = self.flatten(self.pending)
+        self.pending = []
+        self.known(words)
+        self.trained[words] = True
+        self.vocabSize = int(self.trained.sum())
+        gram = np.zeros(len(words), dtype=np.int64)
+        for k in range(1, self.order + 1):
+            at = np.nonzero(offsets >= k - 1)[0]
+            if len(at) == 0:
+                break
+            # The (k-1)-gram ending just before each k-gram.
+            hist = gram[at - 1] if k > 1 else np.zeros(len(at), dtype=np.int64)
+            ids, new = self.tables[k].add(hist * BASE + words[at])
+            if k > 1:
+                # The lower order n-gram ending at the same place gains a
+                # distinct left context for every new k-gram.
+                lower = self.tables[k - 1]
+                lower.cont += np.bincount(gram[at[new]], minlength=len(lower))
+            gram = np.full(len(words), -1, dtype=np.int64)
+            gram[at] = ids
+        self.prepare()
+
+    def prepare(self):
+        for k in range(1, self.order + 1):
+            table = self.tables[k]
+            if k == self.order:
+                used = table.counts
+            else:
+                used = np.where(table.cont > 0, table.cont, table.counts)
+            if k == 1:
+                # <s> is never predicted.
+                used = used.copy()
+                bos = table.lookup(np.array([BOS], dtype=np.int64))[0]
+                if bos >= 0:
+                    used[bos] = 0
+            table.prepare(used, len(self.tables[k - 1]))
+
+    def grams(self, words, offsets, k, lower):
+        """
+        Ids of the k-grams ending at every position, given the ids of the
+        (k-1)-grams ending at every position. Also returns the histories.
+        """
+        hist = np.roll(lower, 1)
+        hist[offsets < k - 1] = -1
+        if k == 1:
+            hist[:] = 0
+        table = self.tables[k]
+        known = hist >= 0
+        gram = np.full(len(words), -1, dtype=np.int64)
+        gram[known] = table.lookup(hist[known] * BASE + words[known])
+        return (gram, hist)
+
+    def interpolate(self, k, hist, gram, p):
+        """Mix the order k estimate into p, the estimate from lower orders."""
+        table = self.tables[k]
+        if table.used is None or len(table) == 0:
+            return p
+        h = np.where(hist >= 0, hist, 0)
+        total = table.histTotal[h]
+        seen = (hist >= 0) & (total > 0)
+        total = np.where(seen, total, 1.0)
+        c = np.where(gram >= 0, table.used[np.where(gram >= 0, gram, 0)], 0)
+        d = table.discount[np.minimum(c, 3)]
+        mixed = (np.maximum(c - d, 0.0) + table.histWeight[h] * p) / total
+        return np.where(seen, mixed, p)
+
+    def scoreFlat(self, words, offsets):
+        """Probability of every position given the ones before it."""
+        # Uniform over every token except <s>.
+        p = np.full(len(words), 1.0 / (self.vocabSize - 1))
+        gram = np.zeros(len(words), dtype=np.int64)
+        for k in range(1, self.order + 1):
+            gram, hist = self.grams(words, offsets, k, gram)
+            p = self.interpolate(k, hist, gram, p)
+        return p
+
+    def logprobs(self, requests):
+        """
+        Natural log-probabilities for a batch of requests (arrays of ids from
+        internAll). Returns one array per request, with one entry for every
+        lexeme plus one for the end of the sentence.
+        """
+        self.merge()
+        sentences = [self.known(r) for r in requests]
+        words, offsets = self.flatten(sentences)
+        with np.errstate(divide='ignore'):
+            lp = np.maximum(np.log(self.scoreFlat(words, offsets)), MIN_LOGPROB)
+        ends = np.cumsum([len(s) + 2 for s in sentences])
+        return [lp[end - len(s) - 1:end]
+                for s, end in zip(sentences, ends)]
+
+    def addToCorpus(self, lexemes):
+        """Adds a string of lexemes to the corpus"""
+        assert isinstance(lexemes, list)
+        assert len(lexemes)
+        self.load()
+        self.openCorpus()
+        cl = self.corpify(lexemes)
+        assert(len(cl))
+        assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
+        print(cl, file=self.corpusFile)
+        self.corpusFile.flush()
+        self.pending.append(self.learn(cl.split()))
+        self.generation += 1
+
+    def addManyToCorpus(self, sentences):
+        """
+        Adds every string of lexemes in sentences (which may be a generator)
+        to the corpus, only flushing it once at the end.
+        """
+        self.load()
+        self.openCorpus()
+        for lexemes in sentences:
+            assert isinstance(lexemes, list)
+            assert len(lexemes)
+            cl = self.corpify(lexemes)
+            assert(len(cl))
+            assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
+            print(cl, file=self.corpusFile)
+            self.pending.append(self.learn(cl.split()))
+        self.corpusFile.flush()
+        self.generation += 1
+
+    def queryCorpus(self, request):
+        """Cross-entropy of request, in nats per token like MITLM."""
+        return self.queryCorpusIds(self.internAll(request))
+
+    def queryCorpusBatch(self, requests):
+        """
+        Like queryCorpus, but for a list of requests, which are all scored in
+        one pass.
+        """
+        return self.queryCorpusBatchIds([self.internAll(r) for r in requests])
+
+    def tokenLogprobs(self, request):
+        """
+        Returns the natural log-probability of every token in request given
+        the tokens before it.
+        """
+        return self.tokenLogprobsIds(self.internAll(request))
+
+    def queryCorpusIds(self, ids):
+        """Like queryCorpus, for an array of ids from internAll."""
+        return self.queryCorpusBatchIds([ids])[0]
+
+    def queryCorpusBatchIds(self, requests):
+        """Like queryCorpusBatch, for arrays of ids from internAll."""
+        if len(requests) == 0:
+            return []
+        self.merge()
+        return self.windowCache.lookup(requests, self.generation,
+            lambda requests: [float(-lp.mean())
+                              for lp in self.logprobs(requests)])
+
+    def tokenLogprobsIds(self, ids):
+        """Like tokenLogprobs, for an array of ids from internAll."""
+        return self.logprobs([ids])[0][:-1].tolist()
+
+    def predictCorpus(self, lexemes, k=10):
+        """
+        The k most likely next tokens after lexemes, as a list of
+        (token, logprob), most likely first.
+        """
+        self.merge()
+        context = self.known(self.internAll(lexemes))
+        words, offsets = self.flatten([context])
+        # Drop </s>: we want the grams ending at the last lexeme.
+        words, offsets = words[:-1], offsets[:-1]
+        candidates = np.nonzero(self.trained)[0]
+        candidates = candidates[(candidates != UNK) & (candidates != BOS)]
+        nc = len(candidates)
+        p = np.full(nc, 1.0 / (self.vocabSize - 1))
+        gram = np.zeros(len(words), dtype=np.int64)
+        for order in range(1, self.order + 1):
+            # History of the next token: the (order-1)-gram ending at the
+            # last lexeme.
+            if order == 1:
+                hist = 0
+            elif offsets[-1] >= order - 2:
+                hist = gram[-1]
+            else:
+                hist = -1
+            hists = np.full(nc, hist, dtype=np.int64)
+            nextGram = np.full(nc, -1, dtype=np.int64)
+            if hist >= 0:
+                nextGram = self.tables[order].lookup(hist * BASE + candidates)
+            p = self.interpolate(order, hists, nextGram, p)
+            if order < self.order:
+                gram, _ = self.grams(words, offsets, order, gram)
+        best = np.argsort(-p, kind='mergesort')[:k]
+        return [(self.words[candidates[i]], float(np.log(p[i])))
+                for i in best]
+
+    def predictCorpusBatch(self, requests, k=10):
+        """predictCorpus for a list of prefixes."""
+        return [self.predictCorpus(request, k) for request in requests]
+
+    def release(self):
+        """Close files"""
+        self.closeCorpus()
+
+    def __del__(self):
+        """I am a destructor, but release should be called explictly."""
+        assert not self.corpusFile, "Destructor called before release()"
@@ -23,6 +23,8 @@ from logging import debug, info, warning, error
 from unnaturalcode import flexibleTokenize
 
 import sys, token, zmq;
+from lib2to3 import pygram, pytree
+from lib2to3.pgen2 import parse, grammar as pgenGrammar, token as pgenToken
 try:
   from cStringIO import StringIO
 except ImportError:
@@ -32,6 +34,42 @@ COMMENT = 53
 
 ws = re.compile('\s')
 
+# We parse with lib2to3's grammar because its parser lets us see what it
+# would have accepted when it gives up. It's the Python 2 grammar, print
+# statements and all.
+grammar = pygram.python_grammar
+# Every string that tokenizes to each operator.
+opstrings = {}
+for opstring, optype in pgenGrammar.opmap.items():
+    opstrings.setdefault(optype, []).append(opstring)
+
+def labelTokens(label, tokens):
+    """Adds the (type, string) of every token label could start with."""
+    t, v = grammar.labels[label]
+    if t >= 256:
+        for first in grammar.dfas[t][1]:
+            labelTokens(first, tokens)
+    elif t in opstrings:
+        for opstring in opstrings[t]:
+            tokens.add(('OP', opstring))
+    else:
+        tokens.add((pgenToken.tok_name[t], v))
+
+def expectedTokens(stack):
+    """
+    The tokens a parser with stack (of (dfa, state)) would shift next,
+    including those of the rules it would finish first.
+    """
+    tokens = set()
+    for (states, first), state in reversed(stack):
+        arcs = states[state]
+        for label, next in arcs:
+            if label != 0:
+                labelTokens(label, tokens)
+        if (0, state) not in arcs:
+            break
+    return tokens
+
 
 # TODO: Refactor so base class is genericSource
 
@@ -108,6 +146,60 @@ class pythonSource(ucSource):
         assert len(r)
         return pythonSource(r)
 
+    def restarts(self):
+        # Statements at the top level: no indentation open, and no brackets
+        # either, since the tokenizer carries on after unmatched ones.
+        r = [0]
+        depth = 0
+        last = None
+        for i in range(0, len(self)):
+            t = self[i].ltype
+            if (i > 0 and depth == 0 and self[i].start.c == 0
+                and last in ('NEWLINE', 'DEDENT')
+                and t not in ('NEWLINE', 'NL', 'COMMENT', 'INDENT', 'DEDENT',
+                              'ENDMARKER')):
+                r.append(i)
+            if t == 'OP':
+                if self[i].val in ('(', '[', '{'):
+                    depth += 1
+                elif self[i].val in (')', ']', '}'):
+                    depth -= 1
+            if t not in ('NL', 'COMMENT'):
+                last = t
+        return r
+
+    def expected(self):
+        parser = parse.Parser(grammar, pytree.convert)
+        parser.setup()
+        last = None
+        for i in range(0, len(self)):
+            t = self[i].ltype
+            if t in ('COMMENT', 'NL'):
+                continue
+            tokens = [(t, self[i][1])]
+            if t == 'INDENT' and last != 'NEWLINE':
+                # scrubbed() drops the NEWLINE before an INDENT.
+                tokens.insert(0, ('NEWLINE', '\n'))
+            for t, v in tokens:
+                if t == 'OP':
+                    if v not in pgenGrammar.opmap:
+                        return (i, set())
+                    code = pgenGrammar.opmap[v]
+                elif hasattr(pgenToken, t):
+                    code = getattr(pgenToken, t)
+                else:
+                    return (i, set())
+                stack = [(dfa, state) for dfa, state, node in parser.stack]
+                try:
+                    if parser.addtoken(code, v, ('', tuple(self[i].start))):
+                        return (None, set())
+                except parse.ParseError:
+                    return (i, expectedTokens(stack))
+                last = t
+        # It ran out before the parser was done.
+        stack = [(dfa, state) for dfa, state, node in parser.stack]
+        return (len(self), expectedTokens(stack))
+
 class LexPyMQ(object):
 	def __init__(self, lexer):
 		self.lexer = lexer
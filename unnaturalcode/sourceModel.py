@@ -19,23 +19,46 @@ from unnaturalcode.ucUtil import *
 from unnaturalcode.mitlmCorpus import *
 from unnaturalcode.pythonSource import *
 from unnaturalcode.unnaturalCode import ucLexeme
+from unnaturalcode.uniqueTokens import uniqueTokens, countTokens
 from operator import itemgetter
 from logging import debug, info, warning, error
+from itertools import imap
+from collections import deque
+import heapq
+from multiprocessing import Pool
 import os.path
-import pickle
+import time
+import numpy as np
+
+def scrubFile(task):
+    """
+    Runs in trainFiles' workers. Returns the strings of a file's scrubbed
+    lexemes, and countTokens of them.
+    """
+    language, path = task
+    # Scrubbed twice, like trainString does: once by sourceToScrubbed and
+    # again by trainLexemes.
+    lexemes = language(slurp(path)).scrubbed().scrubbed()
+    tokens, counts = countTokens(lexemes)
+    return ([l[4] for l in lexemes], tokens, counts)
 
 class sourceModel(object):
 
-    def __init__(self, cm=mitlmCorpus(), language=pythonSource, windowSize=20):
+    # How many of the model's guesses tryInsert and tryReplace score.
+    DEFAULT_CANDIDATES = 200
+    # How many tokens windowScores and tokenScores look up at a time.
+    SCORE_CHUNK = 4096
+
+    def __init__(self, cm=mitlmCorpus(), language=pythonSource, windowSize=20,
+                 candidates=DEFAULT_CANDIDATES):
         self.cm = cm
         self.lang = language
         self.windowSize = windowSize
-        self.listOfUniqueTokens = {}
+        # None scores every unique token instead, e.g. for benchmarking.
+        self.candidates = candidates
         self.uTokenFile = self.cm.writeCorpus + ".uniqueTokens"
-        readTokenFile = self.cm.readCorpus + ".uniqueTokens"
-        if os.path.isfile(readTokenFile):
-          with open(readTokenFile, "rb") as f:
-            self.listOfUniqueTokens = pickle.load(f)
+        self.listOfUniqueTokens = uniqueTokens(
+            self.cm.readCorpus + ".uniqueTokens", self.uTokenFile)
 
     def trainFile(self, files):
         """Blindly train on a set of files whether or not it compiles..."""
@@ -45,6 +68,37 @@ class sourceModel(object):
             sourceCode = slurp(fi)
             self.trainString(sourceCode)
 
+    def trainFiles(self, paths, workers=None):
+        """
+        Train on a lot of files at once. They're read, lexed and scrubbed by
+        a pool of workers processes (as many as there are cores, or
+        workers), and streamed into the corpus in order as they come back,
+        so its model is only thrown out once. The unique tokens are written
+        once, at the end.
+        """
+        tasks = [(self.lang, path) for path in paths]
+        tokens = {}
+        counts = {}
+        def sentences(results):
+            for strings, fileTokens, fileCounts in results:
+                for string, lexeme in fileTokens.items():
+                    if string not in tokens:
+                        tokens[string] = lexeme
+                        counts[string] = 0
+                    counts[string] += fileCounts[string]
+                yield self.paddedStrings(strings)
+        if workers == 1:
+            self.cm.addManyToCorpus(sentences(imap(scrubFile, tasks)))
+        else:
+            pool = Pool(workers)
+            try:
+                self.cm.addManyToCorpus(
+                    sentences(pool.imap(scrubFile, tasks, chunksize=8)))
+            finally:
+                pool.terminate()
+                pool.join()
+        self.listOfUniqueTokens.addCounts(tokens, counts)
+
     def stringifyAll(self, lexemes):
         """Clean up a list of lexemes and convert it to a list of strings"""
         return [i[4] for i in lexemes]
@@ -59,19 +113,17 @@ class sourceModel(object):
     def trainLexemes(self, lexemes):
         """Train on a lexeme sequence."""
         lexemes = lexemes.scrubbed()
-        for l in lexemes:
-            if l[4] not in self.listOfUniqueTokens:
-                self.listOfUniqueTokens[l[4]] = l
-        with open(self.uTokenFile, "wb") as f:
-            pickle.dump(self.listOfUniqueTokens, f)
+        self.listOfUniqueTokens.add(lexemes)
+        return self.cm.addToCorpus(
+            self.paddedStrings(self.stringifyAll(lexemes)))
+
+    def paddedStrings(self, lstrings):
+        """lstrings padded with a window of start and end tokens."""
         windowlen = self.windowSize
-        padding = windowlen
-        lstrings = self.stringifyAll(lexemes)
-        qstrings = ((["/*<START>*/"] * windowlen)
-                    + lstrings 
-                    + (["/*<END>*/"] * windowlen)
-                   )
-        return self.cm.addToCorpus(qstrings)
+        return ((["/*<START>*/"] * windowlen)
+                + lstrings
+                + (["/*<END>*/"] * windowlen)
+               )
 
     def trainString(self, sourceCode):
         """Train on a source code string"""
@@ -83,8 +135,13 @@ class sourceModel(object):
     def queryLexed(self, lexemes):
         return self.cm.queryCorpus(self.stringifyAll(lexemes))
 
-    def predictLexed(self, lexemes):
-        return self.cm.predictCorpus(self.stringifyAll(lexemes))
+    def predictLexed(self, lexemes, k=10):
+        return self.cm.predictCorpus(self.stringifyAll(lexemes), k)
+
+    def predictLexedBatch(self, prefixes, k=10):
+        """predictLexed for many prefixes at once."""
+        return self.cm.predictCorpusBatch(
+            [self.stringifyAll(lexemes) for lexemes in prefixes], k)
 
     def windowedQuery(self, lexemes, returnWindows=True):
         lastWindowStarts = len(lexemes)-self.windowSize
@@ -94,22 +151,47 @@ class sourceModel(object):
                 return [(lexemes, self.queryLexed(lexemes))]
             else:
                 return [(False, self.queryLexed(lexemes))]                
-        r = []
+        windows = []
+        ids = self.cm.internAll(self.stringifyAll(lexemes))
+        qwindows = []
         for i in range(0,lastWindowStarts+1): # remember range is [)
             end = i+self.windowSize
-            w = lexemes[i:end] # remember range is [)
-            e = self.queryLexed(w)
-            if returnWindows:
-                r.append( (w,e) )
-            else:
-                r.append( (False,e) )
-        return r
+            windows.append(lexemes[i:end]) # remember range is [)
+            qwindows.append(ids[i:end])
+        entropies = self.cm.queryCorpusBatchIds(qwindows)
+        if returnWindows:
+            return zip(windows, entropies)
+        else:
+            return [(False, e) for e in entropies]
 
     def worstWindows(self, lexemes):
         lexemes = lexemes.scrubbed()
         unsorted = self.windowedQuery(lexemes)
         return sorted(unsorted, key=itemgetter(1), reverse=True)
     
+    def windowEntropies(self, logprobs):
+        """
+        Given the log-probability of every token in a padded query, returns
+        the entropy of the window ending at each token and the "unwindowed"
+        entropy of each token: the sum of its share of every window it is in.
+        Both are computed from cumulative sums, so this is linear in the
+        length of the query no matter how big the window is.
+        """
+        windowlen = self.windowSize
+        total_len = len(logprobs)
+        surprisal = np.concatenate(([0.0], np.cumsum(-np.asarray(logprobs))))
+        ends = np.arange(1, total_len+1)
+        starts = np.maximum(0, ends-windowlen)
+        lengths = ends-starts
+        window_entropies = (surprisal[ends] - surprisal[starts])/lengths
+        # Each window spreads its entropy evenly over its tokens, and token j
+        # is in the windows ending at j up to j+windowlen-1.
+        shares = np.concatenate(([0.0], np.cumsum(window_entropies/lengths)))
+        firsts = np.arange(0, total_len)
+        lasts = np.minimum(firsts+windowlen, total_len)
+        unwindow_entropies = shares[lasts] - shares[firsts]
+        return (window_entropies.tolist(), unwindow_entropies.tolist())
+
     def unwindowedQuery(self, lexemes):
         lexemes = lexemes.scrubbed()
         windowlen = self.windowSize
@@ -131,39 +213,102 @@ class sourceModel(object):
                        * windowlen)
                    )
         total_len = len(qstrings)
-        window_entropies = []
         windows = []
-        unwindow_entropies = []
         for token_i in range(0, total_len):
             qstart = max(0,token_i+1-windowlen)
             qend = token_i+1
-            query = qstrings[qstart:qend]
             windows.append(qtokens[qstart:qend])
-            entropy = self.cm.queryCorpus(query)
-            window_entropies.append(entropy)
-            unwindow_entropies.append(0)
-            for token_j in range(qstart, qend):
-                unwindow_entropies[token_j] += window_entropies[token_i]/(qend-qstart)
-            #if token_i >= content_start and token_i < content_end:
-                #"""
-                #This part is magical. It comes from building an array with a moving
-                #band of 1s representing the window and then inverting it.
-                #It could be made non-quadratic if necessary by saving earlier sums
-                #and reusing them.
-                #Apprently doesn't work that well, however.
-                #"""
-                #unwindow_entropies.append(
-                    #sum([window_entropies[i] for i in xrange(token_i,-1,-windowlen)])
-                    #- sum([window_entropies[i] for i in xrange(token_i-1,-1,-windowlen)])
-                #)
-            #else:
-                #unwindow_entropies.append(0) # don't consider padding tokens
+        window_entropies, unwindow_entropies = self.windowEntropies(
+            self.cm.tokenLogprobsIds(self.cm.internAll(qstrings)))
         windows = zip(windows, window_entropies)
         windows = windows[content_start:content_end]
         unwindows = zip(qtokens, unwindow_entropies)
         unwindows = unwindows[content_start:content_end]
         return (sorted(windows, key=itemgetter(1), reverse=True),
                 sorted(unwindows, key=itemgetter(1), reverse=True))
+
+    def surprisals(self, lexemes):
+        """
+        The surprisal (negative log-probability) of each token of lexemes,
+        padded like unwindowedQuery pads them. Looks SCORE_CHUNK of them up
+        at a time, so it never holds all of them.
+        """
+        windowlen = self.windowSize
+        n = len(lexemes)
+        total_len = n + 2*windowlen
+        # Tokens need this many before them in the same lookup.
+        context = self.cm.order - 1
+        def string(i):
+            if i < windowlen:
+                return "/*<START>*/"
+            elif i < windowlen + n:
+                return lexemes[i-windowlen][4]
+            else:
+                return "/*<END>*/"
+        for begin in xrange(0, total_len, self.SCORE_CHUNK):
+            lo = max(0, begin-context)
+            end = min(total_len, begin+self.SCORE_CHUNK)
+            logprobs = self.cm.tokenLogprobsIds(
+                self.cm.internAll([string(i) for i in xrange(lo, end)]))
+            for logprob in logprobs[begin-lo:]:
+                yield -logprob
+
+    def paddedWindowEntropies(self, lexemes):
+        """
+        The entropy of the window ending at each token of lexemes, padded,
+        like the first half of windowEntropies gives, one at a time.
+        """
+        windowlen = self.windowSize
+        window = deque()
+        entropy = 0.0
+        for surprisal in self.surprisals(lexemes):
+            window.append(surprisal)
+            entropy += surprisal
+            if len(window) > windowlen:
+                entropy -= window.popleft()
+            yield entropy/len(window)
+
+    def windowScores(self, lexemes):
+        """
+        The windows of unwindowedQuery, without copying any of them: yields
+        (start, end, entropy) for the window ending at each token, where the
+        window is lexemes[start:end]. lexemes are scored as they are, so
+        scrub them first.
+        """
+        windowlen = self.windowSize
+        n = len(lexemes)
+        for k, entropy in enumerate(self.paddedWindowEntropies(lexemes)):
+            i = k - windowlen
+            if 0 <= i < n:
+                yield (max(0, i+1-windowlen), i+1, entropy)
+
+    def tokenScores(self, lexemes):
+        """
+        The tokens of unwindowedQuery: yields (i, i+1, entropy) for each of
+        lexemes, where entropy is its share of every window it's in.
+        """
+        windowlen = self.windowSize
+        n = len(lexemes)
+        # The windows over a token are all whole ones, so they each give it
+        # 1/windowlen of their entropy. The last of them ends windowlen-1
+        # tokens after it.
+        shares = deque(maxlen=windowlen)
+        for k, entropy in enumerate(self.paddedWindowEntropies(lexemes)):
+            shares.append(entropy/windowlen)
+            i = k - 2*windowlen + 1
+            if 0 <= i < n:
+                yield (i, i+1, sum(shares))
+
+    def worstRegions(self, lexemes, k=10, tokens=False):
+        """
+        The k worst windows of lexemes (or tokens, if tokens is true) as
+        (start, end, entropy), worst first. Only ever keeps k of them.
+        """
+        if tokens:
+            scores = self.tokenScores(lexemes)
+        else:
+            scores = self.windowScores(lexemes)
+        return heapq.nlargest(k, scores, key=itemgetter(2))
       
     def isValid(self, lexemes):
         (filename, line, func, text, exceptionName) = lexemes.check_syntax()
@@ -191,22 +336,133 @@ class sourceModel(object):
         else:
             return (False, attempt, "Delete", loci, deleted, entropy)
     
-    def tryInsert(self, lexemes, loci):
+    def candidateStrings(self, left):
+        """
+        The tokens worth trying after left: the model's self.candidates most
+        likely next tokens that we can insert, or every unique token we know
+        of if self.candidates is None or the model has no idea. The right
+        context is taken into account when the attempts are scored.
+        """
+        if self.candidates is None:
+            return self.listOfUniqueTokens.keys()
+        strings = [string
+                   for string, logprob
+                   in self.cm.predictCorpus(left, self.candidates)
+                   if string in self.listOfUniqueTokens]
+        if not len(strings):
+            return self.listOfUniqueTokens.keys()
+        return strings
+
+    def expectedStrings(self, lexemes, loci, expected=None, left=None):
+        """
+        The unique tokens the parser would have accepted at loci, if that's
+        where it gave up on lexemes, or [] if it didn't say. expected is
+        lexemes.expected(), if the caller already has it. If the parser
+        would take any token of a type (any NAME, say) there can be
+        thousands; given left, the strings before loci, only the
+        self.candidates of them the model thinks most likely after left are
+        kept, after the ones the parser spelled out.
+        """
+        at, expected = expected or lexemes.expected()
+        if at != loci:
+            return []
+        exact = []
+        wild = []
+        for string, token in self.listOfUniqueTokens.items():
+            if (token[0], token[4]) in expected:
+                exact.append(string)
+            elif (token[0], None) in expected:
+                wild.append(string)
+        if (left is None or self.candidates is None
+            or len(exact) + len(wild) <= self.candidates):
+            return exact + wild
+        wild = set(wild)
+        likely = [string
+                  for string, logprob
+                  in self.cm.predictCorpus(left, self.candidates)
+                  if string in wild]
+        return (exact + likely)[:self.candidates]
+
+    def candidatesAt(self, lexemes, loci, left, expected=None):
+        """
+        The tokens worth trying at loci, with left before them: the ones the
+        parser expected there, or candidateStrings(left) if it didn't say.
+        Either way there are at most self.candidates of them.
+        """
+        strings = self.expectedStrings(lexemes, loci, expected, left)
+        if not len(strings):
+            return self.candidateStrings(left)
+        return strings
+
+    def attemptIds(self, left, right, strings):
+        """An array with one row of ids per string: left, string, right."""
+        left = self.cm.internAll(left)
+        right = self.cm.internAll(right)
+        qattempts = np.empty((len(strings), len(left)+1+len(right)),
+                             dtype=np.int64)
+        qattempts[:, :len(left)] = left
+        qattempts[:, len(left)] = self.cm.internAll(strings)
+        qattempts[:, len(left)+1:] = right
+        return qattempts
+
+    def candidateAttempts(self, left, right, strings=None):
+        """
+        The candidate tokens, and an array with one row of ids per token:
+        left, then that token, then right. The candidates are strings, or
+        candidateStrings(left) if not given.
+        """
+        if strings is None:
+            strings = self.candidateStrings(left)
+        tokens = [self.listOfUniqueTokens[string] for string in strings]
+        return (tokens, self.attemptIds(left, right, strings))
+
+    def insertContext(self, lexemes, loci):
+        """
+        The strings in the window either side of a token inserted at loci,
+        padded out to the window size.
+        """
         window = lexemes[max(0, loci-self.windowSize):
                            min(len(lexemes),loci+self.windowSize)]
-        results = []
-        for string, token in self.listOfUniqueTokens.items():
-            wattempt = copy(window)
-            wattempt.insert(min(self.windowSize, loci), token)
-            qattempt = (["/*<START>*/"] * max(0, self.windowSize-loci) +
-                        self.stringifyAll(wattempt) +
-                        ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize))
-            assert len(qattempt) == (2*self.windowSize)+1, len(qattempt)
-            entropy = self.cm.queryCorpus(qattempt)
-            results.append((token, entropy))
-        bestresults = sorted(results, key=itemgetter(1), reverse=False)    
+        at = min(self.windowSize, loci)
+        left = (["/*<START>*/"] * max(0, self.windowSize-loci) +
+                self.stringifyAll(window[:at]))
+        right = (self.stringifyAll(window[at:]) +
+                 ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize))
+        assert len(left) + len(right) == (2*self.windowSize), len(left) + len(right)
+        return (left, right)
+
+    def replaceContext(self, lexemes, loci):
+        """
+        The strings in the window either side of lexemes[loci], padded out to
+        the window size. Together they're the window with it deleted.
+        """
+        window = lexemes[max(0, loci-self.windowSize):
+                           min(len(lexemes),loci+self.windowSize+1)]
+        at = min(self.windowSize, loci)
+        assert lexemes[loci] == window[at], "\n".join((repr(lexemes[loci]), repr(window[at])))
+        left = (["/*<START>*/"] * max(0, self.windowSize-loci) +
+                self.stringifyAll(window[:at]))
+        right = (self.stringifyAll(window[at+1:]) +
+                 ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize+1))
+        assert len(left) + len(right) == (2*self.windowSize), len(left) + len(right)
+        return (left, right)
+
+    def applyFix(self, lexemes, op, loci, token=None):
+        """A copy of lexemes with one "Delete", "Insert" or "Replace" done."""
         attempt = copy(lexemes)
-        attempt.insert(loci,bestresults[0][0])
+        if op in ("Delete", "Replace"):
+            attempt.pop(loci)
+        if op in ("Insert", "Replace"):
+            attempt.insert(loci, token)
+        return attempt
+
+    def tryInsert(self, lexemes, loci):
+        left, right = self.insertContext(lexemes, loci)
+        tokens, qattempts = self.candidateAttempts(
+            left, right, self.candidatesAt(lexemes, loci, left))
+        results = zip(tokens, self.cm.queryCorpusBatchIds(qattempts))
+        bestresults = sorted(results, key=itemgetter(1), reverse=False)    
+        attempt = self.applyFix(lexemes, "Insert", loci, bestresults[0][0])
         assert len(attempt) == len(lexemes)+1
         if self.isValid(attempt):
             return (True, attempt, "Insert", loci, attempt[loci], bestresults[0][1])
@@ -214,38 +470,27 @@ class sourceModel(object):
             return (False, attempt, "Insert", loci, attempt[loci], bestresults[0][1])
 
     def tryReplace(self, lexemes, loci):
-        ta = lexemes[loci]
-        window = lexemes[max(0, loci-self.windowSize):
-                           min(len(lexemes),loci+self.windowSize+1)]
-        results = []
-        for string, token in self.listOfUniqueTokens.items():
-            wattempt = copy(window)
-            tb = wattempt.pop(min(self.windowSize, loci))
-            assert ta == tb, "\n".join((repr(ta), repr(tb)))
-            wattempt.insert(self.windowSize, token)
-            qattempt = (["/*<START>*/"] * max(0, self.windowSize-loci) +
-                        self.stringifyAll(wattempt) +
-                        ["/*<END>*/"] * max(0, (loci-len(lexemes))+self.windowSize+1))
-            assert len(qattempt) == (2*self.windowSize)+1, len(qattempt)
-            entropy = self.cm.queryCorpus(qattempt)
-            results.append((token, entropy))
+        left, right = self.replaceContext(lexemes, loci)
+        tokens, qattempts = self.candidateAttempts(
+            left, right, self.candidatesAt(lexemes, loci, left))
+        results = zip(tokens, self.cm.queryCorpusBatchIds(qattempts))
         bestresults = sorted(results, key=itemgetter(1), reverse=False)    
-        attempt = copy(lexemes)
-        attempt.pop(loci)
-        attempt.insert(loci,bestresults[0][0])
+        attempt = self.applyFix(lexemes, "Replace", loci, bestresults[0][0])
         assert len(attempt) == len(lexemes)
         if self.isValid(attempt):
             return (True, attempt, "Replace", loci, attempt[loci], bestresults[0][1])
         else:
             return (False, attempt, "Replace", loci, attempt[loci], bestresults[0][1])
 
-    def fixQuery(self, lexemes, location):
-        found = False
+    def findLocus(self, lexemes, location):
+        """The index of the lexeme that starts where location does."""
         for loci in range(0, len(lexemes)):
             if location.start == lexemes[loci].start:
-                found = True
-                break
-        assert found
+                return loci
+        assert False, "No lexeme starts at %s" % (location.start,)
+
+    def fixQuery(self, lexemes, location):
+        loci = self.findLocus(lexemes, location)
         #TODO: This is wrong and needs to be fixed, but its compatible
         # with the ICSME paper
         fixes = [(False, None, "None", loci, None, 1e70)]
@@ -258,5 +503,110 @@ class sourceModel(object):
         fixes = sorted(fixes, key=itemgetter(5), reverse=False)
         return fixes[0]
 
+    def suspiciousLoci(self, lexemes, n):
+        """
+        The indices of the n tokens of lexemes that the model finds most
+        surprising given the tokens before them, worst first. An edit is
+        most likely needed at, or just before, one of them.
+        """
+        padding = ["/*<START>*/"] * self.windowSize
+        logprobs = self.cm.tokenLogprobsIds(
+            self.cm.internAll(padding + self.stringifyAll(lexemes)))
+        logprobs = logprobs[len(padding):]
+        return sorted(range(0, len(lexemes)), key=lambda i: logprobs[i])[:n]
+
+    def scoreEdits(self, lexemes, loci, expected=None):
+        """
+        Every candidate edit at loci, as (op, string, change in the entropy
+        of the window around it). All of them are scored in one batch.
+        expected is lexemes.expected(), if the caller already has it.
+        """
+        if expected is None:
+            expected = lexemes.expected()
+        insertLeft, insertRight = self.insertContext(lexemes, loci)
+        replaceLeft, replaceRight = self.replaceContext(lexemes, loci)
+        current = lexemes[loci][4]
+        inserts = self.candidatesAt(lexemes, loci, insertLeft, expected)
+        replaces = [string
+                    for string in self.candidatesAt(lexemes, loci, replaceLeft,
+                                                    expected)
+                    if string != current]
+        qwindows = ([self.cm.internAll(insertLeft + insertRight),
+                     self.cm.internAll(replaceLeft + [current] + replaceRight),
+                     self.cm.internAll(replaceLeft + replaceRight)]
+                    + list(self.attemptIds(insertLeft, insertRight, inserts))
+                    + list(self.attemptIds(replaceLeft, replaceRight, replaces)))
+        entropies = self.cm.queryCorpusBatchIds(qwindows)
+        insertBefore, replaceBefore, deleted = entropies[:3]
+        entropies = entropies[3:]
+        return ([("Delete", None, deleted - replaceBefore)]
+                + [("Insert", string, entropy - insertBefore)
+                   for string, entropy in zip(inserts, entropies)]
+                + [("Replace", string, entropy - replaceBefore)
+                   for string, entropy
+                   in zip(replaces, entropies[len(inserts):])])
+
+    def beamFixQuery(self, lexemes, edits=2, beamWidth=8, nLoci=5,
+                     budget=None):
+        """
+        Searches for a repair of up to edits edits at the nLoci most
+        suspicious tokens, keeping the beamWidth best partial repairs at each
+        step. Each edit is scored by how much it changes the entropy of the
+        window around it, and a repair by the sum of those. Repairs that
+        come out the same are only kept once. The best valid repair with the
+        fewest edits wins: (True, fixed lexemes, [(op, loci, token), ...],
+        score), in the order they were made, with loci counted after the
+        edits before. If none is found within budget seconds the result is
+        (False, None, [], 1e70).
+        """
+        end = None if budget is None else time.time() + budget
+        def outOfTime():
+            return end is not None and time.time() >= end
+        none = (False, None, [], 1e70)
+        # The strings of the repairs we've already come across. Only a few
+        # beams' worth of children are ever looked at, so keeping them whole
+        # is cheap, and two different repairs can't be mistaken for each
+        # other.
+        seen = set([tuple(self.stringifyAll(lexemes))])
+        # (score, lexemes, edits) of each partial repair.
+        beam = [(0.0, lexemes, [])]
+        for depth in range(0, edits):
+            children = []
+            for score, state, stateEdits in beam:
+                # The parser only has to look at each state once.
+                expected = state.expected()
+                # What's suspicious changes with every edit.
+                for loci in self.suspiciousLoci(state, nLoci):
+                    if outOfTime():
+                        return none
+                    for op, string, change in self.scoreEdits(state, loci,
+                                                              expected):
+                        children.append((score + change, state, stateEdits,
+                                         op, loci, string))
+            children.sort(key=itemgetter(0))
+            beam = []
+            for score, state, stateEdits, op, loci, string in children:
+                if outOfTime():
+                    return none
+                token = (state[loci] if op == "Delete"
+                         else self.listOfUniqueTokens[string])
+                attempt = self.applyFix(state, op, loci, token)
+                strings = tuple(self.stringifyAll(attempt))
+                if strings in seen:
+                    continue
+                seen.add(strings)
+                if op != "Delete":
+                    token = attempt[loci]
+                beam.append((score, attempt, stateEdits + [(op, loci, token)]))
+                if len(beam) == beamWidth:
+                    break
+            for score, attempt, attemptEdits in beam:
+                if outOfTime():
+                    return none
+                if self.isValid(attempt):
+                    return (True, attempt, attemptEdits, score)
+        return none
+
     def release(self):
+        self.listOfUniqueTokens.waitForCompaction()
         self.cm.release()
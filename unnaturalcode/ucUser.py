@@ -34,7 +34,7 @@ class genericUser(object):
       assert os.access(self.ucDir, os.X_OK & os.R_OK & os.W_OK)
       assert os.path.isdir(self.ucDir)
   
-  def __init__(self, ngram_order=10):
+  def __init__(self, ngram_order=10, incremental=None, background=None):
       self.getHome()
       
       self.readCorpus = os.path.join(self.ucDir, 'genericCorpus') 
@@ -44,15 +44,17 @@ class genericUser(object):
             f.write(corpus)
       self.logFilePath = os.path.join(self.ucDir, 'genericLogFile')
       self.lm = genericSource
-      self.basicSetup(ngram_order)
+      self.basicSetup(ngram_order, incremental, background)
    
-  def basicSetup(self, ngram_order=10):
+  def basicSetup(self, ngram_order=10, incremental=None, background=None):
       self.uc = unnaturalCode(logFilePath=self.logFilePath)
       # Oiugh... thank you, dependecy injection.
       self.cm = mitlmCorpus(readCorpus=self.readCorpus,
                             writeCorpus=self.readCorpus,
                             uc=self.uc,
-                            order=ngram_order)
+                            order=ngram_order,
+                            incremental=incremental,
+                            background=background)
       self.sm = sourceModel(cm=self.cm, language=self.lm)
       
   def release(self):
@@ -67,7 +69,7 @@ class genericUser(object):
 
 class pyUser(genericUser):
   
-  def __init__(self, ngram_order=10):
+  def __init__(self, ngram_order=10, incremental=None, background=None):
       self.getHome()
       self.readCorpus = os.path.join(self.ucDir, 'pyCorpus') 
       if not os.path.exists(self.readCorpus):
@@ -76,5 +78,5 @@ class pyUser(genericUser):
             f.write(corpus)
       self.logFilePath = os.path.join(self.ucDir, 'pyLogFile')
       self.lm = pythonSource
-      self.basicSetup(ngram_order)
+      self.basicSetup(ngram_order, incremental, background)
       
@@ -16,7 +16,10 @@
 #    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
 # ------- UTILITY FUNCTIONS ---------------------------------------------------
 
-import os, sys, re, json
+import os, sys, re, json, threading, hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 
 def slurp(fn):
     return open(fn).read()
@@ -33,4 +36,122 @@ def singleton(cls):
             instances[cls] = cls(*a, **k)
         return instances[cls]
     return getinstance
-# End Public Domain
\ No newline at end of file
+# End Public Domain
+
+
+class lruCache(object):
+    """
+    Bounded least-recently-used cache of scores, keyed by sequences of token
+    ids. Everything in it is thrown away as soon as it's asked about a
+    different model generation than the one it was filled from. Sequences
+    are only kept as a digest of their ids, so an entry costs about the
+    same however long its sequence is.
+    """
+    def __init__(self, size=None):
+        if size is None:
+            size = int(os.getenv("ucWindowCache", "100000"))
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(ids):
+        return hashlib.sha1(np.asarray(ids, dtype=np.int64).tostring()).digest()
+
+    def lookup(self, requests, generation, compute):
+        """
+        Values for every request. The ones that aren't cached are computed
+        all at once by compute, which takes a list of requests and returns a
+        list of values.
+        """
+        if self.size <= 0:
+            self.misses += len(requests)
+            return compute(requests)
+        keys = [self.key(r) for r in requests]
+        values = [None] * len(keys)
+        missing = OrderedDict()
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    value = self.entries.pop(key)
+                    self.entries[key] = value
+                    values[i] = value
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+                    self.misses += 1
+        if len(missing) == 0:
+            return values
+        computed = compute([requests[indices[0]]
+                            for indices in missing.values()])
+        with self.lock:
+            # Don't keep the scores if the model changed while we were
+            # computing them.
+            store = (generation == self.generation)
+            for (key, indices), value in zip(missing.items(), computed):
+                for i in indices:
+                    values[i] = value
+                if store:
+                    self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return values
+
+class rwLock(object):
+    """
+    Any number of readers or one writer. A waiting writer keeps new readers
+    out, so a steady stream of readers can't starve it. A thread that
+    already reads can read again without waiting, since the writer is
+    waiting for it anyway. Writing isn't reentrant.
+    """
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        # How many times each thread that is reading holds the lock.
+        self.owners = {}
+        self.writing = False
+        self.writersWaiting = 0
+
+    @contextmanager
+    def reader(self):
+        me = threading.current_thread().ident
+        with self.cond:
+            if not self.owners.get(me):
+                while self.writing or self.writersWaiting:
+                    self.cond.wait()
+            self.owners[me] = self.owners.get(me, 0) + 1
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                self.owners[me] -= 1
+                if self.owners[me] == 0:
+                    del self.owners[me]
+                if self.readers == 0:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def writer(self):
+        with self.cond:
+            self.writersWaiting += 1
+            while self.writing or self.readers:
+                self.cond.wait()
+            self.writersWaiting -= 1
+            self.writing = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writing = False
+                self.cond.notify_all()
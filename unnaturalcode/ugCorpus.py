@@ -0,0 +1,414 @@
+#    Copyright 2013, 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An n-gram language model in unnaturalgrams, with the same interface as
+mitlmCorpus.
+
+unnaturalgrams keeps its counts in an LMDB database and updates them in
+place as it's trained, so the model never has to be re-estimated, survives
+restarts, and can be queried by any number of processes at once. Scores are
+interpolated modified Kneser-Ney, in natural logs like MITLM.
+
+Build the library with "make lib" in unnaturalgrams/, or point
+ucUnnaturalGramsLib at a copy of it.
+"""
+
+from __future__ import print_function
+import os
+import os.path
+import codecs
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from ctypes import (CDLL, POINTER, Structure, c_char_p, c_double, c_int,
+                    c_size_t, c_uint64, c_void_p)
+from ctypes.util import find_library
+from unnaturalcode.unnaturalCode import *
+from logging import debug, info, warning, error
+import numpy as np
+
+allWhitespace = re.compile('^\s+$')
+
+# Longest token unnaturalgrams can store, in bytes, including the NUL.
+MAX_WORD_LENGTH = 499
+
+# The id of every string the database hasn't been trained on. It goes to
+# unnaturalgrams as the empty string, which no lexeme can be.
+UNK = 0
+
+class ugFeature(Structure):
+    _fields_ = [("length", c_size_t), ("value", c_char_p)]
+
+class ugWord(Structure):
+    _fields_ = [("nAttributes", c_size_t), ("values", POINTER(ugFeature))]
+
+class ugWordWeighted(Structure):
+    _fields_ = [("nAttributes", c_size_t), ("weight", c_double),
+                ("values", POINTER(ugFeature))]
+
+class ugGram(Structure):
+    _fields_ = [("length", c_size_t), ("words", POINTER(ugWord))]
+
+class ugGramWeighted(Structure):
+    _fields_ = [("length", c_size_t), ("words", POINTER(ugWordWeighted))]
+
+class ugPrediction(Structure):
+    _fields_ = [("score", c_double), ("gram", ugGram)]
+
+class ugPredictions(Structure):
+    _fields_ = [("nPredictions", c_size_t),
+                ("predictions", POINTER(ugPrediction))]
+
+library = None
+
+def loadLibrary():
+    """Loads libunnaturalgrams, the first time it's needed."""
+    global library
+    if library is not None:
+        return library
+    path = os.getenv("ucUnnaturalGramsLib")
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "unnaturalgrams",
+            "libunnaturalgrams.so")
+        if not os.path.exists(path):
+            path = find_library("unnaturalgrams")
+    if path is None:
+        raise OSError("libunnaturalgrams not found: run make lib in "
+                      "unnaturalgrams/ or set ucUnnaturalGramsLib")
+    lib = CDLL(path)
+    # struct ug_Corpus *, which only unnaturalgrams looks inside.
+    corpus = c_void_p
+    lib.ug_createCorpusHandle.argtypes = [c_char_p, c_uint64, c_size_t]
+    lib.ug_createCorpusHandle.restype = corpus
+    lib.ug_openCorpusHandle.argtypes = [c_char_p]
+    lib.ug_openCorpusHandle.restype = corpus
+    lib.ug_closeCorpusHandle.argtypes = [corpus]
+    lib.ug_closeCorpusHandle.restype = None
+    lib.ug_corpusGeneration.argtypes = [corpus]
+    lib.ug_corpusGeneration.restype = c_uint64
+    lib.ug_addToCorpus.argtypes = [corpus, ugGramWeighted]
+    lib.ug_addToCorpus.restype = c_int
+    lib.ug_beginBulkLoad.argtypes = [corpus]
+    lib.ug_beginBulkLoad.restype = None
+    lib.ug_endBulkLoad.argtypes = [corpus]
+    lib.ug_endBulkLoad.restype = c_int
+    lib.ug_crossEntropy.argtypes = [corpus, ugGram]
+    lib.ug_crossEntropy.restype = c_double
+    lib.ug_tokenLogprobs.argtypes = [corpus, ugGram, POINTER(c_double)]
+    lib.ug_tokenLogprobs.restype = None
+    lib.ug_vocabIds.argtypes = [corpus, ugGram, POINTER(c_uint64)]
+    lib.ug_vocabIds.restype = None
+    lib.ug_predict.argtypes = [corpus, ugGram, c_size_t, c_size_t, ugGram,
+                               c_size_t]
+    lib.ug_predict.restype = ugPredictions
+    lib.ug_freePredictions.argtypes = [ugPredictions]
+    lib.ug_freePredictions.restype = None
+    library = lib
+    return library
+
+
+class ugCorpus(object):
+    """
+    unnaturalgrams n-gram model. Drop-in replacement for mitlmCorpus.
+
+    The database lives next to writeCorpus, in writeCorpus + ".ug". It's
+    created the first time it's needed, from whatever is in readCorpus.
+    """
+
+    def __init__(self, readCorpus=None, writeCorpus=None, uc=unnaturalCode(), order=10,
+                 windowCache=None):
+        self.readCorpus = (readCorpus or os.getenv("ucCorpus", "/tmp/ucCorpus"))
+        self.writeCorpus = (writeCorpus or os.getenv("ucWriteCorpus", self.readCorpus))
+        self.path = self.writeCorpus + ".ug"
+        self.order = order
+        self.corpus = None
+        # The process that opened self.corpus. LMDB handles can't be used
+        # across a fork, so children open their own.
+        self.pid = None
+        # unnaturalgrams isn't thread-safe; every call into it holds this.
+        self.lock = threading.RLock()
+        self.loading = False
+        self.vocab = {}
+        self.words = [u'<unk>']
+        # words, encoded the way unnaturalgrams wants them.
+        self.encoded = [ugFeature(1, b"")]
+        self.vocabLock = threading.Lock()
+        # Bumped every time this process trains the model. Training in a
+        # bulk load isn't in the database (so doesn't change its generation)
+        # until it's over, but is already scored.
+        self.trained = 0
+        # Scores of recently queried windows, for this generation.
+        self.windowCache = lruCache(windowCache)
+
+    def corpify(self, lexemes):
+        """Stringify lexed source: produce space-seperated sequence of lexemes"""
+        assert isinstance(lexemes, list)
+        assert len(lexemes)
+        return u" ".join(lexemes)
+
+    def openCorpus(self):
+        """Opens the database (if necessary), creating it if it's missing."""
+        if self.corpus is not None and self.pid == os.getpid():
+            return self.corpus
+        lib = loadLibrary()
+        self.pid = os.getpid()
+        if os.path.exists(self.path):
+            self.corpus = lib.ug_openCorpusHandle(self.path.encode("UTF-8"))
+            return self.corpus
+        info("Creating %s" % self.path)
+        self.corpus = lib.ug_createCorpusHandle(self.path.encode("UTF-8"), 1,
+                                                self.order)
+        if os.path.exists(self.readCorpus):
+            with self.bulkLoad():
+                with codecs.open(self.readCorpus, 'r', encoding='UTF-8') as f:
+                    for line in f:
+                        words = line.split()
+                        if len(words):
+                            self.train(self.learn(words))
+        return self.corpus
+
+    def closeCorpus(self):
+        """Closes the database (if necessary)"""
+        with self.lock:
+            if self.corpus is not None and self.pid == os.getpid():
+                loadLibrary().ug_closeCorpusHandle(self.corpus)
+            self.corpus = None
+
+    @property
+    def generation(self):
+        """
+        Changes every time the model does, whichever process trained it.
+        """
+        with self.lock:
+            return (loadLibrary().ug_corpusGeneration(self.openCorpus()),
+                    self.trained)
+
+    @contextmanager
+    def bulkLoad(self):
+        """
+        Training done inside this is kept in memory and written to the
+        database in one go, in order, at the end. Much faster for loading a
+        lot of code at once; other threads wait for it to finish. If another
+        process trains the database meanwhile, the load is thrown away and
+        RuntimeError raised, rather than overwriting what it added.
+        """
+        with self.lock:
+            if self.loading:
+                yield
+                return
+            lib = loadLibrary()
+            lib.ug_beginBulkLoad(self.openCorpus())
+            self.loading = True
+            try:
+                yield
+            finally:
+                self.loading = False
+                conflict = lib.ug_endBulkLoad(self.corpus) != 0
+            if conflict:
+                # What was scored during the load is gone.
+                self.trained += 1
+                raise RuntimeError("%s changed during a bulk load; "
+                                   "nothing was loaded" % self.path)
+
+    def add(self, string):
+        """Add string to the vocabulary and return its id. Hold vocabLock."""
+        j = len(self.words)
+        self.vocab[string] = j
+        self.words.append(string)
+        value = string.encode("UTF-8")[:MAX_WORD_LENGTH - 2]
+        self.encoded.append(ugFeature(len(value) + 1, value))
+        return j
+
+    def learn(self, strings):
+        """
+        Ids of strings that are about to be trained on, as an array, adding
+        the ones we haven't seen before to the vocabulary.
+        """
+        vocab = self.vocab
+        ids = np.empty(len(strings), dtype=np.int64)
+        with self.vocabLock:
+            for i, string in enumerate(strings):
+                j = vocab.get(string)
+                if j is None:
+                    j = self.add(string)
+                ids[i] = j
+        return ids
+
+    def internAll(self, strings):
+        """
+        Ids of strings, as an array. Strings we haven't seen before are added
+        to the vocabulary if the database has been trained on them (by any
+        process), and are UNK otherwise, so querying never grows the
+        vocabulary. These ids are only ever used by this object; the
+        database has its own.
+        """
+        vocab = self.vocab
+        ids = np.empty(len(strings), dtype=np.int64)
+        unseen = OrderedDict()
+        with self.vocabLock:
+            for i, string in enumerate(strings):
+                j = vocab.get(string)
+                if j is None:
+                    unseen.setdefault(string, []).append(i)
+                else:
+                    ids[i] = j
+        if len(unseen) == 0:
+            return ids
+        words = list(unseen.keys())
+        features = [string.encode("UTF-8")[:MAX_WORD_LENGTH - 2]
+                    for string in words]
+        features = [ugFeature(len(value) + 1, value) for value in features]
+        gram = (ugWord * len(words))()
+        for i, feature in enumerate(features):
+            gram[i].nAttributes = 1
+            gram[i].values = POINTER(ugFeature)(feature)
+        known = (c_uint64 * len(words))()
+        with self.lock:
+            loadLibrary().ug_vocabIds(self.openCorpus(),
+                                      ugGram(len(words), gram), known)
+        with self.vocabLock:
+            for string, k in zip(words, known):
+                j = vocab.get(string)
+                if j is None:
+                    j = UNK if k == 0 else self.add(string)
+                for i in unseen[string]:
+                    ids[i] = j
+        return ids
+
+    def toGram(self, ids):
+        """A ug_Gram of interned ids."""
+        ids = list(ids)
+        words = (ugWord * max(len(ids), 1))()
+        for i, j in enumerate(ids):
+            words[i].nAttributes = 1
+            words[i].values = POINTER(ugFeature)(self.encoded[j])
+        return ugGram(len(ids), words)
+
+    def train(self, ids):
+        """Adds a sentence of interned ids to the database."""
+        words = (ugWordWeighted * len(ids))()
+        for i, j in enumerate(ids):
+            words[i].nAttributes = 1
+            words[i].weight = 1.0
+            words[i].values = POINTER(ugFeature)(self.encoded[j])
+        with self.lock:
+            loadLibrary().ug_addToCorpus(self.openCorpus(),
+                                         ugGramWeighted(len(ids), words))
+            self.trained += 1
+
+    def addToCorpus(self, lexemes):
+        """Adds a string of lexemes to the corpus"""
+        assert isinstance(lexemes, list)
+        assert len(lexemes)
+        cl = self.corpify(lexemes)
+        assert(len(cl))
+        assert (not allWhitespace.match(cl)), "Adding blank line to corpus!"
+        self.train(self.learn(cl.split()))
+
+    def addManyToCorpus(self, sentences):
+        """
+        Adds every string of lexemes in sentences (which may be a generator)
+        to the corpus in one bulk load.
+        """
+        with self.bulkLoad():
+            for lexemes in sentences:
+                self.addToCorpus(lexemes)
+
+    def queryCorpus(self, request):
+        """Cross-entropy of request, in nats per token like MITLM."""
+        return self.queryCorpusIds(self.internAll(request))
+
+    def queryCorpusBatch(self, requests):
+        """Like queryCorpus, but for a list of requests."""
+        return self.queryCorpusBatchIds([self.internAll(r) for r in requests])
+
+    def tokenLogprobs(self, request):
+        """
+        Returns the natural log-probability of every token in request given
+        the tokens before it.
+        """
+        return self.tokenLogprobsIds(self.internAll(request))
+
+    def queryCorpusIds(self, ids):
+        """Like queryCorpus, for an array of ids from internAll."""
+        return self.queryCorpusBatchIds([ids])[0]
+
+    def queryCorpusBatchIds(self, requests):
+        """Like queryCorpusBatch, for arrays of ids from internAll."""
+        if len(requests) == 0:
+            return []
+        def compute(requests):
+            lib = loadLibrary()
+            with self.lock:
+                corpus = self.openCorpus()
+                return [lib.ug_crossEntropy(corpus, self.toGram(request))
+                        for request in requests]
+        # Keyed on the database's generation, so training in other
+        # processes is seen too.
+        return self.windowCache.lookup(requests, self.generation, compute)
+
+    def tokenLogprobsIds(self, ids):
+        """Like tokenLogprobs, for an array of ids from internAll."""
+        # The last one is for the end of the sentence.
+        logprobs = (c_double * (len(ids) + 1))()
+        with self.lock:
+            loadLibrary().ug_tokenLogprobs(self.openCorpus(),
+                                           self.toGram(ids), logprobs)
+        return list(logprobs)[:-1]
+
+    def predictCorpus(self, lexemes, k=10):
+        """
+        The k most likely next tokens after lexemes, as a list of
+        (token, logprob), most likely first.
+        """
+        return self.predictCorpusBatch([lexemes], k)[0]
+
+    def predictCorpusBatch(self, requests, k=10):
+        """predictCorpus for a list of prefixes."""
+        return self.predictCorpusBatchIds(
+            [self.internAll(request) for request in requests], k)
+
+    def predictCorpusBatchIds(self, requests, k=10):
+        """Like predictCorpusBatch, for arrays of ids from internAll."""
+        lib = loadLibrary()
+        results = []
+        with self.lock:
+            if self.loading:
+                raise RuntimeError("Can't predict during a bulk load")
+            corpus = self.openCorpus()
+            for request in requests:
+                predictions = lib.ug_predict(corpus, self.toGram(request),
+                                             1, 1, self.toGram([]), k)
+                try:
+                    results.append([
+                        (p.gram.words[0].values[0].value.decode("UTF-8"),
+                         p.score)
+                        for p in predictions.predictions[
+                            :predictions.nPredictions]])
+                finally:
+                    lib.ug_freePredictions(predictions)
+        return results
+
+    def release(self):
+        """Close the database"""
+        self.closeCorpus()
+
+    def __del__(self):
+        """I am a destructor, but release should be called explictly."""
+        assert self.corpus is None, "Destructor called before release()"
@@ -0,0 +1,299 @@
+#    Copyright 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+The unique tokens a sourceModel has been trained on: one example lexeme of
+each, and how many times each has been seen.
+
+They're kept in an append-only log next to the corpus. Training appends a
+record for each token in what it trained on, and never reads or rewrites the
+rest, so training on lots of files one at a time doesn't write the whole
+vocabulary out again for every one. The log is only read the first time
+somebody asks about the tokens. Once it has grown to several times the size
+it was last compacted to, it's compacted to one record per token on a
+background thread, while training carries on appending. Appends and the end
+of a compaction lock the log with flock, so other processes training on the
+same corpus don't lose what they append either.
+
+Corpora trained before the log existed have a pickle of the tokens instead.
+It's read once and written out as a log.
+"""
+
+import os
+import sys
+import fcntl
+import pickle
+import threading
+from contextlib import contextmanager
+from logging import debug, info, warning, error
+
+def countTokens(lexemes, tokens=None, counts=None):
+    """
+    The first lexeme of each token in lexemes and how many times it's
+    there, added to tokens and counts if given.
+    """
+    if tokens is None:
+        tokens = {}
+        counts = {}
+    for l in lexemes:
+        if l[4] not in tokens:
+            tokens[l[4]] = l
+            counts[l[4]] = 0
+        counts[l[4]] += 1
+    return (tokens, counts)
+
+class uniqueTokens(object):
+
+    # Compact the log once it's this many times the size it was compacted
+    # to, and at least COMPACT_AFTER bytes.
+    COMPACT_RATIO = 4
+    COMPACT_AFTER = 1 << 20
+
+    def __init__(self, readPath, writePath=None):
+        """
+        readPath and writePath are where the pickles used to go; the logs
+        are named after them.
+        """
+        self.readPath = readPath
+        self.writePath = writePath or readPath
+        self.readLog = self.readPath + ".log"
+        self.writeLog = self.writePath + ".log"
+        # string -> the first lexeme we saw of it, and how many times we've
+        # seen it. None until somebody needs them.
+        self.tokens = None
+        self.counts = None
+        self.lock = threading.RLock()
+        self.compactor = None
+        if (self.readLog == self.writeLog
+            and not os.path.exists(self.writeLog)
+            and os.path.isfile(self.readPath)):
+            self.migrate()
+        self.size = self.logSize()
+        self.compactedSize = self.size
+
+    def logSize(self):
+        if os.path.exists(self.writeLog):
+            return os.path.getsize(self.writeLog)
+        return 0
+
+    @contextmanager
+    def lockedLog(self):
+        """
+        The log, open for appending and locked against other processes.
+        Compacting replaces the log, so if it was replaced while we waited
+        for the lock, the new one is locked instead.
+        """
+        while True:
+            f = open(self.writeLog, 'ab')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    current = os.stat(self.writeLog).st_ino
+                except OSError:
+                    current = None
+                if current == os.fstat(f.fileno()).st_ino:
+                    yield f
+                    return
+            finally:
+                # Which unlocks it.
+                f.close()
+
+    def readRecords(self, path, end=None):
+        """
+        The tokens and counts in the log at path, up to byte end. A record
+        cut short (by a crash while it was being appended) ends the log.
+        """
+        tokens = {}
+        counts = {}
+        with open(path, 'rb') as f:
+            if end is None:
+                end = os.fstat(f.fileno()).st_size
+            while f.tell() < end:
+                try:
+                    count, lexeme = pickle.load(f)
+                except Exception:
+                    warning("Ignoring the end of %s from byte %d."
+                            % (path, f.tell()))
+                    break
+                if lexeme[4] not in tokens:
+                    tokens[lexeme[4]] = lexeme
+                    counts[lexeme[4]] = 0
+                counts[lexeme[4]] += count
+        return (tokens, counts)
+
+    def records(self, tokens, counts):
+        """tokens and counts as log records, in one string."""
+        return "".join(pickle.dumps((counts[string], lexeme), 2)
+                       for string, lexeme in tokens.items())
+
+    def writeRecords(self, path, data):
+        """Replace the log at path with data all at once."""
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def migrate(self):
+        """Write the legacy pickle at readPath out as a log."""
+        with open(self.readPath, 'rb') as f:
+            tokens = pickle.load(f)
+        info("Migrating %d unique tokens from %s to %s."
+             % (len(tokens), self.readPath, self.writeLog))
+        # The pickle didn't count them.
+        counts = dict((string, 1) for string in tokens)
+        self.writeRecords(self.writeLog, self.records(tokens, counts))
+
+    def load(self):
+        """Read the tokens, if we haven't already."""
+        with self.lock:
+            if self.tokens is not None:
+                return
+            if os.path.exists(self.readLog):
+                tokens, counts = self.readRecords(self.readLog)
+            elif os.path.isfile(self.readPath):
+                with open(self.readPath, 'rb') as f:
+                    tokens = pickle.load(f)
+                counts = dict((string, 1) for string in tokens)
+            else:
+                tokens, counts = ({}, {})
+            if self.readLog != self.writeLog:
+                # What we write starts with everything we read, like it
+                # did when the whole pickle was written every time.
+                self.writeRecords(self.writeLog, self.records(tokens, counts))
+                self.size = self.compactedSize = self.logSize()
+            self.tokens = tokens
+            self.counts = counts
+
+    def reload(self):
+        """
+        Read the tokens again, picking up what other processes appended to
+        the log since we read it.
+        """
+        with self.lock:
+            if self.tokens is None:
+                return self.load()
+            # Once loaded, what we write holds everything we read too.
+            if os.path.exists(self.writeLog):
+                tokens, counts = self.readRecords(self.writeLog)
+            else:
+                tokens, counts = ({}, {})
+            self.tokens = tokens
+            self.counts = counts
+
+    def add(self, lexemes):
+        """Count lexemes, keeping the first one of each token."""
+        self.addCounts(*countTokens(lexemes))
+
+    def addCounts(self, tokens, counts):
+        """
+        Add counts of tokens (like countTokens gives), keeping the first
+        lexeme we see of each.
+        """
+        data = self.records(tokens, counts)
+        with self.lock:
+            if self.readLog != self.writeLog:
+                self.load()
+            with self.lockedLog() as f:
+                f.write(data)
+                f.flush()
+                # Other processes append to it too.
+                self.size = os.fstat(f.fileno()).st_size
+            if self.tokens is not None:
+                for string, lexeme in tokens.items():
+                    if string not in self.tokens:
+                        self.tokens[string] = lexeme
+                        self.counts[string] = 0
+                    self.counts[string] += counts[string]
+            if (self.compactor is None
+                and self.size >= max(self.COMPACT_AFTER,
+                                     self.COMPACT_RATIO * self.compactedSize)):
+                self.compactor = threading.Thread(
+                    target=self.backgroundCompact)
+                self.compactor.daemon = True
+                self.compactor.start()
+
+    def compact(self):
+        """
+        Rewrite the log with one record per token. Records appended while
+        we're at it, by any process, are kept.
+        """
+        with self.lock:
+            with open(self.writeLog, 'rb') as f:
+                log = os.fstat(f.fileno())
+            end = log.st_size
+        tokens, counts = self.readRecords(self.writeLog, end)
+        data = self.records(tokens, counts)
+        with self.lock:
+            with self.lockedLog() as f:
+                if os.fstat(f.fileno()).st_ino != log.st_ino:
+                    # Another process compacted it first.
+                    self.size = self.compactedSize = self.logSize()
+                    return
+                with open(self.writeLog, 'rb') as appended:
+                    appended.seek(end)
+                    rest = appended.read()
+                self.writeRecords(self.writeLog, data + rest)
+            self.compactedSize = len(data)
+            self.size = len(data) + len(rest)
+        debug("Compacted %s from %d to %d bytes."
+              % (self.writeLog, end, len(data)))
+
+    def backgroundCompact(self):
+        """Runs on the compactor thread."""
+        try:
+            self.compact()
+        except Exception:
+            error("Compacting %s failed." % self.writeLog,
+                  exc_info=sys.exc_info())
+        finally:
+            with self.lock:
+                self.compactor = None
+
+    def waitForCompaction(self):
+        """Block until a background compaction (if any) is done."""
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+
+    def count(self, string):
+        """How many times we've seen string."""
+        self.load()
+        return self.counts.get(string, 0)
+
+    def __contains__(self, string):
+        self.load()
+        return string in self.tokens
+
+    def __getitem__(self, string):
+        self.load()
+        return self.tokens[string]
+
+    def __len__(self):
+        self.load()
+        return len(self.tokens)
+
+    def __iter__(self):
+        self.load()
+        return iter(self.tokens)
+
+    def keys(self):
+        self.load()
+        return self.tokens.keys()
+
+    def items(self):
+        self.load()
+        return self.tokens.items()
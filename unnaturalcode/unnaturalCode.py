@@ -335,6 +335,23 @@ class ucSource(list):
 
     def scrubbed(self):
         raise NotImplementedError
+
+    def restarts(self):
+        """
+        The indices of the lexemes that lexing (and scrubbing) the code from
+        the start of the line they're on gives the same lexemes as the whole
+        code does from there on, in order. Lexeme 0 always is one.
+        """
+        return [0]
+
+    def expected(self):
+        """
+        Where a parser gives up on this source, as an index into it, and the
+        (type, string) of every token it would have accepted there instead.
+        A string of None means any token of that type. (None, set()) if it
+        parses or we can't tell.
+        """
+        return (None, set())
         
     if ucParanoid:
         def __setitem__(self, index, value):
@@ -75,9 +75,11 @@ def main(mode="wrap"):
     from unnaturalcode.ucUser import pyUser
     ucpy = pyUser()
     
-    worst = ucpy.sm.worstWindows(ucpy.lm(source))
-    print("Suggest checking around %s:%d:%d" % (program, worst[0][0][10][2][0], worst[0][0][10][2][1]), file=sys.stderr)
-    print("Near:\n" + ucpy.lm(worst[0][0]).settle().deLex())
+    lexemes = ucpy.lm(source).scrubbed()
+    start, end, entropy = ucpy.sm.worstRegions(lexemes, 1)[0]
+    middle = lexemes[(start+end)//2]
+    print("Suggest checking around %s:%d:%d" % (program, middle[2][0], middle[2][1]), file=sys.stderr)
+    print("Near:\n" + ucpy.lm(lexemes[start:end]).settle().deLex())
     
     ucpy.release()
     
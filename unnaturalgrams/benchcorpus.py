@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#    Copyright 2014 Joshua Charles Campbell
+#
+#    This file is part of UnnaturalCode.
+#    
+#    UnnaturalCode is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    UnnaturalCode is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Writes the token corpus ugbench loads: every file of the test project
+(unnaturalcode/testdata, or $TEST_FILE_LIST) lexed and padded just as
+sourceModel.trainLexemes would train it, one file a line.
+
+    PYTHONPATH=.. python benchcorpus.py > bench-corpus.txt
+"""
+
+import codecs
+import sys
+from logging import warning
+
+from unnaturalcode.ucUtil import slurp
+from unnaturalcode.pythonSource import pythonSource
+from unnaturalcode.ucTestData import testProjectFiles
+
+WINDOW_SIZE = 20
+
+def main():
+    out = codecs.getwriter('UTF-8')(sys.stdout)
+    for path in sorted(testProjectFiles):
+        try:
+            lexemes = pythonSource(slurp(path)).scrubbed()
+        except Exception as e:
+            warning("Skipping %s: %s" % (path, e))
+            continue
+        strings = [l[4] for l in lexemes]
+        if not len(strings):
+            continue
+        strings = (["/*<START>*/"] * WINDOW_SIZE
+                   + strings
+                   + ["/*<END>*/"] * WINDOW_SIZE)
+        out.write(u" ".join(strings) + u"\n")
+
+if __name__ == '__main__':
+    main()
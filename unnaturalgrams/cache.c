@@ -0,0 +1,240 @@
+/* cache.c -- In-process caches for UnnaturalGrams
+ * 
+ * Copyright 2014 Joshua Charles Campbell
+ *
+ * This file is part of UnnaturalCode.
+ *
+ * UnnaturalCode is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * UnnaturalCode is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <string.h>
+#include <stdlib.h>
+#include "copper.h"
+#include "cache.h"
+#include "kvtable.h"
+#include "db.h"
+
+#define ug_NO_BLOCK ((size_t) -1)
+
+static void ug_emptyCache(struct ug_Cache * cache) {
+  if (cache->lookups != NULL) {
+    ug_freeKVTable(cache->lookups);
+  }
+  if (cache->blockSlots != NULL) {
+    ug_freeKVTable(cache->blockSlots);
+  }
+  cache->lookups = ug_newKVTable();
+  cache->blockSlots = ug_newKVTable();
+  cache->nBlocks = 0;
+  cache->newest = ug_NO_BLOCK;
+  cache->oldest = ug_NO_BLOCK;
+}
+
+void ug_syncCache(struct ug_Corpus * corpus, uint64_t generation) {
+  if (corpus->cache == NULL) {
+    ASYS(( (corpus->cache = calloc(1, sizeof(struct ug_Cache))) != NULL ));
+    ug_emptyCache(corpus->cache);
+  } else if (corpus->cache->generation != generation) {
+    ug_emptyCache(corpus->cache);
+  }
+  corpus->cache->generation = generation;
+}
+
+void ug_clearCache(struct ug_Corpus * corpus) {
+  if (corpus->cache != NULL) {
+    ug_emptyCache(corpus->cache);
+  }
+}
+
+void ug_freeCache(struct ug_Corpus * corpus) {
+  if (corpus->cache == NULL) {
+    return;
+  }
+  ug_freeKVTable(corpus->cache->lookups);
+  ug_freeKVTable(corpus->cache->blockSlots);
+  free(corpus->cache->blocks);
+  free(corpus->cache);
+  corpus->cache = NULL;
+}
+
+static void ug_cacheUInt64(struct ug_Cache * cache,
+                           size_t keyLength, void * keyData,
+                           uint64_t value)
+{
+  if (cache->lookups->nEntries >= ug_MAX_CACHED_LOOKUPS) {
+    ug_freeKVTable(cache->lookups);
+    cache->lookups = ug_newKVTable();
+  }
+  memcpy(ug_putKV(cache->lookups, keyLength, keyData, sizeof(value)),
+         &value, sizeof(value));
+}
+
+uint64_t ug_readCachedUInt64OrZero(struct ug_Corpus * corpus,
+                                   size_t keyLength, void * keyData)
+{
+  struct ug_KVEntry * entry = NULL;
+  uint64_t value = 0;
+  
+  Ad(( corpus->cache != NULL ));
+  entry = ug_findKV(corpus->cache->lookups, keyLength, keyData);
+  if (entry != NULL) {
+    memcpy(&value, ug_KV_VALUE(entry), sizeof(value));
+    return value;
+  }
+  value = ug_readUInt64OrZero(corpus, keyLength, keyData);
+  ug_cacheUInt64(corpus->cache, keyLength, keyData, value);
+  return value;
+}
+
+void ug_writeCachedUInt64(struct ug_Corpus * corpus,
+                          size_t keyLength, void * keyData,
+                          uint64_t value)
+{
+  Ad(( corpus->cache != NULL ));
+  ug_writeUInt64(corpus, keyLength, keyData, value);
+  ug_cacheUInt64(corpus->cache, keyLength, keyData, value);
+}
+
+static void ug_unlinkBlock(struct ug_Cache * cache, size_t i) {
+  struct ug_CachedBlock * block = &(cache->blocks[i]);
+  if (block->newer == ug_NO_BLOCK) {
+    cache->newest = block->older;
+  } else {
+    cache->blocks[block->newer].older = block->older;
+  }
+  if (block->older == ug_NO_BLOCK) {
+    cache->oldest = block->newer;
+  } else {
+    cache->blocks[block->older].newer = block->newer;
+  }
+}
+
+static void ug_linkNewestBlock(struct ug_Cache * cache, size_t i) {
+  struct ug_CachedBlock * block = &(cache->blocks[i]);
+  block->newer = ug_NO_BLOCK;
+  block->older = cache->newest;
+  if (cache->newest == ug_NO_BLOCK) {
+    cache->oldest = i;
+  } else {
+    cache->blocks[cache->newest].newer = i;
+  }
+  cache->newest = i;
+}
+
+struct ug_VectorElement * ug_findCachedBlock(struct ug_Corpus * corpus,
+                                             struct ug_VectorKey key)
+{
+  struct ug_Cache * cache = corpus->cache;
+  struct ug_KVEntry * entry = NULL;
+  size_t i = 0;
+  
+  Ad(( cache != NULL ));
+  entry = ug_findKV(cache->blockSlots, sizeof(key), &key);
+  if (entry == NULL) {
+    return NULL;
+  }
+  memcpy(&i, ug_KV_VALUE(entry), sizeof(i));
+  if (i != cache->newest) {
+    ug_unlinkBlock(cache, i);
+    ug_linkNewestBlock(cache, i);
+  }
+  return cache->blocks[i].elements;
+}
+
+struct ug_VectorElement * ug_newCachedBlock(struct ug_Corpus * corpus,
+                                            struct ug_VectorKey key)
+{
+  struct ug_Cache * cache = corpus->cache;
+  size_t i = 0;
+  
+  Ad(( cache != NULL ));
+  if (cache->blocks == NULL) {
+    ASYS(( (
+      cache->blocks = malloc(sizeof(struct ug_CachedBlock) * ug_CACHED_BLOCKS)
+    ) != NULL ));
+  }
+  if (cache->nBlocks < ug_CACHED_BLOCKS) {
+    i = cache->nBlocks++;
+  } else {
+    i = cache->oldest;
+    ug_unlinkBlock(cache, i);
+    ug_removeKV(cache->blockSlots,
+                sizeof(cache->blocks[i].key), &(cache->blocks[i].key));
+  }
+  cache->blocks[i].key = key;
+  ug_linkNewestBlock(cache, i);
+  memcpy(ug_putKV(cache->blockSlots, sizeof(key), &key, sizeof(i)),
+         &i, sizeof(i));
+  return cache->blocks[i].elements;
+}
+
+void ug_forgetCachedBlocks(struct ug_Corpus * corpus) {
+  struct ug_Cache * cache = corpus->cache;
+  if (cache == NULL) {
+    return;
+  }
+  ug_freeKVTable(cache->blockSlots);
+  cache->blockSlots = ug_newKVTable();
+  cache->nBlocks = 0;
+  cache->newest = ug_NO_BLOCK;
+  cache->oldest = ug_NO_BLOCK;
+}
+
+TEST({
+  struct ug_Corpus c;
+  struct ug_VectorKey key;
+  struct ug_VectorElement * block = NULL;
+  uint64_t lookup = 12345;
+  size_t i = 0;
+  
+  memset(&c, 0, sizeof(c));
+  ug_syncCache(&c, 7);
+  A(( c.cache != NULL ));
+  key.magic = ug_VECTOR;
+  key.attributeID = 0;
+  key.gramOrder = 1;
+  
+  /* The least recently used block goes first. */
+  for (i = 0; i < ug_CACHED_BLOCKS; i++) {
+    key.startOffset = i * ug_BLOCKSIZE;
+    block = ug_newCachedBlock(&c, key);
+    block[0].vocab = i;
+  }
+  key.startOffset = 0;
+  A(( ug_findCachedBlock(&c, key) != NULL ));
+  key.startOffset = ug_CACHED_BLOCKS * ug_BLOCKSIZE;
+  ug_newCachedBlock(&c, key)[0].vocab = ug_CACHED_BLOCKS;
+  key.startOffset = 0;
+  A(( ug_findCachedBlock(&c, key) != NULL ));
+  key.startOffset = ug_BLOCKSIZE;
+  A(( ug_findCachedBlock(&c, key) == NULL ));
+  for (i = 2; i <= ug_CACHED_BLOCKS; i++) {
+    key.startOffset = i * ug_BLOCKSIZE;
+    block = ug_findCachedBlock(&c, key);
+    A(( block != NULL && block[0].vocab == i ));
+  }
+  
+  ug_forgetCachedBlocks(&c);
+  key.startOffset = 0;
+  A(( ug_findCachedBlock(&c, key) == NULL ));
+  
+  /* Lookups survive until the generation changes. */
+  ug_cacheUInt64(c.cache, sizeof(lookup), &lookup, 1);
+  ug_syncCache(&c, 7);
+  A(( ug_findKV(c.cache->lookups, sizeof(lookup), &lookup) != NULL ));
+  ug_syncCache(&c, 8);
+  A(( ug_findKV(c.cache->lookups, sizeof(lookup), &lookup) == NULL ));
+  ug_freeCache(&c);
+  A(( c.cache == NULL ));
+});
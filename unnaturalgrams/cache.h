@@ -0,0 +1,79 @@
+/* cache.h -- In-process caches for UnnaturalGrams
+ * 
+ * Copyright 2014 Joshua Charles Campbell
+ *
+ * This file is part of UnnaturalCode.
+ *
+ * UnnaturalCode is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * UnnaturalCode is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef _CACHE_H_
+#define _CACHE_H_
+
+#include <stddef.h>
+#include <stdint.h>
+#include "corpus.h"
+#include "hgvector.h"
+
+/* Lookups (of vocab IDs and gram indexes) cached before they're all thrown
+ * out, and decoded blocks kept. */
+#define ug_MAX_CACHED_LOOKUPS (1 << 18)
+#define ug_CACHED_BLOCKS (1024)
+
+struct ug_CachedBlock {
+  struct ug_VectorKey key;
+  size_t newer;
+  size_t older;
+  struct ug_VectorElement elements[ug_BLOCKSIZE];
+};
+
+/* What a corpus handle has read from the database, for as long as nothing
+ * has been committed to it. Every write transaction bumps the "generation"
+ * in the database, and every transaction starts by checking it, so writes
+ * from other handles and processes are noticed too. */
+struct ug_Cache {
+  uint64_t generation;
+  struct ug_KVTable * lookups; /* key -> uint64_t, 0 if it isn't there */
+  struct ug_KVTable * blockSlots; /* VectorKey -> index into blocks */
+  size_t nBlocks;
+  size_t newest; /* least recently used blocks are evicted first */
+  size_t oldest;
+  struct ug_CachedBlock * blocks; /* [ug_CACHED_BLOCKS] */
+};
+
+/* Makes the cache good for generation, emptying it if it was filled at
+ * another one. */
+void ug_syncCache(struct ug_Corpus * corpus, uint64_t generation);
+void ug_clearCache(struct ug_Corpus * corpus);
+void ug_freeCache(struct ug_Corpus * corpus);
+
+/* ug_readUInt64OrZero and ug_writeUInt64, through the cache. Only for keys
+ * whose values never change once written. */
+uint64_t ug_readCachedUInt64OrZero(struct ug_Corpus * corpus,
+                                   size_t keyLength, void * keyData);
+void ug_writeCachedUInt64(struct ug_Corpus * corpus,
+                          size_t keyLength, void * keyData,
+                          uint64_t value);
+
+/* A decoded block, keyed by its first index, or NULL. Good until the next
+ * ug_newCachedBlock. */
+struct ug_VectorElement * ug_findCachedBlock(struct ug_Corpus * corpus,
+                                             struct ug_VectorKey key);
+/* Room for a block to be decoded into, evicting another if need be. */
+struct ug_VectorElement * ug_newCachedBlock(struct ug_Corpus * corpus,
+                                            struct ug_VectorKey key);
+/* Called whenever chunks are written. */
+void ug_forgetCachedBlocks(struct ug_Corpus * corpus);
+
+#endif /* _CACHE_H_ */
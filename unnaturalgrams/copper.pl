@@ -175,7 +175,7 @@ if ($command eq 'makefile') {
 	print "copper_tests.c: $input_files\n";
 	print "\t$0 tests \$+ >\$\@\n\n";
 	print "$tester_name: copper_tests.c copper-internal.c copper.c $object_files\n";
-	print "\t\${CC} \${CFLAGS} \${CPPFLAGS} -o $tester_name \$+\n\n";
+	print "\t\${CC} \${CFLAGS} \${CPPFLAGS} -o $tester_name \$+ \${LDFLAGS} \${LDLIBS}\n\n";
 	foreach my $i (0..$#tests) {
 		print "$functions[$i]: $tester_name \n";
 		print "\t$tester_name $i\n";
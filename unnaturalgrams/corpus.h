@@ -23,6 +23,10 @@
 
 #include "ug.h"
 
+struct ug_DirtyChunks;
+struct ug_KVTable;
+struct ug_Cache;
+
 /* Instance/Context for a UG corpus */
 struct ug_Corpus {
   ug_AttributeID nAttributes;
@@ -33,7 +37,11 @@ struct ug_Corpus {
   MDB_txn * mdbTxn;
   int readOnlyTxn;
   int inTxn;
-  struct ug_VectorElement **** dirtyChunks;
+  struct ug_DirtyChunks ** dirtyChunks; /* [attribute][order] */
+  struct ug_KVTable * bulk; /* writes go here during a bulk load */
+  uint64_t bulkGeneration; /* of the database when the bulk load began */
+  uint64_t chunkFormat;
+  struct ug_Cache * cache;
 };
 
 #endif /* _CORPUS_H_ */
\ No newline at end of file
@@ -19,17 +19,43 @@
  */
 
 #include "db.h"
+#include "kvtable.h"
+#include "cache.h"
 #include "copper.h"
 
 #include <sys/stat.h>
+#include <stdint.h>
 #include <unistd.h>
 #include <string.h>
+#include <stdlib.h>
+
+/* LMDB needs to know up front how big the database may get. This is only
+ * address space; the file grows as needed. */
+#define ug_MAP_SIZE (((size_t) 1) << (SIZE_MAX > 0xFFFFFFFFu ? 38 : 30))
+
+/* Read transactions are kept around (reset, then renewed) and may be used
+ * from whichever thread holds the corpus, so they can't be tied to one. */
+#define ug_ENV_FLAGS (MDB_NOTLS)
+
+/* Bumped by every write transaction. See struct ug_Cache. */
+#define ug_GENERATION_KEY "generation"
+
+uint64_t ug_readGeneration(struct ug_Corpus * corpus) {
+  return ug_readUInt64OrZero(corpus, strlen(ug_GENERATION_KEY)+1,
+                             ug_GENERATION_KEY);
+}
 
 void ug_commit(struct ug_Corpus * corpus) {
+  uint64_t generation = 0;
   Ad(( corpus->inTxn  ));
   if (corpus->readOnlyTxn) {
     mdb_txn_reset(corpus->mdbTxn);
   } else {  
+    /* What we've cached is still good: our writes went through it. */
+    generation = ug_readGeneration(corpus)+1;
+    ug_overwriteUInt64(corpus, strlen(ug_GENERATION_KEY)+1,
+                       ug_GENERATION_KEY, generation);
+    corpus->cache->generation = generation;
     Ad(( mdb_txn_commit(corpus->mdbTxn) == 0 ));
     corpus->mdbTxn = NULL;
   }
@@ -37,12 +63,20 @@ void ug_commit(struct ug_Corpus * corpus) {
 }
 
 void ug_abort(struct ug_Corpus * corpus) {
+  if (corpus->inTxn && ! corpus->readOnlyTxn) {
+    ug_clearCache(corpus);
+  }
   mdb_txn_abort(corpus->mdbTxn);
   corpus->mdbTxn = NULL;
   corpus->inTxn = 0;
 }
 
 void ug_beginRW(struct ug_Corpus * corpus) {
+  if (corpus->bulk != NULL) {
+    /* Writes only go to memory, so there's nothing to lock. */
+    ug_beginRO(corpus);
+    return;
+  }
   Ad(( ! corpus->inTxn  ));
   if (corpus->readOnlyTxn) {
     corpus->readOnlyTxn = 0;
@@ -51,6 +85,7 @@ void ug_beginRW(struct ug_Corpus * corpus) {
   Ad(( corpus->mdbTxn == NULL ));
   Ad(( mdb_txn_begin(corpus->mdbEnv, NULL, 0, &(corpus->mdbTxn)) == 0 ));
   corpus->inTxn = 1;
+  ug_syncCache(corpus, ug_readGeneration(corpus));
 }
 
 void ug_beginRO(struct ug_Corpus * corpus) {
@@ -64,6 +99,7 @@ void ug_beginRO(struct ug_Corpus * corpus) {
     corpus->readOnlyTxn = 1;
   }
   corpus->inTxn = 1;
+  ug_syncCache(corpus, ug_readGeneration(corpus));
 }
 
 
@@ -76,7 +112,8 @@ int ug_openDB(char * path, struct ug_Corpus * corpus) {
 
   Ad(( mdb_env_create(&(corpus->mdbEnv)) == 0 ));
   Ad(( S_ISDIR(s.st_mode) ));
-  Ad(( mdb_env_open(corpus->mdbEnv, path, 0, 0666) == 0 ));
+  Ad(( mdb_env_set_mapsize(corpus->mdbEnv, ug_MAP_SIZE) == 0 ));
+  Ad(( mdb_env_open(corpus->mdbEnv, path, ug_ENV_FLAGS, 0666) == 0 ));
   Ad(( mdb_txn_begin(corpus->mdbEnv, NULL, 0, &mdbTxn) == 0 ));
   Ad(( mdb_dbi_open(mdbTxn, NULL, 0, &(corpus->mdbDbi)) == 0 ));
   Ad(( mdb_txn_commit(mdbTxn) == 0 )); mdbTxn = NULL;
@@ -98,9 +135,28 @@ int ug_closeDB(struct ug_Corpus * corpus) {
   corpus->mdbDbi = 0;
   mdb_env_close(corpus->mdbEnv); 
   corpus->mdbEnv = NULL;
+  ug_freeCache(corpus);
   return 0;
 }
 
+/* Looks key up in what's been written during a bulk load, if any. */
+static int ug_readBulk(struct ug_Corpus * corpus,
+                       struct MDB_val * key,
+                       struct MDB_val * data)
+{
+  struct ug_KVEntry * entry = NULL;
+  if (corpus->bulk == NULL) {
+    return 0;
+  }
+  entry = ug_findKV(corpus->bulk, key->mv_size, key->mv_data);
+  if (entry == NULL) {
+    return 0;
+  }
+  data->mv_data = ug_KV_VALUE(entry);
+  data->mv_size = entry->valueLength;
+  return 1;
+}
+
 int ug_existsByC(struct  ug_Corpus * corpus, char * cKey) {
   struct MDB_val key;
   struct MDB_val data;
@@ -109,6 +165,10 @@ int ug_existsByC(struct  ug_Corpus * corpus, char * cKey) {
   key.mv_data = cKey;
   key.mv_size = strlen(key.mv_data)+1;  
   
+  if (corpus->bulk != NULL
+      && ug_findKV(corpus->bulk, key.mv_size, key.mv_data) != NULL) {
+    return 1;
+  }
   r = mdb_get(corpus->mdbTxn, corpus->mdbDbi, &key, &data);
   
   if (r == 0) {
@@ -132,6 +192,10 @@ size_t ug_readOrNull(struct  ug_Corpus * corpus, size_t keyLength, void * keyDat
   Ad((key.mv_size > 0));
   Ad((corpus->inTxn));
   
+  if (ug_readBulk(corpus, &key, &data)) {
+    *valueData = data.mv_data;
+    return data.mv_size;
+  }
   r = mdb_get(corpus->mdbTxn, corpus->mdbDbi, &key, &data);
   
   if (r == 0) {
@@ -156,6 +220,10 @@ size_t ug_read(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
   
   Ad((key.mv_size > 0));
   
+  if (ug_readBulk(corpus, &key, &data)) {
+    *valueData = data.mv_data;
+    return data.mv_size;
+  }
   r = mdb_get(corpus->mdbTxn, corpus->mdbDbi, &key, &data);
   
   if (r == 0) {
@@ -215,6 +283,7 @@ void ug_write(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
 {
   struct MDB_val key;
   struct MDB_val data;
+  void * existing = NULL;
   int r;
 
   key.mv_data = keyData;
@@ -223,6 +292,13 @@ void ug_write(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
   data.mv_data = valueData;
   data.mv_size = valueLength;
   
+  if (corpus->bulk != NULL) {
+    EA(( ug_readOrNull(corpus, keyLength, keyData, &existing) == 0 ),
+       ("Key already exists."));
+    memcpy(ug_putKV(corpus->bulk, keyLength, keyData, valueLength),
+           valueData, valueLength);
+    return;
+  }
   r = mdb_put(corpus->mdbTxn, corpus->mdbDbi, &key, &data, MDB_NOOVERWRITE);
   
   if (r != 0) {
@@ -254,6 +330,12 @@ void ug_overwrite(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
   data.mv_data = valueData;
   data.mv_size = valueLength;
   
+  if (corpus->bulk != NULL) {
+    /* valueData may be what we read for this key. */
+    memmove(ug_putKV(corpus->bulk, keyLength, keyData, valueLength),
+            valueData, valueLength);
+    return;
+  }
   r = mdb_put(corpus->mdbTxn, corpus->mdbDbi, &key, &data, 0);
   
   if (r != 0) {
@@ -285,6 +367,9 @@ void * ug_overwriteBuffer(
   data.mv_data = NULL;
   data.mv_size = valueLength;
   
+  if (corpus->bulk != NULL) {
+    return ug_putKV(corpus->bulk, keyLength, keyData, valueLength);
+  }
   r = mdb_put(corpus->mdbTxn, corpus->mdbDbi, &key, &data, MDB_RESERVE);
   
   if (r != 0) {
@@ -296,6 +381,136 @@ void * ug_overwriteBuffer(
 
 
 
+void ug_forEachByPrefix(
+  struct  ug_Corpus * corpus,
+  size_t prefixLength,
+  void * prefix,
+  void (* f)(size_t keyLength, void * keyData,
+             size_t valueLength, void * valueData,
+             void * context),
+  void * context
+)
+{
+  MDB_cursor * cursor = NULL;
+  struct MDB_val key = {prefixLength, prefix};
+  struct MDB_val data = {0, NULL};
+  int r = 0;
+  
+  Ad((corpus->inTxn));
+  EA(( corpus->bulk == NULL ), ("Can't scan the database during a bulk load."));
+  Ad(( mdb_cursor_open(corpus->mdbTxn, corpus->mdbDbi, &cursor) == 0 ));
+  r = mdb_cursor_get(cursor, &key, &data, MDB_SET_RANGE);
+  while (r == 0
+         && key.mv_size >= prefixLength
+         && memcmp(key.mv_data, prefix, prefixLength) == 0) {
+    f(key.mv_size, key.mv_data, data.mv_size, data.mv_data, context);
+    r = mdb_cursor_get(cursor, &key, &data, MDB_NEXT);
+  }
+  if (r != 0 && r != MDB_NOTFOUND) {
+    E(("LMDB Error %i: %s", r, mdb_strerror(r)));
+  }
+  mdb_cursor_close(cursor);
+}
+
+void ug_beginBulk(struct ug_Corpus * corpus) {
+  Ad(( corpus->bulk == NULL ));
+  Ad(( ! corpus->inTxn ));
+  ug_beginRO(corpus);
+    corpus->bulkGeneration = ug_readGeneration(corpus);
+  ug_commit(corpus);
+  corpus->bulk = ug_newKVTable();
+}
+
+/* Writes entries in order. Keys after the last one already in the database
+ * are appended, which LMDB does without searching or splitting pages. */
+static void ug_writeSorted(struct ug_Corpus * corpus,
+                           size_t nEntries,
+                           struct ug_KVEntry ** entries)
+{
+  MDB_cursor * cursor = NULL;
+  struct MDB_val key = {0, NULL};
+  struct MDB_val data = {0, NULL};
+  void * last = NULL;
+  size_t lastLength = 0;
+  int appending = 0;
+  size_t i = 0;
+  int r = 0;
+  
+  Ad(( mdb_cursor_open(corpus->mdbTxn, corpus->mdbDbi, &cursor) == 0 ));
+  r = mdb_cursor_get(cursor, &key, &data, MDB_LAST);
+  if (r == MDB_NOTFOUND) {
+    appending = 1;
+  } else {
+    Ad(( r == 0 ));
+    ASYS(( (last = malloc(key.mv_size)) != NULL ));
+    memcpy(last, key.mv_data, key.mv_size);
+    lastLength = key.mv_size;
+  }
+  for (i = 0; i < nEntries; i++) {
+    key.mv_size = entries[i]->keyLength;
+    key.mv_data = ug_KV_KEY(entries[i]);
+    data.mv_size = entries[i]->valueLength;
+    data.mv_data = ug_KV_VALUE(entries[i]);
+    if (!appending) {
+      appending = ug_compareKeys(key.mv_size, key.mv_data,
+                                 lastLength, last) > 0;
+    }
+    r = mdb_cursor_put(cursor, &key, &data, appending ? MDB_APPEND : 0);
+    if (r != 0) {
+      E(("LMDB Error %i: %s", r, mdb_strerror(r)));
+    }
+  }
+  free(last);
+  mdb_cursor_close(cursor);
+}
+
+int ug_commitBulk(struct ug_Corpus * corpus) {
+  struct ug_KVTable * table = corpus->bulk;
+  struct ug_KVEntry ** entries = NULL;
+  MDB_cursor * cursor = NULL;
+  MDB_stat stat;
+  struct MDB_val key = {0, NULL};
+  struct MDB_val data = {0, NULL};
+  int r = 0;
+  
+  Ad(( table != NULL ));
+  corpus->bulk = NULL;
+  ug_beginRW(corpus);
+    if (ug_readGeneration(corpus) != corpus->bulkGeneration) {
+      /* Someone else wrote to the database during the load. What we have
+       * are whole values (counts, chunks, vocabulary ids) derived from what
+       * was there before, so writing them would undo their changes. */
+      ug_abort(corpus);
+      ug_freeKVTable(table);
+      return -1;
+    }
+    Ad(( mdb_stat(corpus->mdbTxn, corpus->mdbDbi, &stat) == 0 ));
+    if (stat.ms_entries <= table->nEntries) {
+      /* E.g. loading a new corpus: it's cheaper to read what's there and
+       * write everything back in order, appending all of it. */
+      Ad(( mdb_cursor_open(corpus->mdbTxn, corpus->mdbDbi, &cursor) == 0 ));
+      r = mdb_cursor_get(cursor, &key, &data, MDB_FIRST);
+      while (r == 0) {
+        if (ug_findKV(table, key.mv_size, key.mv_data) == NULL) {
+          memcpy(ug_putKV(table, key.mv_size, key.mv_data, data.mv_size),
+                 data.mv_data, data.mv_size);
+        }
+        r = mdb_cursor_get(cursor, &key, &data, MDB_NEXT);
+      }
+      if (r != MDB_NOTFOUND) {
+        E(("LMDB Error %i: %s", r, mdb_strerror(r)));
+      }
+      mdb_cursor_close(cursor);
+      Ad(( mdb_drop(corpus->mdbTxn, corpus->mdbDbi, 0) == 0 ));
+    }
+    entries = ug_sortKV(table);
+    ug_writeSorted(corpus, table->nEntries, entries);
+    free(entries);
+  ug_commit(corpus);
+  ug_freeKVTable(table);
+  return 0;
+}
+
 int ug_createDB(char * path, struct ug_Corpus * corpus) {
   MDB_txn * mdbTxn = NULL;
   MDB_env * mdbEnv = NULL;
@@ -304,7 +519,8 @@ int ug_createDB(char * path, struct ug_Corpus * corpus) {
   ASYS(( mkdir(path, 0777) == 0 ));
   
   Ad(( mdb_env_create(&mdbEnv) == 0 ));
-  Ad(( mdb_env_open(mdbEnv, path, 0, 0666) == 0 ));
+  Ad(( mdb_env_set_mapsize(mdbEnv, ug_MAP_SIZE) == 0 ));
+  Ad(( mdb_env_open(mdbEnv, path, ug_ENV_FLAGS, 0666) == 0 ));
   Ad(( mdb_txn_begin(mdbEnv, NULL, 0, &mdbTxn) == 0 ));
   Ad(( mdb_dbi_open(mdbTxn, NULL, MDB_CREATE, &(mdbDbi)) == 0 ));
   Ad(( mdb_txn_commit(mdbTxn) == 0 )); mdbTxn = NULL;
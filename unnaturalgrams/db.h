@@ -28,10 +28,26 @@ int ug_openDB(char * path, struct ug_Corpus * corpus);
 int ug_closeDB(struct ug_Corpus * corpus);
 int ug_createDB(char * path, struct ug_Corpus * corpus);
 
+/* The generation of the database, which every write transaction (from any
+ * process) bumps. Only inside a transaction. */
+uint64_t ug_readGeneration(struct ug_Corpus * corpus);
+
 void ug_beginRO(struct ug_Corpus * corpus);
 void ug_beginRW(struct ug_Corpus * corpus);
 void ug_commit(struct ug_Corpus * corpus);
+void ug_abort(struct ug_Corpus * corpus);
+
+/* Until ug_commitBulk, writes are kept in memory (where reads see them)
+ * instead of going to the database, and "write" transactions are read-only.
+ * ug_commitBulk writes them all in one transaction, in key order. If the
+ * database was written to in the meantime it writes nothing, discards them
+ * and returns -1; otherwise 0. */
+void ug_beginBulk(struct ug_Corpus * corpus);
+int ug_commitBulk(struct ug_Corpus * corpus);
 
+int ug_existsByC(struct  ug_Corpus * corpus, char * cKey);
+size_t ug_readOrNull(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
+              void ** valueData);
 void * ug_readNOrNull(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
               size_t valueSize);
 void * ug_readN(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
@@ -59,6 +75,9 @@ void ug_writeUInt64(struct  ug_Corpus * corpus,
                         size_t keyLength, void * keyData,
                         uint64_t value);
 
+void ug_overwrite(struct  ug_Corpus * corpus, size_t keyLength, void * keyData,
+                  size_t valueLength, void * valueData);
+
 void ug_overwriteUInt64(struct  ug_Corpus * corpus,
                         size_t keyLength, void * keyData,
                         uint64_t value);
@@ -70,4 +89,15 @@ void * ug_overwriteBuffer(
   size_t valueLength
 );
 
+/* Calls f for every key that starts with prefix, in order. */
+void ug_forEachByPrefix(
+  struct  ug_Corpus * corpus,
+  size_t prefixLength,
+  void * prefix,
+  void (* f)(size_t keyLength, void * keyData,
+             size_t valueLength, void * valueData,
+             void * context),
+  void * context
+);
+
 #endif /* _DB_H_ */
\ No newline at end of file
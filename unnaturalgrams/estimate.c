@@ -18,3 +18,251 @@
  * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
  */
 
+#include "copper.h"
+#include "estimate.h"
+#include "vocabulary.h"
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+
+/* Counts are weighted, so they are rounded to the nearest whole count
+ * when we need to know whether a gram was seen once, twice, etc.
+ * Returns 0 for grams that weren't seen at all and 5 for more than 4. */
+int ug_countBucket(double count) {
+  if (count < 0.5) {
+    return 0;
+  } else if (count >= 4.5) {
+    return 5;
+  }
+  return (int) (count + 0.5);
+}
+
+static double ug_discount(double (* discounts)[3], double count) {
+  int bucket = ug_countBucket(count);
+  if (bucket == 0) {
+    return 0.0;
+  }
+  return (*discounts)[(bucket > 3 ? 3 : bucket) - 1];
+}
+
+/* Chen and Goodman's estimates of the modified Kneser-Ney discounts, from
+ * the number of grams seen 1, 2, 3 and 4 times. Tiny corpora don't have
+ * enough of those, so we fall back to half the count. */
+static void ug_estimateDiscounts(double (* n)[4], double (* discounts)[3]) {
+  int k = 0;
+  double y = 0.5;
+  double d = 0.0;
+  
+  if ((*n)[0] + 2*(*n)[1] > 0) {
+    y = (*n)[0] / ((*n)[0] + 2*(*n)[1]);
+  }
+  for (k = 0; k < 3; k++) {
+    d = -1.0;
+    if ((*n)[k] > 0) {
+      d = (k+1) - (k+2) * y * (*n)[k+1] / (*n)[k];
+    }
+    if (!(d > 0.0 && d < k+1)) {
+      d = 0.5 * (k+1);
+    }
+    (*discounts)[k] = d;
+  }
+}
+
+struct ug_Estimator ug_openEstimator(struct ug_Corpus * corpus,
+                                     ug_AttributeID attr)
+{
+  struct ug_Estimator e;
+  struct ug_CountsOfCounts coc;
+  double n[4];
+  ug_GramOrder order = 0;
+  int flavor = 0;
+  
+  Au(( corpus->inTxn ));
+  e.attr = ug_getAttribute(corpus, attr);
+  e.order = corpus->gramOrder;
+  e.nVocab = ug_getVocabCount(corpus, attr);
+  /* Anything but <s> can come next. */
+  e.uniform = 1.0 / (e.nVocab - 1);
+  ASYS(( (
+    e.discounts = calloc(e.order+1, sizeof(*(e.discounts)))
+  ) != NULL ));
+  for (order = 1; order <= e.order; order++) {
+    coc = ug_getCountsOfCounts(ug_getHGVector(e.attr, order));
+    for (flavor = 0; flavor < ug_FLAVORS; flavor++) {
+      memcpy(n, coc.n[flavor], sizeof(n));
+      ug_estimateDiscounts(&n, &(e.discounts[order][flavor]));
+    }
+  }
+  return e;
+}
+
+void ug_closeEstimator(struct ug_Estimator * e) {
+  free(e->discounts);
+  e->discounts = NULL;
+}
+
+static struct ug_Context ug_newContext(struct ug_Estimator * e) {
+  struct ug_Context c = {0, NULL};
+  ASYS(( (
+    c.grams = calloc(e->order+1, sizeof(ug_Index))
+  ) != NULL ));
+  c.grams[0] = ug_NGRAM_ROOT;
+  return c;
+}
+
+/* The context at the start of a sentence, just after <s>. */
+struct ug_Context ug_startContext(struct ug_Estimator * e) {
+  struct ug_Context c = ug_newContext(e);
+  c.position = 1;
+  c.grams[1] = ug_lookupGram(ug_getHGVector(e->attr, 1),
+                             ug_VOCAB_START, ug_NGRAM_ROOT);
+  return c;
+}
+
+void ug_copyContext(struct ug_Estimator * e,
+                    struct ug_Context * to,
+                    struct ug_Context * from)
+{
+  if (to->grams == NULL) {
+    *to = ug_newContext(e);
+  }
+  to->position = from->position;
+  memcpy(to->grams, from->grams, (e->order+1) * sizeof(ug_Index));
+}
+
+void ug_freeContext(struct ug_Context * c) {
+  free(c->grams);
+  c->grams = NULL;
+}
+
+/* Modified Kneser-Ney uses raw counts for the highest order and for
+ * histories reaching back to <s>, which never has anything before it. */
+static int ug_flavor(struct ug_Estimator * e,
+                     struct ug_Context * c,
+                     ug_GramOrder order)
+{
+  if (order == e->order || order-1 == c->position) {
+    return ug_RAW;
+  }
+  return ug_CONTINUATION;
+}
+
+/* The history of the given order that the next word is predicted from, or
+ * ug_NGRAM_UNKNOWN if the corpus has never seen it. */
+static ug_Index ug_history(struct ug_Context * c, ug_GramOrder order)
+{
+  if (order-1 > c->position) {
+    return ug_NGRAM_UNKNOWN;
+  }
+  return c->grams[order-1];
+}
+
+double ug_scoreNext(struct ug_Estimator * e,
+                    struct ug_Context * c,
+                    ug_Vocab vocab)
+{
+  ug_GramOrder order = 0;
+  ug_Index next[e->order+1];
+  ug_Index history = 0;
+  double p = e->uniform;
+  double count = 0.0;
+  double lp = 0.0;
+  int flavor = 0;
+  struct ug_Counts h;
+  struct ug_HGVector v;
+  double (* d)[3];
+  
+  memset(next, 0, sizeof(next));
+  next[0] = ug_NGRAM_ROOT;
+  for (order = 1; order <= e->order; order++) {
+    history = ug_history(c, order);
+    if (order > 1 && history == ug_NGRAM_UNKNOWN) {
+      break;
+    }
+    v = ug_getHGVector(e->attr, order);
+    next[order] = ug_lookupGram(v, vocab, history);
+    flavor = ug_flavor(e, c, order);
+    h = ug_getElement(ug_getHGVector(e->attr, order-1), history)
+          ->counts[flavor];
+    if (h.childTotal <= 0.0) {
+      continue;
+    }
+    count = 0.0;
+    if (next[order] != ug_NGRAM_UNKNOWN) {
+      count = ug_getElement(v, next[order])->counts[flavor].count;
+    }
+    d = &(e->discounts[order][flavor]);
+    p = (count > ug_discount(d, count) ? count - ug_discount(d, count) : 0.0)
+          / h.childTotal
+        + ((*d)[0] * h.childN[0]
+           + (*d)[1] * h.childN[1]
+           + (*d)[2] * h.childN[2]) / h.childTotal * p;
+  }
+  
+  memcpy(c->grams, next, sizeof(next));
+  c->position++;
+  
+  lp = log(p);
+  if (!(lp > -UG_INFINITY)) {
+    return -UG_INFINITY;
+  }
+  return lp;
+}
+
+struct ug_nextDistributionContext {
+  struct ug_HGVector v;
+  int flavor;
+  double (* discounts)[3];
+  double total;
+  double * p;
+};
+
+static void ug_addDiscounted(ug_Vocab vocab, ug_Index index, void * context) {
+  struct ug_nextDistributionContext * c = context;
+  double count = ug_getElement(c->v, index)->counts[c->flavor].count;
+  double d = ug_discount(c->discounts, count);
+  if (count > d) {
+    c->p[vocab] += (count - d) / c->total;
+  }
+}
+
+void ug_nextDistribution(struct ug_Estimator * e,
+                         struct ug_Context * c,
+                         double (* p)[e->nVocab])
+{
+  ug_GramOrder order = 0;
+  ug_Index history = 0;
+  ug_Vocab vocab = 0;
+  double gamma = 0.0;
+  struct ug_Counts h;
+  struct ug_nextDistributionContext dc;
+  
+  for (vocab = 0; vocab < e->nVocab; vocab++) {
+    (*p)[vocab] = e->uniform;
+  }
+  (*p)[ug_VOCAB_START] = 0.0;
+  
+  for (order = 1; order <= e->order; order++) {
+    history = ug_history(c, order);
+    if (order > 1 && history == ug_NGRAM_UNKNOWN) {
+      break;
+    }
+    dc.v = ug_getHGVector(e->attr, order);
+    dc.flavor = ug_flavor(e, c, order);
+    dc.discounts = &(e->discounts[order][dc.flavor]);
+    dc.p = *p;
+    h = ug_getElement(ug_getHGVector(e->attr, order-1), history)
+          ->counts[dc.flavor];
+    if (h.childTotal <= 0.0) {
+      continue;
+    }
+    dc.total = h.childTotal;
+    gamma = ((*dc.discounts)[0] * h.childN[0]
+             + (*dc.discounts)[1] * h.childN[1]
+             + (*dc.discounts)[2] * h.childN[2]) / h.childTotal;
+    for (vocab = 0; vocab < e->nVocab; vocab++) {
+      (*p)[vocab] *= gamma;
+    }
+    ug_forEachChild(dc.v, history, ug_addDiscounted, &dc);
+  }
+}
@@ -18,3 +18,50 @@
  * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
  */
 
+#ifndef _ESTIMATE_H_
+#define _ESTIMATE_H_
+
+#include "ug.h"
+#include "corpus.h"
+#include "hgvector.h"
+
+/* Everything needed to score words against one attribute of a corpus.
+ * Only valid inside the transaction it was made in. */
+struct ug_Estimator {
+  struct ug_Attribute attr;
+  ug_GramOrder order;
+  ug_Vocab nVocab;
+  double uniform; /* probability of a word nothing is known about */
+  double (* discounts)[ug_FLAVORS][3]; /* [order], for counts 1, 2, 3+ */
+};
+
+/* The grams ending at the last word seen, of every order. */
+struct ug_Context {
+  size_t position; /* number of words seen, counting <s> */
+  ug_Index * grams; /* [order+1], grams[0] is the root */
+};
+
+int ug_countBucket(double count);
+
+struct ug_Estimator ug_openEstimator(struct ug_Corpus * corpus,
+                                     ug_AttributeID attr);
+void ug_closeEstimator(struct ug_Estimator * e);
+
+struct ug_Context ug_startContext(struct ug_Estimator * e);
+void ug_copyContext(struct ug_Estimator * e,
+                    struct ug_Context * to,
+                    struct ug_Context * from);
+void ug_freeContext(struct ug_Context * c);
+
+/* Natural log-probability of vocab following the context, which is then
+ * moved along past it. */
+double ug_scoreNext(struct ug_Estimator * e,
+                    struct ug_Context * c,
+                    ug_Vocab vocab);
+
+/* Probability of every word in the vocabulary following the context. */
+void ug_nextDistribution(struct ug_Estimator * e,
+                         struct ug_Context * c,
+                         double (* p)[e->nVocab]);
+
+#endif /* _ESTIMATE_H_ */
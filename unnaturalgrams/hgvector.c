@@ -20,10 +20,198 @@
 
 #include <string.h>
 #include <stdlib.h>
+#include <math.h>
 #include "copper.h"
 #include "hgvector.h"
+#include "cache.h"
 #include "db.h"
 
+/* A compact chunk is a uint32_t count of the elements in use, the uint32_t
+ * offset of each block, then the blocks. Each element is its history and
+ * backoff indexes, as deltas from the element before it in the block, its
+ * vocab and then its counts, all as varints. Counts are exact: whole ones
+ * (nearly all of them) are stored shifted left by one, and anything else
+ * as a 1 followed by the double. */
+#define ug_BLOCKS_PER_CHUNK (ug_CHUNKSIZE/ug_BLOCKSIZE)
+#define ug_MAX_VARINT_BYTES (10)
+#define ug_MAX_ELEMENT_BYTES (3*ug_MAX_VARINT_BYTES \
+                              + 5*ug_FLAVORS*(1+sizeof(double)))
+#define ug_MAX_COMPACT_CHUNK ((1+ug_BLOCKS_PER_CHUNK)*sizeof(uint32_t) \
+                              + ug_CHUNKSIZE*ug_MAX_ELEMENT_BYTES)
+
+static uint8_t * ug_putVarint(uint8_t * p, uint64_t x)
+{
+  while (x >= 0x80) {
+    *(p++) = (x & 0x7F) | 0x80;
+    x >>= 7;
+  }
+  *(p++) = x;
+  return p;
+}
+
+static uint8_t * ug_getVarint(uint8_t * p, uint8_t * end, uint64_t * x)
+{
+  unsigned int shift = 0;
+  *x = 0;
+  do {
+    As(( p < end && shift < 64 ));
+    *x |= ((uint64_t) (*p & 0x7F)) << shift;
+    shift += 7;
+  } while (*(p++) & 0x80);
+  return p;
+}
+
+static uint64_t ug_zigzag(ug_Index index, ug_Index previous)
+{
+  int64_t delta = (int64_t) (index - previous);
+  return (((uint64_t) delta) << 1) ^ ((uint64_t) (delta >> 63));
+}
+
+static ug_Index ug_unzigzag(uint64_t z, ug_Index previous)
+{
+  return previous + ((z >> 1) ^ (-(z & 1)));
+}
+
+static uint8_t * ug_putCount(uint8_t * p, double count)
+{
+  if (count >= 0.0 && count < 4.0e18 && count == floor(count)) {
+    return ug_putVarint(p, ((uint64_t) count) << 1);
+  }
+  p = ug_putVarint(p, 1);
+  memcpy(p, &count, sizeof(count));
+  return p + sizeof(count);
+}
+
+static uint8_t * ug_getCount(uint8_t * p, uint8_t * end, double * count)
+{
+  uint64_t x = 0;
+  p = ug_getVarint(p, end, &x);
+  if (x != 1) {
+    *count = (double) (x >> 1);
+    return p;
+  }
+  As(( p + sizeof(*count) <= end ));
+  memcpy(count, p, sizeof(*count));
+  return p + sizeof(*count);
+}
+
+static uint8_t * ug_encodeElement(uint8_t * p,
+                                  struct ug_VectorElement e,
+                                  struct ug_VectorElement previous)
+{
+  int flavor = 0;
+  p = ug_putVarint(p, ug_zigzag(e.historyIndex, previous.historyIndex));
+  p = ug_putVarint(p, e.vocab);
+  p = ug_putVarint(p, ug_zigzag(e.backoffIndex, previous.backoffIndex));
+  for (flavor = 0; flavor < ug_FLAVORS; flavor++) {
+    p = ug_putCount(p, e.counts[flavor].count);
+    p = ug_putCount(p, e.counts[flavor].childTotal);
+    p = ug_putCount(p, e.counts[flavor].childN[0]);
+    p = ug_putCount(p, e.counts[flavor].childN[1]);
+    p = ug_putCount(p, e.counts[flavor].childN[2]);
+  }
+  return p;
+}
+
+static uint8_t * ug_decodeElement(uint8_t * p,
+                                  uint8_t * end,
+                                  struct ug_VectorElement * e,
+                                  struct ug_VectorElement previous)
+{
+  int flavor = 0;
+  uint64_t x = 0;
+  double counts[5];
+  p = ug_getVarint(p, end, &x);
+  e->historyIndex = ug_unzigzag(x, previous.historyIndex);
+  p = ug_getVarint(p, end, &x);
+  e->vocab = x;
+  p = ug_getVarint(p, end, &x);
+  e->backoffIndex = ug_unzigzag(x, previous.backoffIndex);
+  for (flavor = 0; flavor < ug_FLAVORS; flavor++) {
+    p = ug_getCount(p, end, &(counts[0]));
+    p = ug_getCount(p, end, &(counts[1]));
+    p = ug_getCount(p, end, &(counts[2]));
+    p = ug_getCount(p, end, &(counts[3]));
+    p = ug_getCount(p, end, &(counts[4]));
+    e->counts[flavor].count = counts[0];
+    e->counts[flavor].childTotal = counts[1];
+    e->counts[flavor].childN[0] = counts[2];
+    e->counts[flavor].childN[1] = counts[3];
+    e->counts[flavor].childN[2] = counts[4];
+  }
+  return p;
+}
+
+/* Encodes chunk into out, which must have room for ug_MAX_COMPACT_CHUNK
+ * bytes, and returns its length. */
+static size_t ug_encodeChunk(struct ug_VectorElement * chunk, uint8_t * out)
+{
+  struct ug_VectorElement zero;
+  uint32_t nElements = ug_CHUNKSIZE;
+  uint32_t offset = 0;
+  size_t i = 0;
+  uint8_t * p = NULL;
+  
+  memset(&zero, 0, sizeof(zero));
+  /* Elements past the end of the vector are left out. */
+  while (nElements > 0
+         && memcmp(&(chunk[nElements-1]), &zero, sizeof(zero)) == 0) {
+    nElements--;
+  }
+  memcpy(out, &nElements, sizeof(nElements));
+  p = out + (1 + (nElements + ug_BLOCKSIZE - 1)/ug_BLOCKSIZE)
+              * sizeof(uint32_t);
+  for (i = 0; i < nElements; i++) {
+    if (i % ug_BLOCKSIZE == 0) {
+      offset = p - out;
+      memcpy(out + (1 + i/ug_BLOCKSIZE)*sizeof(uint32_t),
+             &offset, sizeof(offset));
+      p = ug_encodeElement(p, chunk[i], zero);
+    } else {
+      p = ug_encodeElement(p, chunk[i], chunk[i-1]);
+    }
+  }
+  return p - out;
+}
+
+/* Decodes one block of a compact chunk into out. */
+static void ug_decodeBlock(uint8_t * data,
+                           size_t length,
+                           size_t block,
+                           struct ug_VectorElement * out)
+{
+  struct ug_VectorElement zero;
+  uint32_t nElements = 0;
+  uint32_t offset = 0;
+  size_t i = 0;
+  uint8_t * p = NULL;
+  
+  memset(&zero, 0, sizeof(zero));
+  memset(out, 0, sizeof(struct ug_VectorElement) * ug_BLOCKSIZE);
+  As(( length >= sizeof(nElements) ));
+  memcpy(&nElements, data, sizeof(nElements));
+  if (block * ug_BLOCKSIZE >= nElements) {
+    return;
+  }
+  memcpy(&offset, data + (1 + block)*sizeof(uint32_t), sizeof(offset));
+  As(( offset < length ));
+  p = data + offset;
+  for (i = 0; i < ug_BLOCKSIZE && block*ug_BLOCKSIZE + i < nElements; i++) {
+    p = ug_decodeElement(p, data + length, &(out[i]),
+                         (i == 0) ? zero : out[i-1]);
+  }
+}
+
+static void ug_decodeChunk(uint8_t * data,
+                           size_t length,
+                           struct ug_VectorElement * out)
+{
+  size_t block = 0;
+  for (block = 0; block < ug_BLOCKS_PER_CHUNK; block++) {
+    ug_decodeBlock(data, length, block, &(out[block * ug_BLOCKSIZE]));
+  }
+}
+
 struct ug_HGVector ug_getHGVector(struct ug_Attribute attribute,
                                   ug_GramOrder order)
 {
@@ -31,6 +219,28 @@ struct ug_HGVector ug_getHGVector(struct ug_Attribute attribute,
   return v;
 }
 
+/* Only done on a new corpus: the vector holds just the unused element 0 (or
+ * the root, for order 0). */
+void ug_initHGVector(struct ug_HGVector v)
+{
+  struct ug_VectorLengthKey key = {
+    ug_VECTOR_LENGTH,
+    v.attributeID,
+    v.order
+  };
+  struct ug_VectorElement root = {0};
+  struct ug_CountsOfCountsKey cocKey = {
+    ug_COUNTS_OF_COUNTS,
+    v.attributeID,
+    v.order
+  };
+  struct ug_CountsOfCounts coc = {{{0}}};
+
+  ug_writeUInt64(v.corpus, sizeof(key), &key, 1);
+  ug_writeStructByStruct(v.corpus, cocKey, coc);
+  ug_updateElement(v, 0, root);
+}
+
 ug_Index ug_lookupGram(
   struct ug_HGVector v,
   ug_Vocab vocab,
@@ -40,13 +250,55 @@ ug_Index ug_lookupGram(
     ug_GRAM_LOOKUP,
     v.attributeID,
     v.order,
-    vocab,
-    history
+    history,
+    vocab
+  };
+  return ug_readCachedUInt64OrZero(v.corpus, sizeof(key), &key);
+}
+
+struct ug_forEachChildContext {
+  void (* f)(ug_Vocab vocab, ug_Index index, void * context);
+  void * context;
+};
+
+static void ug_forEachChildKey(
+  size_t keyLength,
+  void * keyData,
+  size_t valueLength,
+  void * valueData,
+  void * context
+)
+{
+  struct ug_forEachChildContext * c = context;
+  struct ug_GramKey key;
+  ug_Index index;
+  As(( keyLength == sizeof(key) ));
+  As(( valueLength == sizeof(index) ));
+  memcpy(&key, keyData, sizeof(key));
+  memcpy(&index, valueData, sizeof(index));
+  c->f(key.vocab, index, c->context);
+}
+
+void ug_forEachChild(
+  struct ug_HGVector v,
+  ug_Index history,
+  void (* f)(ug_Vocab vocab, ug_Index index, void * context),
+  void * context
+)
+{
+  struct ug_GramKey key = {
+    ug_GRAM_LOOKUP,
+    v.attributeID,
+    v.order,
+    history,
+    0
   };
-  return ug_readUInt64OrZero(v.corpus, sizeof(key), &key);
+  struct ug_forEachChildContext c = {f, context};
+  ug_forEachByPrefix(v.corpus, ug_GRAM_KEY_PREFIX_LENGTH, &key,
+                     ug_forEachChildKey, &c);
 }
 
-static ug_Index ug_getVectorLength(struct ug_HGVector v)
+ug_Index ug_getVectorLength(struct ug_HGVector v)
 {
   struct ug_VectorLengthKey key = {
     ug_VECTOR_LENGTH,
@@ -61,80 +313,222 @@ size_t ug_getVectorChunkCount(struct ug_HGVector v)
   return ug_getVectorLength(v)/ug_CHUNKSIZE;
 }
 
+static struct ug_DirtyChunks * ug_getDirtyChunks(struct ug_HGVector v)
+{
+  if (v.corpus->dirtyChunks == NULL) {
+    ASYS(( (
+      v.corpus->dirtyChunks 
+        = calloc(v.corpus->nAttributes, sizeof(struct ug_DirtyChunks *))
+    ) != NULL ));
+  }
+
+  if (v.corpus->dirtyChunks[v.attributeID] == NULL) {
+    ASYS(( (
+      v.corpus->dirtyChunks[v.attributeID] =
+        calloc(v.corpus->gramOrder+1, sizeof(struct ug_DirtyChunks))
+    ) != NULL ));
+  }
+  
+  return &(v.corpus->dirtyChunks[v.attributeID][v.order]);
+}
+
+static struct ug_VectorElement * ug_getDirtyChunk(
+  struct ug_HGVector v,
+  ug_Index chunk
+)
+{
+  struct ug_DirtyChunks * dirty = NULL;
+  
+  if (v.corpus->dirtyChunks == NULL
+      || v.corpus->dirtyChunks[v.attributeID] == NULL) {
+    return NULL;
+  }
+  dirty = &(v.corpus->dirtyChunks[v.attributeID][v.order]);
+  if (chunk >= dirty->nChunks) {
+    return NULL;
+  }
+  return dirty->chunks[chunk];
+}
 
+/* The chunk starting at index, straight from the database, if it's raw. */
 static struct ug_VectorElement * ug_getChunk(
   struct ug_HGVector v,
   ug_Index index
 )
 {
-  struct ug_VectorElement * chunkStart = NULL;
   struct ug_VectorKey key = { ug_VECTOR, v.attributeID, v.order, index };
   
-  chunkStart = ug_readNOrNull(v.corpus, sizeof(key), &key,
-                              sizeof(struct ug_VectorElement) * ug_CHUNKSIZE);
-  if (chunkStart == NULL) {
+  As(( v.corpus->chunkFormat == ug_CHUNK_RAW ));
+  return ug_readNOrNull(v.corpus, sizeof(key), &key,
+                        sizeof(struct ug_VectorElement) * ug_CHUNKSIZE);
+}
+
+/* The block holding index, decoded from a compact chunk. Blocks stay
+ * decoded in the corpus's cache until they're evicted or written. */
+static struct ug_VectorElement * ug_getBlock(
+  struct ug_HGVector v,
+  ug_Index index
+)
+{
+  struct ug_VectorKey key = {
+    ug_VECTOR,
+    v.attributeID,
+    v.order,
+    (index/ug_BLOCKSIZE)*ug_BLOCKSIZE
+  };
+  struct ug_VectorElement * block = NULL;
+  void * data = NULL;
+  size_t length = 0;
+  
+  block = ug_findCachedBlock(v.corpus, key);
+  if (block != NULL) {
+    return block;
+  }
+  
+  key.startOffset = (index/ug_CHUNKSIZE)*ug_CHUNKSIZE;
+  length = ug_readOrNull(v.corpus, sizeof(key), &key, &data);
+  if (length == 0) {
     return NULL;
   }
-  return chunkStart;
+  key.startOffset = (index/ug_BLOCKSIZE)*ug_BLOCKSIZE;
+  block = ug_newCachedBlock(v.corpus, key);
+  ug_decodeBlock(data, length, (index%ug_CHUNKSIZE)/ug_BLOCKSIZE, block);
+  return block;
 }
 
 static struct ug_VectorElement * ug_getWritableChunk(
   struct ug_HGVector v,
   ug_Index index)
 {
-  struct ug_VectorKey key = { ug_VECTOR, v.attributeID, v.order, index };
   ug_Index chunk = index/ug_CHUNKSIZE;
+  struct ug_DirtyChunks * dirty = ug_getDirtyChunks(v);
   struct ug_VectorElement * chunkStart = NULL;
+  size_t nChunks = 0;
   
-  if (v.corpus->dirtyChunks == NULL) {
-    ASYS(( (
-      v.corpus->dirtyChunks 
-        = calloc(sizeof(struct ug_VectorElement *),
-                 v.corpus->nAttributes)
-    ) != NULL ));
-  }
-
-  if (v.corpus->dirtyChunks[v.attributeID] == NULL) {
-    ASYS(( (
-      v.corpus->dirtyChunks[v.attributeID] =
-        calloc(sizeof(struct ug_VectorElement *),
-               v.corpus->gramOrder)
-    ) != NULL ));
-  }
-
-  if (v.corpus->dirtyChunks[v.attributeID][v.order] == NULL) {
+  if (chunk >= dirty->nChunks) {
+    nChunks = (chunk+1 > 2*dirty->nChunks) ? chunk+1 : 2*dirty->nChunks;
     ASYS(( (
-      v.corpus->dirtyChunks[v.attributeID][v.order]
-        = calloc(sizeof(struct ug_VectorElement *),
-                 ug_getVectorLength(v))
+      dirty->chunks = realloc(dirty->chunks,
+                              nChunks * sizeof(struct ug_VectorElement *))
     ) != NULL ));
+    memset(&(dirty->chunks[dirty->nChunks]), 0,
+           (nChunks - dirty->nChunks) * sizeof(struct ug_VectorElement *));
+    dirty->nChunks = nChunks;
   }
   
-  if (v.corpus->dirtyChunks[v.attributeID][v.order][chunk] == NULL) {
+  if (dirty->chunks[chunk] == NULL) {
     ASYS(( (
-      v.corpus->dirtyChunks[v.attributeID][v.order][chunk]
-        = ug_overwriteBuffer(
-                             v.corpus,
-                             sizeof(key),
-                             &key,
-                             sizeof(struct ug_VectorElement) * ug_CHUNKSIZE
-                            )
+      dirty->chunks[chunk]
+        = malloc(sizeof(struct ug_VectorElement) * ug_CHUNKSIZE)
     ) != NULL ));
     
+    /* Copy the committed chunk (if any) before we touch the database. */
+    if (v.corpus->chunkFormat == ug_CHUNK_COMPACT) {
+      struct ug_VectorKey key = {
+        ug_VECTOR,
+        v.attributeID,
+        v.order,
+        chunk * ug_CHUNKSIZE
+      };
+      void * data = NULL;
+      size_t length = ug_readOrNull(v.corpus, sizeof(key), &key, &data);
+      if (length > 0) {
+        ug_decodeChunk(data, length, dirty->chunks[chunk]);
+      } else {
+        memset(dirty->chunks[chunk],
+               0,
+               sizeof(struct ug_VectorElement) * ug_CHUNKSIZE);
+      }
+      return dirty->chunks[chunk];
+    }
     chunkStart = ug_getChunk(v, index);
-    
     if (chunkStart != NULL) {
-      memcpy(v.corpus->dirtyChunks[v.attributeID][v.order][chunk],
+      memcpy(dirty->chunks[chunk],
             chunkStart,
             sizeof(struct ug_VectorElement) * ug_CHUNKSIZE);
     } else {
-      memset(v.corpus->dirtyChunks[v.attributeID][v.order][chunk],
+      memset(dirty->chunks[chunk],
              0,
              sizeof(struct ug_VectorElement) * ug_CHUNKSIZE);
     }
   }
   
-  return v.corpus->dirtyChunks[v.attributeID][v.order][chunk];
+  return dirty->chunks[chunk];
+}
+
+/* Writes every dirty chunk to the database. Must be called (in the write
+ * transaction) before committing. */
+void ug_flushChunks(struct ug_Corpus * corpus)
+{
+  ug_AttributeID attr = 0;
+  ug_GramOrder order = 0;
+  ug_Index chunk = 0;
+  struct ug_DirtyChunks * dirty = NULL;
+  struct ug_VectorKey key = { ug_VECTOR, 0, 0, 0 };
+  uint8_t * encoded = NULL;
+  size_t length = 0;
+
+  if (corpus->dirtyChunks == NULL) {
+    return;
+  }
+  if (corpus->chunkFormat == ug_CHUNK_COMPACT) {
+    ASYS(( (encoded = malloc(ug_MAX_COMPACT_CHUNK)) != NULL ));
+  }
+  for (attr = 0; attr < corpus->nAttributes; attr++) {
+    if (corpus->dirtyChunks[attr] == NULL) {
+      continue;
+    }
+    for (order = 0; order <= corpus->gramOrder; order++) {
+      dirty = &(corpus->dirtyChunks[attr][order]);
+      for (chunk = 0; chunk < dirty->nChunks; chunk++) {
+        if (dirty->chunks[chunk] == NULL) {
+          continue;
+        }
+        key.attributeID = attr;
+        key.gramOrder = order;
+        key.startOffset = chunk * ug_CHUNKSIZE;
+        if (encoded != NULL) {
+          length = ug_encodeChunk(dirty->chunks[chunk], encoded);
+          ug_overwrite(corpus, sizeof(key), &key, length, encoded);
+        } else {
+          ug_overwrite(corpus, sizeof(key), &key,
+                       sizeof(struct ug_VectorElement) * ug_CHUNKSIZE,
+                       dirty->chunks[chunk]);
+        }
+      }
+    }
+  }
+  free(encoded);
+  ug_forgetCachedBlocks(corpus);
+  ug_dropChunks(corpus);
+}
+
+/* Forgets every dirty chunk, e.g. after an abort. */
+void ug_dropChunks(struct ug_Corpus * corpus)
+{
+  ug_AttributeID attr = 0;
+  ug_GramOrder order = 0;
+  ug_Index chunk = 0;
+  struct ug_DirtyChunks * dirty = NULL;
+
+  if (corpus->dirtyChunks == NULL) {
+    return;
+  }
+  for (attr = 0; attr < corpus->nAttributes; attr++) {
+    if (corpus->dirtyChunks[attr] == NULL) {
+      continue;
+    }
+    for (order = 0; order <= corpus->gramOrder; order++) {
+      dirty = &(corpus->dirtyChunks[attr][order]);
+      for (chunk = 0; chunk < dirty->nChunks; chunk++) {
+        free(dirty->chunks[chunk]);
+      }
+      free(dirty->chunks);
+    }
+    free(corpus->dirtyChunks[attr]);
+  }
+  free(corpus->dirtyChunks);
+  corpus->dirtyChunks = NULL;
 }
 
 struct ug_VectorElement * ug_getElement(
@@ -146,6 +540,20 @@ struct ug_VectorElement * ug_getElement(
   ug_Index offsetInChunk = index%ug_CHUNKSIZE;
   struct ug_VectorElement * chunkStart = NULL;
 
+  /* Our own uncommitted changes come first. */
+  chunkStart = ug_getDirtyChunk(v, index/ug_CHUNKSIZE);
+  if (chunkStart != NULL) {
+    return &(chunkStart[offsetInChunk]);
+  }
+  
+  if (v.corpus->chunkFormat == ug_CHUNK_COMPACT) {
+    chunkStart = ug_getBlock(v, index);
+    if (chunkStart == NULL) {
+      return NULL;
+    }
+    return &(chunkStart[index%ug_BLOCKSIZE]);
+  }
+
   chunkStart = ug_getChunk(v, chunkOffsetInVector);
 
   if (chunkStart == NULL) {
@@ -177,7 +585,6 @@ static ug_Index ug_incrVectorLength(
     v.attributeID,
     v.order
   };
-  key.attributeID = v.attributeID;
   ug_Index newLength = ug_getVectorLength(v)+1;
   ug_overwriteUInt64(v.corpus, sizeof(key), &key, newLength);
   return newLength;
@@ -212,25 +619,78 @@ ug_Index ug_addElement (
     ug_GRAM_LOOKUP, 
     v.attributeID, 
     v.order, 
-    data.vocab, 
-    data.historyIndex
+    data.historyIndex,
+    data.vocab
   };
   ug_Index newIndex = 0;
   
   newIndex = ug_assignFreeIndex(v);
   Ds(("ug_addElement order %u index %u", v.order, newIndex));
+  As(( newIndex != ug_NGRAM_UNKNOWN ));
 
-  ug_writeUInt64(v.corpus, sizeof(lookup), &lookup, newIndex);
+  ug_writeCachedUInt64(v.corpus, sizeof(lookup), &lookup, newIndex);
   
   ug_updateElement(v, newIndex, data);
   
   return newIndex;
 }
 
-double ug_bincount (
+struct ug_CountsOfCounts ug_getCountsOfCounts (
+  struct ug_HGVector v
+)
+{
+  struct ug_CountsOfCountsKey key = {
+    ug_COUNTS_OF_COUNTS,
+    v.attributeID,
+    v.order
+  };
+  struct ug_CountsOfCounts coc;
+  ug_readStructByStruct(v.corpus, key, coc);
+  return coc;
+}
+
+void ug_updateCountsOfCounts (
   struct ug_HGVector v,
-  ug_Index i
+  struct ug_CountsOfCounts data
 )
 {
-  return 0.0;
-};
+  struct ug_CountsOfCountsKey key = {
+    ug_COUNTS_OF_COUNTS,
+    v.attributeID,
+    v.order
+  };
+  ug_overwrite(v.corpus, sizeof(key), &key, sizeof(data), &data);
+}
+
+TEST({
+  struct ug_VectorElement chunk[ug_CHUNKSIZE];
+  struct ug_VectorElement decoded[ug_CHUNKSIZE];
+  uint8_t * encoded = NULL;
+  size_t length = 0;
+  size_t i = 0;
+  
+  ASYS(( (encoded = malloc(ug_MAX_COMPACT_CHUNK)) != NULL ));
+  memset(chunk, 0, sizeof(chunk));
+  /* A vector that ends part way through the chunk, with indexes going both
+   * ways and some counts that aren't whole numbers. */
+  for (i = 1; i < 700; i++) {
+    chunk[i].historyIndex = (i * 37) % 500;
+    chunk[i].vocab = i * 1000003;
+    chunk[i].backoffIndex = (i % 3) ? i / 2 : UINT64_MAX - i;
+    chunk[i].counts[ug_RAW].count = i % 5;
+    chunk[i].counts[ug_RAW].childTotal = (i % 7) ? 3.0 : 0.25;
+    chunk[i].counts[ug_CONTINUATION].childN[2] = 1e19;
+    chunk[i].counts[ug_CONTINUATION].count = -1.0;
+  }
+  length = ug_encodeChunk(chunk, encoded);
+  A(( length < sizeof(chunk) / 3 ));
+  ug_decodeChunk(encoded, length, decoded);
+  A(( memcmp(chunk, decoded, sizeof(chunk)) == 0 ));
+  
+  memset(chunk, 0, sizeof(chunk));
+  length = ug_encodeChunk(chunk, encoded);
+  A(( length == sizeof(uint32_t) ));
+  ug_decodeChunk(encoded, length, decoded);
+  A(( memcmp(chunk, decoded, sizeof(chunk)) == 0 ));
+  free(encoded);
+});
@@ -26,7 +26,27 @@
 #define ug_CHUNKSIZE (1024)
 #define ug_MAX_ORDER (0xFFFFFFFF)
 
+/* How chunks are stored, recorded in the database as "chunkFormat".
+ * Corpora from before it was recorded are raw: arrays of ug_VectorElement.
+ * Compact chunks are varints, with indexes delta coded, in blocks of
+ * ug_BLOCKSIZE elements so that reading one element only decodes its
+ * block. */
+#define ug_CHUNK_RAW (0)
+#define ug_CHUNK_COMPACT (1)
+#define ug_BLOCKSIZE (64)
+
+/* Index 0 of every vector is never used for a gram, so that it can mean
+ * "not there". In the order 0 vector it is the empty gram, the history of
+ * every unigram. */
 #define ug_NGRAM_UNKNOWN ((ug_Index) 0)
+#define ug_NGRAM_ROOT ((ug_Index) 0)
+
+/* Modified Kneser-Ney uses raw counts for the highest order and for grams
+ * that start a sentence, and continuation counts (the number of different
+ * words seen just before the gram) for everything else. We keep both. */
+#define ug_RAW 0
+#define ug_CONTINUATION 1
+#define ug_FLAVORS 2
 
 struct __attribute__((packed)) ug_VectorKey {
   ug_KeyMagic magic; /* should be ug_VECTOR */
@@ -35,12 +55,17 @@ struct __attribute__((packed)) ug_VectorKey {
   ug_Index startOffset;
 };
 
+struct __attribute__((packed)) ug_Counts {
+  double count; /* of this gram */
+  double childTotal; /* of the grams that extend this one by a word */
+  double childN[3]; /* how many of those have a count of 1, 2 and 3+ */
+};
+
 struct __attribute__((packed)) ug_VectorElement {
   ug_Index historyIndex;
   ug_Vocab vocab;
-  double weight;
-  double backoffWeight;
   ug_Index backoffIndex;
+  struct ug_Counts counts[ug_FLAVORS];
 };
 
 struct __attribute__((packed)) ug_VectorLengthKey {
@@ -53,14 +78,36 @@ struct __attribute__((packed)) ug_VectorLength {
   ug_Index vectorLength; /* for allocation */
 };
 
+/* The history comes before the vocab so that all of the grams extending
+ * one history are next to each other in the database. */
 struct __attribute__((packed)) ug_GramKey {
   ug_KeyMagic magic; /* should be ug_GRAM_LOOKUP */
   ug_AttributeID attributeID;
   ug_GramOrder gramOrder; /* 1-based! */
-  ug_Vocab vocab;
   ug_Index historyIndex;
+  ug_Vocab vocab;
 };
 
+#define ug_GRAM_KEY_PREFIX_LENGTH (sizeof(struct ug_GramKey)-sizeof(ug_Vocab))
+
+/* How many grams of an order have counts of 1, 2, 3 and 4, for working out
+ * the discounts. */
+struct __attribute__((packed)) ug_CountsOfCountsKey {
+  ug_KeyMagic magic; /* should be ug_COUNTS_OF_COUNTS */
+  ug_AttributeID attributeID;
+  ug_GramOrder gramOrder; /* 1-based! */
+};
+
+struct __attribute__((packed)) ug_CountsOfCounts {
+  double n[ug_FLAVORS][4];
+};
+
+/* Chunks modified in the current write transaction. They are kept in
+ * memory and written out by ug_flushChunks just before committing. */
+struct ug_DirtyChunks {
+  size_t nChunks;
+  struct ug_VectorElement ** chunks;
+};
 
 /* Instance/Context for a UG Hsu-Glass order vector */
 struct ug_HGVector {
@@ -73,17 +120,34 @@ struct ug_HGVector ug_getHGVector (
   ug_GramOrder order /* 1-based! */
 );
 
+void ug_initHGVector (
+  struct ug_HGVector v
+);
+
+ug_Index ug_getVectorLength (
+  struct ug_HGVector v
+);
+
 ug_Index ug_lookupGram (
   struct ug_HGVector v,
   ug_Vocab vocab,
   ug_Index history
 );
 
+/* Calls f for every gram in v with the given history. */
+void ug_forEachChild (
+  struct ug_HGVector v,
+  ug_Index history,
+  void (* f)(ug_Vocab vocab, ug_Index index, void * context),
+  void * context
+);
+
 ug_Index ug_addElement (
   struct ug_HGVector v,
   struct ug_VectorElement data
 );
 
+/* Only good until the next call: copy what you need. */
 struct ug_VectorElement * ug_getElement (
   struct ug_HGVector v,
   ug_Index index
@@ -95,4 +159,16 @@ void ug_updateElement (
   struct ug_VectorElement data
 );
 
+struct ug_CountsOfCounts ug_getCountsOfCounts (
+  struct ug_HGVector v
+);
+
+void ug_updateCountsOfCounts (
+  struct ug_HGVector v,
+  struct ug_CountsOfCounts data
+);
+
+void ug_flushChunks(struct ug_Corpus * corpus);
+void ug_dropChunks(struct ug_Corpus * corpus);
+
 #endif /* _HGVECTOR_H_ */
\ No newline at end of file
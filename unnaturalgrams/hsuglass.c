@@ -22,6 +22,7 @@
 #include "hsuglass.h"
 #include "db.h"
 #include "hgvector.h"
+#include "estimate.h"
 
 size_t ug_setHsuGlass(struct ug_Corpus * corpus, size_t order) {
     size_t j = 0;
@@ -29,8 +30,6 @@ size_t ug_setHsuGlass(struct ug_Corpus * corpus, size_t order) {
     
     /* This operation can only be done on a new brain so, there is no data
      * present. */
-    struct ug_VectorLength metadata = {0};
-    struct ug_VectorLengthKey metakey = {ug_VECTOR_LENGTH, 0, 0};
     
     As(( order >= 1 ));
     
@@ -39,12 +38,12 @@ size_t ug_setHsuGlass(struct ug_Corpus * corpus, size_t order) {
       corpus->gramOrder = order;
       /* Save the chunking size. */
       ug_writeUInt64ByC(corpus, "chunkSize", ug_CHUNKSIZE);
+      ug_writeUInt64ByC(corpus, "chunkFormat", ug_CHUNK_COMPACT);
+      corpus->chunkFormat = ug_CHUNK_COMPACT;
       /* Save the vector lengths */
       for (i = 0; i < corpus->nAttributes; i++) {
-        for (j = 1; j <= corpus->gramOrder; j++) {
-          metakey.attributeID = i;
-          metakey.gramOrder = j;
-          ug_writeStructByStruct(corpus, metakey, metadata);
+        for (j = 0; j <= corpus->gramOrder; j++) {
+          ug_initHGVector(ug_getHGVector(ug_getAttribute(corpus, i), j));
         }
       }
     
@@ -57,27 +56,74 @@ void ug_initHsuGlass(struct ug_Corpus * corpus) {
     size_t i = 0;
     uint64_t dbChunksize = 0;
     
-    /* This operation can only be done on a new brain so, there is no data
-     * present. */
     struct ug_VectorLength metadata = {0};
     struct ug_VectorLengthKey metakey = {ug_VECTOR_LENGTH, 0, 0};
    
-      /* Save the model order. */
+      /* Load the model order. */
       corpus->gramOrder = ug_readUInt64ByC(corpus, "gramOrder");
       As(( corpus->gramOrder >= 1 ));
-      /* Save the chunking size. */
+      /* Check the chunking size. */
       dbChunksize= ug_readUInt64ByC(corpus, "chunkSize");
       As((dbChunksize == ug_CHUNKSIZE));
-      /* Save the vector lengths */
+      if (ug_existsByC(corpus, "chunkFormat")) {
+        corpus->chunkFormat = ug_readUInt64ByC(corpus, "chunkFormat");
+      } else {
+        corpus->chunkFormat = ug_CHUNK_RAW;
+      }
+      As(( corpus->chunkFormat == ug_CHUNK_RAW
+           || corpus->chunkFormat == ug_CHUNK_COMPACT ));
+      /* Check the vector lengths */
       for (i = 0; i < corpus->nAttributes; i++) {
-        for (j = 1; j <= corpus->gramOrder; j++) {
+        for (j = 0; j <= corpus->gramOrder; j++) {
           metakey.attributeID = i;
           metakey.gramOrder = j;
           ug_readStructByStruct(corpus, metakey, metadata);
+          As(( metadata.vectorLength >= 1 ));
         }
       }
 }
 
+/* Adds delta to one of the counts of a gram, keeping the statistics of its
+ * history and the counts of counts of its order up to date. */
+static void ug_addCount(struct ug_Attribute attr,
+                        ug_GramOrder order,
+                        ug_Index index,
+                        int flavor,
+                        double delta)
+{
+  struct ug_HGVector v = ug_getHGVector(attr, order);
+  struct ug_HGVector hv = ug_getHGVector(attr, order-1);
+  struct ug_VectorElement elt = *ug_getElement(v, index);
+  struct ug_VectorElement history;
+  struct ug_CountsOfCounts coc;
+  int before = ug_countBucket(elt.counts[flavor].count);
+  int after = 0;
+  
+  elt.counts[flavor].count += delta;
+  after = ug_countBucket(elt.counts[flavor].count);
+  ug_updateElement(v, index, elt);
+  
+  history = *ug_getElement(hv, elt.historyIndex);
+  history.counts[flavor].childTotal += delta;
+  if (before != after) {
+    if (before > 0) {
+      history.counts[flavor].childN[(before > 3 ? 3 : before) - 1] -= 1.0;
+    }
+    if (after > 0) {
+      history.counts[flavor].childN[(after > 3 ? 3 : after) - 1] += 1.0;
+    }
+    coc = ug_getCountsOfCounts(v);
+    if (before > 0 && before <= 4) {
+      coc.n[flavor][before - 1] -= 1.0;
+    }
+    if (after > 0 && after <= 4) {
+      coc.n[flavor][after - 1] += 1.0;
+    }
+    ug_updateCountsOfCounts(v, coc);
+  }
+  ug_updateElement(hv, elt.historyIndex, history);
+}
+
 /* In order to prevent double counting, we only accumulate weights on to
  * nGrams which were on a path that right-recursed ANY amount of times
  * and then left-recursed ANY amount of times, but no other pattern is allowed:
@@ -96,6 +142,9 @@ void ug_initHsuGlass(struct ug_Corpus * corpus) {
  * 
  * When called from a sliding window recursionState should be 1 on the first
  * (leftmost) window and 2 otherwise.
+ *
+ * Every gram created is also a new left extension of its backoff, which is
+ * what the continuation counts count.
  */    
 static ug_Index ug_addNGram(struct ug_Attribute attr,
                                     ug_GramOrder order,
@@ -107,7 +156,7 @@ static ug_Index ug_addNGram(struct ug_Attribute attr,
   ug_Index index = ug_NGRAM_UNKNOWN; /* into order order */
   ug_Index history = ug_NGRAM_UNKNOWN; /* into order (order-1) */
   ug_Index backoff = ug_NGRAM_UNKNOWN; /* into order (order-1) */
-  struct ug_VectorElement elt;
+  struct ug_VectorElement elt = {0};
   struct ug_HGVector v = ug_getHGVector(attr, order);
   
   Ds(("ug_addNGram %u %u %u %p %i", attr.attributeID, order, vocabString[0], 
@@ -115,8 +164,7 @@ static ug_Index ug_addNGram(struct ug_Attribute attr,
   
   /* recursive base case */
   if (order == 1) {
-    history = ug_NGRAM_UNKNOWN; /* Doesn't make sense for unigrams to have a */
-                                /* history or a backoff. */
+    history = ug_NGRAM_ROOT; /* Unigrams all have the empty history. */
   } else {
     /* Recursively build our prefix trie by adding
      * the prefix if necessary. In state 1 stay in state 1, otherwise
@@ -135,51 +183,47 @@ static ug_Index ug_addNGram(struct ug_Attribute attr,
   Ds(("ug_addNGram index %u", index));
   /* Does it already exist? */
   if (index == ug_NGRAM_UNKNOWN) { /* It does not already exist. */
+    Av(( recursionState != 3 ));
+    
     if (order == 1) {
       backoff = ug_NGRAM_UNKNOWN;
     } else {
       /* Recursively build our backoff trie by adding
-      * the postfix if necessary. In state 1 or 2 goto state 2, otherwise
-      * goto state 3.
+      * the postfix if necessary. In state 1 or 2 goto state 2.
       */
       backoff = ug_addNGram(attr, order-1,
                             &(vocabString[1]), &(weightString[1]),
-                            ((recursionState != 3) ? 2 : 3)
+                            2
                            );
     }
                          
-    Av(( recursionState != 3 ));
-    
     elt.historyIndex = history;
     elt.vocab = vocabString[order-1];
-    elt.weight = weightString[order-1];
-    elt.backoffWeight = 0.0;
     elt.backoffIndex = backoff;
     
+    index = ug_addElement(v, elt);
     
-    index = ug_addElement(v, elt);  
+    if (order > 1) {
+      ug_addCount(attr, order-1, backoff, ug_CONTINUATION, 1.0);
+    }
   } else { /* It does already exist. */
     elt = *ug_getElement(v, index);
     
     As(( elt.historyIndex == history ));
     As(( elt.vocab == vocabString[order-1] ));
     
-    if (recursionState == 1) {
-      if (order == 1) {
-        backoff = ug_NGRAM_UNKNOWN;
-      } else {
-        backoff = ug_addNGram(attr, order-1,
-                              &(vocabString[1]), &(weightString[1]),
-                              ((recursionState != 3) ? 2 : 3)
-                             );
-      }
+    /* The postfixes of this occurence need counting too. */
+    if (recursionState != 3 && order > 1) {
+      backoff = ug_addNGram(attr, order-1,
+                            &(vocabString[1]), &(weightString[1]),
+                            2
+                           );
       As(( elt.backoffIndex == backoff ));
     }
-    
-    if (recursionState != 3) {
-      elt.weight += weightString[order-1];
-      ug_updateElement(v, index, elt);
-    }
+  }
+  
+  if (recursionState != 3) {
+    ug_addCount(attr, order, index, ug_RAW, weightString[order-1]);
   }
   return index;
 }
@@ -192,16 +236,19 @@ static void ug_addFeatureStringToAttribute(
 ) 
 {
     size_t iWord = 0;
+    size_t order = (length <= attr.corpus->gramOrder
+                    ? length
+                    : attr.corpus->gramOrder);
     /* Sliding window */
     ug_addNGram(attr,
-                (length <= attr.corpus->gramOrder ? length : attr.corpus->gramOrder), /* = order */
+                order,
                 &(vocabString[0]),
                 &(weightString[0]),
                 1
                );
-    for (iWord = 1; iWord < length-attr.corpus->gramOrder; iWord++) {
+    for (iWord = 1; iWord + order <= length; iWord++) {
       ug_addNGram(attr,
-                  attr.corpus->gramOrder,
+                  order,
                   &(vocabString[iWord]),
                   &(weightString[iWord]),
                   2
@@ -218,4 +265,4 @@ void ug_addFeatureStringToCorpus(struct ug_Corpus * corpus,
 {
   ug_addFeatureStringToAttribute(ug_getAttribute(corpus, attr),
                                  length, vocabString, weightString);
-}
\ No newline at end of file
+}
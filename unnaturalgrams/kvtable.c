@@ -0,0 +1,251 @@
+/* kvtable.c -- In-memory key-value table for UnnaturalGrams
+ * 
+ * Copyright 2014 Joshua Charles Campbell
+ *
+ * This file is part of UnnaturalCode.
+ *
+ * UnnaturalCode is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * UnnaturalCode is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#include <string.h>
+#include <stdlib.h>
+#include "copper.h"
+#include "kvtable.h"
+
+#define ug_KV_INITIAL_SLOTS (1024)
+
+/* 64-bit FNV-1a */
+static uint64_t ug_hashKey(size_t keyLength, void * key) {
+  uint64_t hash = 0xcbf29ce484222325ULL;
+  unsigned char * bytes = key;
+  size_t i = 0;
+  for (i = 0; i < keyLength; i++) {
+    hash ^= bytes[i];
+    hash *= 0x100000001b3ULL;
+  }
+  return hash;
+}
+
+struct ug_KVTable * ug_newKVTable(void) {
+  struct ug_KVTable * table = NULL;
+  ASYS(( (table = malloc(sizeof(struct ug_KVTable))) != NULL ));
+  table->nEntries = 0;
+  table->nSlots = ug_KV_INITIAL_SLOTS;
+  ASYS(( (
+    table->slots = calloc(table->nSlots, sizeof(struct ug_KVEntry *))
+  ) != NULL ));
+  return table;
+}
+
+void ug_freeKVTable(struct ug_KVTable * table) {
+  size_t i = 0;
+  for (i = 0; i < table->nSlots; i++) {
+    if (table->slots[i] != NULL) {
+      free(table->slots[i]->data);
+      free(table->slots[i]);
+    }
+  }
+  free(table->slots);
+  free(table);
+}
+
+/* The slot key is in, or the empty slot it would go in. */
+static size_t ug_slotKV(struct ug_KVTable * table,
+                        uint64_t hash,
+                        size_t keyLength,
+                        void * key)
+{
+  size_t mask = table->nSlots - 1;
+  size_t i = hash & mask;
+  struct ug_KVEntry * entry = NULL;
+  while ((entry = table->slots[i]) != NULL) {
+    if (entry->hash == hash
+        && entry->keyLength == keyLength
+        && memcmp(entry->data, key, keyLength) == 0) {
+      break;
+    }
+    i = (i + 1) & mask;
+  }
+  return i;
+}
+
+static void ug_growKV(struct ug_KVTable * table) {
+  struct ug_KVEntry ** old = table->slots;
+  size_t nOld = table->nSlots;
+  size_t i = 0;
+  size_t j = 0;
+  
+  table->nSlots *= 2;
+  ASYS(( (
+    table->slots = calloc(table->nSlots, sizeof(struct ug_KVEntry *))
+  ) != NULL ));
+  for (i = 0; i < nOld; i++) {
+    if (old[i] != NULL) {
+      j = old[i]->hash & (table->nSlots - 1);
+      while (table->slots[j] != NULL) {
+        j = (j + 1) & (table->nSlots - 1);
+      }
+      table->slots[j] = old[i];
+    }
+  }
+  free(old);
+}
+
+struct ug_KVEntry * ug_findKV(struct ug_KVTable * table,
+                              size_t keyLength,
+                              void * key)
+{
+  uint64_t hash = ug_hashKey(keyLength, key);
+  return table->slots[ug_slotKV(table, hash, keyLength, key)];
+}
+
+void * ug_putKV(struct ug_KVTable * table,
+                size_t keyLength,
+                void * key,
+                size_t valueLength)
+{
+  uint64_t hash = ug_hashKey(keyLength, key);
+  size_t i = ug_slotKV(table, hash, keyLength, key);
+  struct ug_KVEntry * entry = table->slots[i];
+  
+  if (entry == NULL) {
+    if (2 * (table->nEntries + 1) > table->nSlots) {
+      ug_growKV(table);
+      i = ug_slotKV(table, hash, keyLength, key);
+    }
+    ASYS(( (entry = malloc(sizeof(struct ug_KVEntry))) != NULL ));
+    entry->hash = hash;
+    entry->keyLength = keyLength;
+    entry->valueLength = 0;
+    entry->data = NULL;
+    table->slots[i] = entry;
+    table->nEntries++;
+  } else if (entry->valueLength == valueLength) {
+    return ug_KV_VALUE(entry);
+  }
+  ASYS(( (
+    entry->data = realloc(entry->data, keyLength + valueLength + 1)
+  ) != NULL ));
+  memcpy(entry->data, key, keyLength);
+  entry->valueLength = valueLength;
+  return ug_KV_VALUE(entry);
+}
+
+void ug_removeKV(struct ug_KVTable * table, size_t keyLength, void * key) {
+  uint64_t hash = ug_hashKey(keyLength, key);
+  size_t mask = table->nSlots - 1;
+  size_t i = ug_slotKV(table, hash, keyLength, key);
+  size_t j = i;
+  size_t home = 0;
+  
+  if (table->slots[i] == NULL) {
+    return;
+  }
+  free(table->slots[i]->data);
+  free(table->slots[i]);
+  table->slots[i] = NULL;
+  table->nEntries--;
+  /* Move back whatever can't be found past the hole any more. */
+  for (j = (i + 1) & mask; table->slots[j] != NULL; j = (j + 1) & mask) {
+    home = table->slots[j]->hash & mask;
+    if (((j - home) & mask) >= ((j - i) & mask)) {
+      table->slots[i] = table->slots[j];
+      table->slots[j] = NULL;
+      i = j;
+    }
+  }
+}
+
+int ug_compareKeys(size_t aLength, void * a, size_t bLength, void * b) {
+  int r = memcmp(a, b, (aLength < bLength) ? aLength : bLength);
+  if (r != 0) {
+    return r;
+  }
+  return (aLength > bLength) - (aLength < bLength);
+}
+
+static int ug_compareEntries(const void * a, const void * b) {
+  struct ug_KVEntry * ea = *((struct ug_KVEntry **) a);
+  struct ug_KVEntry * eb = *((struct ug_KVEntry **) b);
+  return ug_compareKeys(ea->keyLength, ug_KV_KEY(ea),
+                        eb->keyLength, ug_KV_KEY(eb));
+}
+
+struct ug_KVEntry ** ug_sortKV(struct ug_KVTable * table) {
+  struct ug_KVEntry ** entries = NULL;
+  size_t i = 0;
+  size_t n = 0;
+  
+  ASYS(( (
+    entries = malloc((table->nEntries + 1) * sizeof(struct ug_KVEntry *))
+  ) != NULL ));
+  for (i = 0; i < table->nSlots; i++) {
+    if (table->slots[i] != NULL) {
+      entries[n++] = table->slots[i];
+    }
+  }
+  Au(( n == table->nEntries ));
+  qsort(entries, n, sizeof(struct ug_KVEntry *), ug_compareEntries);
+  return entries;
+}
+
+TEST({
+  struct ug_KVTable * t = ug_newKVTable();
+  struct ug_KVEntry ** sorted = NULL;
+  struct ug_KVEntry * e = NULL;
+  uint64_t i = 0;
+  uint64_t key = 0;
+  
+  for (i = 0; i < 5000; i++) {
+    key = i * 7919 % 5000;
+    *((uint64_t *) ug_putKV(t, sizeof(key), &key, sizeof(i))) = i;
+  }
+  A(( t->nEntries == 5000 ));
+  key = 7919 % 5000;
+  e = ug_findKV(t, sizeof(key), &key);
+  A(( e != NULL ));
+  A(( *((uint64_t *) ug_KV_VALUE(e)) == 1 ));
+  /* Replacing a value, with one of a different size. */
+  memcpy(ug_putKV(t, sizeof(key), &key, 3), "ab", 3);
+  e = ug_findKV(t, sizeof(key), &key);
+  A(( e->valueLength == 3 ));
+  A(( strcmp(ug_KV_VALUE(e), "ab") == 0 ));
+  A(( t->nEntries == 5000 ));
+  key = 5000;
+  A(( ug_findKV(t, sizeof(key), &key) == NULL ));
+  /* Everything else can still be found after removing half. */
+  for (i = 0; i < 5000; i += 2) {
+    ug_removeKV(t, sizeof(i), &i);
+  }
+  A(( t->nEntries == 2500 ));
+  for (i = 0; i < 5000; i++) {
+    A(( (ug_findKV(t, sizeof(i), &i) == NULL) == (i % 2 == 0) ));
+  }
+  for (i = 0; i < 5000; i += 2) {
+    *((uint64_t *) ug_putKV(t, sizeof(i), &i, sizeof(i))) = i;
+  }
+  
+  /* A prefix of a key sorts before it. */
+  ug_putKV(t, 1, "\xFF", 0);
+  ug_putKV(t, 2, "\xFF\x00", 0);
+  sorted = ug_sortKV(t);
+  for (i = 1; i < t->nEntries; i++) {
+    A(( ug_compareEntries(&(sorted[i-1]), &(sorted[i])) < 0 ));
+  }
+  for (i = 0; sorted[i]->keyLength != 1; i++) {
+  }
+  A(( sorted[i+1]->keyLength == 2 ));
+  free(sorted);
+  ug_freeKVTable(t);
+});
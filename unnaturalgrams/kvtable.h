@@ -0,0 +1,69 @@
+/* kvtable.h -- In-memory key-value table for UnnaturalGrams
+ * 
+ * Copyright 2014 Joshua Charles Campbell
+ *
+ * This file is part of UnnaturalCode.
+ *
+ * UnnaturalCode is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * UnnaturalCode is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef _KVTABLE_H_
+#define _KVTABLE_H_
+
+#include <stddef.h>
+#include <stdint.h>
+
+/* A key and its value, stored one after the other. */
+struct ug_KVEntry {
+  uint64_t hash;
+  size_t keyLength;
+  size_t valueLength;
+  unsigned char * data;
+};
+
+#define ug_KV_KEY(entry) ((void *) (entry)->data)
+#define ug_KV_VALUE(entry) ((void *) ((entry)->data + (entry)->keyLength))
+
+/* Hash table from byte strings to byte strings. */
+struct ug_KVTable {
+  size_t nEntries;
+  size_t nSlots; /* a power of two, at least twice nEntries */
+  struct ug_KVEntry ** slots;
+};
+
+struct ug_KVTable * ug_newKVTable(void);
+void ug_freeKVTable(struct ug_KVTable * table);
+
+/* Returns NULL if key isn't in the table. */
+struct ug_KVEntry * ug_findKV(struct ug_KVTable * table,
+                              size_t keyLength,
+                              void * key);
+
+/* Makes room for a value of valueLength under key, replacing any value it
+ * had, and returns it for the caller to fill in. */
+void * ug_putKV(struct ug_KVTable * table,
+                size_t keyLength,
+                void * key,
+                size_t valueLength);
+
+void ug_removeKV(struct ug_KVTable * table, size_t keyLength, void * key);
+
+/* The entries in LMDB's default key order. Free the array (only) when
+ * done; it's invalidated by ug_putKV. */
+struct ug_KVEntry ** ug_sortKV(struct ug_KVTable * table);
+
+/* LMDB's default key order: bytewise, shorter keys first on a tie. */
+int ug_compareKeys(size_t aLength, void * a, size_t bLength, void * b);
+
+#endif /* _KVTABLE_H_ */
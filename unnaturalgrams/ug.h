@@ -74,7 +74,7 @@ struct ug_GramWeighted {
   struct ug_WordWeighted * words;
 };
 
-/* The base-2 logarithm of numbers which we consider practically infinite. */
+/* The (natural) logarithm of numbers which we consider practically infinite. */
 #define UG_INFINITY 70.0
 
 struct ug_Prediction {
@@ -94,6 +94,7 @@ typedef enum {
   ug_VOCAB_COUNT, /* for storing the current size of the vocabulary */
   ug_FEATURE, /* for mapping IDs back to real words */
   ug_GRAM_LOOKUP, /* for mapping (vocab, history) pairs to indices in the vector */
+  ug_COUNTS_OF_COUNTS, /* for working out the discounts */
 } ug_KeyType;
 
 
@@ -23,27 +23,282 @@
 #include "db.h"
 #include "hsuglass.h"
 #include "vocabulary.h"
+#include "estimate.h"
 #include <string.h>
 #include <stdlib.h>
+#include <math.h>
+
+/* Queries are scored against the first attribute (the spelling). */
+static void ug_mapGramToVocabs(struct ug_Corpus * corpus,
+                               struct ug_Gram gram,
+                               ug_Vocab (* ids)[gram.length+1])
+{
+  size_t i = 0;
+  for (i = 0; i < gram.length; i++) {
+    Au(( gram.words[i].nAttributes >= 1 ));
+    (*ids)[i] = ug_mapFeatureToVocab(corpus, 0, gram.words[i].values[0]);
+  }
+}
+
+void ug_tokenLogprobs(struct ug_Corpus * corpus,
+                      struct ug_Gram query,
+                      double (* logprobs)[query.length+1])
+{
+  size_t i = 0;
+  ug_Vocab ids[query.length+1];
+  struct ug_Estimator e;
+  struct ug_Context c;
+  A((corpus->open));
+  
+  ug_beginRO(corpus);
+    ug_mapGramToVocabs(corpus, query, &ids);
+    e = ug_openEstimator(corpus, 0);
+    c = ug_startContext(&e);
+    for (i = 0; i < query.length; i++) {
+      (*logprobs)[i] = ug_scoreNext(&e, &c, ids[i]);
+    }
+    (*logprobs)[query.length] = ug_scoreNext(&e, &c, ug_VOCAB_END);
+    ug_freeContext(&c);
+    ug_closeEstimator(&e);
+  ug_commit(corpus);
+}
+
+void ug_vocabIds(struct ug_Corpus * corpus,
+                 struct ug_Gram query,
+                 uint64_t (* ids)[query.length])
+{
+  size_t i = 0;
+  A((corpus->open));
+  
+  ug_beginRO(corpus);
+    for (i = 0; i < query.length; i++) {
+      Au(( query.words[i].nAttributes >= 1 ));
+      (*ids)[i] = ug_mapFeatureToVocab(corpus, 0, query.words[i].values[0]);
+    }
+  ug_commit(corpus);
+}
 
 double ug_crossEntropy(struct ug_Corpus * corpus, struct ug_Gram query) {
-  return 70.0;
+  size_t i = 0;
+  double logprobs[query.length+1];
+  double entropy = 0.0;
+  
+  ug_tokenLogprobs(corpus, query, &logprobs);
+  for (i = 0; i <= query.length; i++) {
+    entropy -= logprobs[i];
+  }
+  return entropy / (query.length+1);
+}
+
+/* Where score belongs in a best-first list of n scores, which holds at most
+ * k. Returns k if it doesn't belong at all. */
+static size_t ug_rank(size_t k, size_t n, double scores[k], double score) {
+  size_t i = n;
+  while (i > 0 && scores[i-1] < score) {
+    i--;
+  }
+  return i;
+}
+
+static struct ug_Gram ug_mapVocabsToGram(struct ug_Corpus * corpus,
+                                         size_t length,
+                                         ug_Vocab ids[length])
+{
+  size_t i = 0;
+  struct ug_Feature feature;
+  struct ug_Gram gram = {length, NULL};
+  
+  ASYS(( (gram.words = calloc(length, sizeof(struct ug_Word))) != NULL ));
+  for (i = 0; i < length; i++) {
+    feature = ug_mapVocabToFeature(corpus, 0, ids[i]);
+    gram.words[i].nAttributes = 1;
+    ASYS(( (
+      gram.words[i].values = malloc(sizeof(struct ug_Feature))
+    ) != NULL ));
+    gram.words[i].values[0].length = feature.length;
+    ASYS(( (
+      gram.words[i].values[0].value = malloc(feature.length)
+    ) != NULL ));
+    memcpy(gram.words[i].values[0].value, feature.value, feature.length);
+  }
+  return gram;
 }
 
+/* A beam search: each step extends the best nPredictions partial strings
+ * by every word, and keeps the best nPredictions of those. */
 struct ug_Predictions ug_predict(struct ug_Corpus * corpus,
                   struct ug_Gram prefix,
                   size_t min,
                   size_t max,
-                  struct ug_Gram postfix
+                  struct ug_Gram postfix,
+                  size_t nPredictions
                  ) {
-  A((corpus->open));
   struct ug_Predictions predictions = {
     .nPredictions = 0,
     .predictions = NULL
   };
+  size_t k = nPredictions;
+  size_t i = 0;
+  size_t j = 0;
+  size_t r = 0;
+  size_t step = 0;
+  size_t nBeam = 1;
+  size_t nNext = 0;
+  size_t nResults = 0;
+  ug_Vocab vocab = 0;
+  double score = 0.0;
+  double * p = NULL;
+  ug_Vocab prefixIds[prefix.length+1];
+  ug_Vocab postfixIds[postfix.length+1];
+  struct ug_Estimator e;
+  struct ug_Context postfixContext = {0, NULL};
+  A((corpus->open));
+  
+  if (min < 1) {
+    min = 1;
+  }
+  if (max < min || k == 0) {
+    return predictions;
+  }
+  {
+    double beamScores[k];
+    ug_Vocab beamWords[k][max];
+    struct ug_Context beam[k];
+    double nextScores[k];
+    size_t nextFrom[k];
+    ug_Vocab nextWords[k];
+    double resultScores[k];
+    size_t resultLengths[k];
+    ug_Vocab resultWords[k][max];
+    struct ug_Context next[k];
+    
+    memset(beam, 0, sizeof(beam));
+    memset(next, 0, sizeof(next));
+    
+    ug_beginRO(corpus);
+      ug_mapGramToVocabs(corpus, prefix, &prefixIds);
+      ug_mapGramToVocabs(corpus, postfix, &postfixIds);
+      e = ug_openEstimator(corpus, 0);
+      ASYS(( (p = malloc(e.nVocab * sizeof(double))) != NULL ));
+      
+      beam[0] = ug_startContext(&e);
+      beamScores[0] = 0.0;
+      for (i = 0; i < prefix.length; i++) {
+        ug_scoreNext(&e, &(beam[0]), prefixIds[i]);
+      }
+      
+      for (step = 1; step <= max && nBeam > 0; step++) {
+        nNext = 0;
+        for (i = 0; i < nBeam; i++) {
+          if (step > 1 && beamWords[i][step-2] == ug_VOCAB_END) {
+            continue;
+          }
+          ug_nextDistribution(&e, &(beam[i]), (double (*)[e.nVocab]) p);
+          for (vocab = 0; vocab < e.nVocab; vocab++) {
+            if (vocab == ug_VOCAB_UNKNOWN || vocab == ug_VOCAB_START) {
+              continue;
+            }
+            score = beamScores[i] + log(p[vocab]);
+            r = ug_rank(k, nNext, nextScores, score);
+            if (r >= k) {
+              continue;
+            }
+            for (j = (nNext < k ? nNext : k-1); j > r; j--) {
+              nextScores[j] = nextScores[j-1];
+              nextFrom[j] = nextFrom[j-1];
+              nextWords[j] = nextWords[j-1];
+            }
+            nextScores[r] = score;
+            nextFrom[r] = i;
+            nextWords[r] = vocab;
+            if (nNext < k) {
+              nNext++;
+            }
+          }
+        }
+        
+        /* Move the beam along. */
+        {
+          ug_Vocab words[nNext+1][max];
+          for (i = 0; i < nNext; i++) {
+            memcpy(words[i], beamWords[nextFrom[i]], sizeof(words[i]));
+            words[i][step-1] = nextWords[i];
+            ug_copyContext(&e, &(next[i]), &(beam[nextFrom[i]]));
+            ug_scoreNext(&e, &(next[i]), nextWords[i]);
+          }
+          for (i = 0; i < nNext; i++) {
+            memcpy(beamWords[i], words[i], sizeof(words[i]));
+            beamScores[i] = nextScores[i];
+            ug_copyContext(&e, &(beam[i]), &(next[i]));
+          }
+          nBeam = nNext;
+        }
+        
+        if (step < min) {
+          continue;
+        }
+        for (i = 0; i < nBeam; i++) {
+          score = beamScores[i];
+          ug_copyContext(&e, &postfixContext, &(beam[i]));
+          for (j = 0; j < postfix.length; j++) {
+            score += ug_scoreNext(&e, &postfixContext, postfixIds[j]);
+          }
+          r = ug_rank(k, nResults, resultScores, score);
+          if (r >= k) {
+            continue;
+          }
+          for (j = (nResults < k ? nResults : k-1); j > r; j--) {
+            resultScores[j] = resultScores[j-1];
+            resultLengths[j] = resultLengths[j-1];
+            memcpy(resultWords[j], resultWords[j-1], sizeof(resultWords[j]));
+          }
+          resultScores[r] = score;
+          resultLengths[r] = step;
+          memcpy(resultWords[r], beamWords[i], sizeof(resultWords[r]));
+          if (nResults < k) {
+            nResults++;
+          }
+        }
+      }
+      
+      predictions.nPredictions = nResults;
+      ASYS(( (
+        predictions.predictions = calloc(nResults+1,
+                                         sizeof(struct ug_Prediction))
+      ) != NULL ));
+      for (i = 0; i < nResults; i++) {
+        predictions.predictions[i].score = resultScores[i];
+        predictions.predictions[i].gram
+          = ug_mapVocabsToGram(corpus, resultLengths[i], resultWords[i]);
+      }
+      
+      for (i = 0; i < k; i++) {
+        ug_freeContext(&(beam[i]));
+        ug_freeContext(&(next[i]));
+      }
+      ug_freeContext(&postfixContext);
+      free(p);
+      ug_closeEstimator(&e);
+    ug_commit(corpus);
+  }
   return predictions;
 }
 
+void ug_freePredictions(struct ug_Predictions predictions) {
+  size_t i = 0;
+  size_t j = 0;
+  struct ug_Gram gram;
+  for (i = 0; i < predictions.nPredictions; i++) {
+    gram = predictions.predictions[i].gram;
+    for (j = 0; j < gram.length; j++) {
+      free(gram.words[j].values[0].value);
+      free(gram.words[j].values);
+    }
+    free(gram.words);
+  }
+  free(predictions.predictions);
+}
+
 static void ug_parallelProperties(
   struct ug_Corpus * corpus,
   struct ug_GramWeighted text,
@@ -66,23 +321,49 @@ int ug_addToCorpus(struct ug_Corpus * corpus, struct ug_GramWeighted text) {
   struct ug_Feature lists[corpus->nAttributes][text.length];
   double weights[text.length];
   ug_Vocab ids[text.length];
+  /* Wrapped in <s> and </s> */
+  double sentenceWeights[text.length+2];
+  ug_Vocab sentence[text.length+2];
   A((corpus->open));
   A((text.length > 0));
 
   ug_parallelProperties(corpus, text, &lists, &weights);
+  /* <s> never gets predicted. */
+  sentenceWeights[0] = 0.0;
+  memcpy(&(sentenceWeights[1]), weights, sizeof(weights));
+  sentenceWeights[text.length+1] = weights[text.length-1];
   
   ug_beginRW(corpus);
 
     for (i = 0; i < corpus->nAttributes; i++) {
       ug_mapFeaturesToVocabsOrCreate(corpus, i, text.length, lists[i], &ids);
-      ug_addFeatureStringToCorpus(corpus, i, text.length, ids, weights);
+      sentence[0] = ug_VOCAB_START;
+      memcpy(&(sentence[1]), ids, sizeof(ids));
+      sentence[text.length+1] = ug_VOCAB_END;
+      ug_addFeatureStringToCorpus(corpus, i, text.length+2,
+                                  sentence, sentenceWeights);
     }
     
-  
+    /* During a bulk load chunks stay in memory until the end. */
+    if (corpus->bulk == NULL) {
+      ug_flushChunks(corpus);
+    }
   ug_commit(corpus);
   return i;
 }
 
+void ug_beginBulkLoad(struct ug_Corpus * corpus) {
+  A((corpus->open));
+  ug_beginBulk(corpus);
+}
+
+int ug_endBulkLoad(struct ug_Corpus * corpus) {
+  A((corpus->open));
+  A((corpus->bulk != NULL));
+  ug_flushChunks(corpus);
+  return ug_commitBulk(corpus);
+}
+
 struct ug_Corpus ug_openCorpus(char * path) {
   struct ug_Corpus corpus = {
     .nAttributes = 0,
@@ -100,6 +381,10 @@ struct ug_Corpus ug_openCorpus(char * path) {
 
 void ug_closeCorpus(struct ug_Corpus * corpus) {
   EA(( corpus->open ), ("DB already closed"));
+  if (corpus->bulk != NULL && ug_endBulkLoad(corpus) != 0) {
+    W(("The database changed during the bulk load; it was discarded."));
+  }
+  ug_dropChunks(corpus);
   A(( ug_closeDB(corpus) == 0 ));
   corpus->open = 0;
 }
@@ -126,11 +411,42 @@ struct ug_Corpus ug_createCorpus(char * path, ug_AttributeID nAttributes, size_t
   for (ia = 0; ia < nAttributes; ia++) {
     ug_initVocab(&corpus, ia);
   }
+  ug_flushChunks(&corpus);
   ug_commit(&corpus);
   corpus.open = 1;
   return corpus;
 }
 
+struct ug_Corpus * ug_openCorpusHandle(char * path) {
+  struct ug_Corpus * corpus = malloc(sizeof(struct ug_Corpus));
+  ASYS(( corpus != NULL ));
+  *corpus = ug_openCorpus(path);
+  return corpus;
+}
+
+struct ug_Corpus * ug_createCorpusHandle(char * path,
+                                         ug_AttributeID nAttributes,
+                                         size_t gramOrder) {
+  struct ug_Corpus * corpus = malloc(sizeof(struct ug_Corpus));
+  ASYS(( corpus != NULL ));
+  *corpus = ug_createCorpus(path, nAttributes, gramOrder);
+  return corpus;
+}
+
+void ug_closeCorpusHandle(struct ug_Corpus * corpus) {
+  ug_closeCorpus(corpus);
+  free(corpus);
+}
+
+uint64_t ug_corpusGeneration(struct ug_Corpus * corpus) {
+  uint64_t generation = 0;
+  A((corpus->open));
+  ug_beginRO(corpus);
+    generation = ug_readGeneration(corpus);
+  ug_commit(corpus);
+  return generation;
+}
+
 TEST({
   struct ug_Corpus c;
   char * tmpDir;
@@ -278,3 +594,236 @@ TEST({
   system(removeCmd);  
 });
 
+/* A handle sees what another one has written since it last looked, even
+ * though it had cached the word as missing. */
+TEST({
+  struct ug_Corpus writer;
+  struct ug_Corpus reader;
+  ug_Vocab written = 0;
+  uint64_t generation = 0;
+  char * tmpDir;
+  char removeCmd[] = "rm -rvf ugtest-XXXXXX";
+  char path[] = "ugtest-XXXXXX/corpus";
+  tmpDir = &(removeCmd[8]);
+  ASYS(( tmpDir == mkdtemp(tmpDir) ));
+  memcpy(path, tmpDir, strlen(tmpDir));
+  writer = ug_createCorpus(path, 1, 10);
+  reader = ug_openCorpus(path);
+  
+  ug_beginRO(&reader);
+    A(( ug_mapFeatureToVocab(&reader, 0, testAttrArray[0])
+        == ug_VOCAB_UNKNOWN ));
+  ug_commit(&reader);
+  generation = ug_corpusGeneration(&reader);
+  A(( ug_addToCorpus(&writer, testText) ));
+  A(( ug_corpusGeneration(&reader) > generation ));
+  A(( ug_corpusGeneration(&reader) == ug_corpusGeneration(&writer) ));
+  ug_beginRO(&writer);
+    written = ug_mapFeatureToVocab(&writer, 0, testAttrArray[0]);
+  ug_commit(&writer);
+  A(( written != ug_VOCAB_UNKNOWN ));
+  ug_beginRO(&reader);
+    A(( ug_mapFeatureToVocab(&reader, 0, testAttrArray[0]) == written ));
+  ug_commit(&reader);
+  A(( ug_crossEntropy(&reader, testQuery)
+      == ug_crossEntropy(&writer, testQuery) ));
+  
+  ug_closeCorpus(&reader);
+  ug_closeCorpus(&writer);
+  system(removeCmd);  
+});
+
+/* Only words that have been trained on have ids. */
+TEST({
+  struct ug_Corpus c;
+  struct ug_Gram alphabet;
+  uint64_t ids[26];
+  size_t i = 0;
+  char * tmpDir;
+  char removeCmd[] = "rm -rvf ugtest-XXXXXX";
+  char path[] = "ugtest-XXXXXX/corpus";
+  tmpDir = &(removeCmd[8]);
+  ASYS(( tmpDir == mkdtemp(tmpDir) ));
+  memcpy(path, tmpDir, strlen(tmpDir));
+  c = ug_createCorpus(path, 1, 10);
+  alphabet.length = 26;
+  alphabet.words = testTermQueryArray;
+  
+  A(( ug_addToCorpus(&c, testText) ));
+  ug_vocabIds(&c, alphabet, &ids);
+  for (i = 0; i < 26; i++) {
+    A(( (ids[i] == ug_VOCAB_UNKNOWN) == (i >= testText.length) ));
+  }
+  
+  ug_closeCorpus(&c);
+  system(removeCmd);  
+});
+
+
+TEST({
+  struct ug_Corpus c;
+  struct ug_Predictions predictions;
+  struct ug_Gram prefix;
+  struct ug_Gram empty;
+  struct ug_Word reversedArray[20];
+  struct ug_Gram reversed;
+  struct ug_Estimator e;
+  struct ug_Context context;
+  double seen = 0.0;
+  double sum = 0.0;
+  size_t i = 0;
+  char * tmpDir;
+  char removeCmd[] = "rm -rvf ugtest-XXXXXX";
+  char path[] = "ugtest-XXXXXX/corpus";
+  tmpDir = &(removeCmd[8]);
+  ASYS(( tmpDir == mkdtemp(tmpDir) ));
+  memcpy(path, tmpDir, strlen(tmpDir));
+  c = ug_createCorpus(path, 1, 4);
+  
+  A(( ug_addToCorpus(&c, testText) ));
+  prefix.length = 3;
+  prefix.words = testTermQueryArray;
+  empty.length = 0;
+  empty.words = NULL;
+  reversed.length = 20;
+  reversed.words = reversedArray;
+  for (i = 0; i < 20; i++) {
+    reversedArray[i] = testTermQueryArray[19-i];
+  }
+  seen = ug_crossEntropy(&c, testQuery);
+  A(( seen < ug_crossEntropy(&c, reversed) ));
+
+  /* Every distribution sums to one. */
+  ug_beginRO(&c);
+    e = ug_openEstimator(&c, 0);
+    context = ug_startContext(&e);
+    for (i = 0; i < 5; i++) {
+      double p[e.nVocab];
+      ug_Vocab vocab;
+      ug_nextDistribution(&e, &context, &p);
+      sum = 0.0;
+      for (vocab = 0; vocab < e.nVocab; vocab++) {
+        sum += p[vocab];
+      }
+      A(( fabs(sum - 1.0) < 1e-9 ));
+      ug_scoreNext(&e, &context, ug_mapFeatureToVocab(&c, 0, testAttrArray[i]));
+    }
+    ug_freeContext(&context);
+    ug_closeEstimator(&e);
+  ug_commit(&c);
+  
+  predictions = ug_predict(&c, prefix, 1, 2, empty, 3);
+  A(( predictions.nPredictions == 3 ));
+  A(( predictions.predictions[0].gram.length == 1 ));
+  A(( strcmp(predictions.predictions[0].gram.words[0].values[0].value,
+             "d") == 0 ));
+  A(( predictions.predictions[0].score > predictions.predictions[1].score ));
+  A(( predictions.predictions[0].score < 0.0 ));
+  ug_freePredictions(predictions);
+  
+  /* Nothing is lost by closing the corpus. */
+  ug_closeCorpus(&c);
+  c = ug_openCorpus(path);
+  A(( fabs(ug_crossEntropy(&c, testQuery) - seen) < 1e-12 ));
+  ug_closeCorpus(&c);
+  system(removeCmd);
+});
+
+TEST({
+  struct ug_Corpus c;
+  struct ug_Corpus bulk;
+  struct ug_Corpus other;
+  struct ug_GramWeighted half;
+  double entropy = 0.0;
+  char * tmpDir;
+  char removeCmd[] = "rm -rvf ugtest-XXXXXX";
+  char path[] = "ugtest-XXXXXX/corpus";
+  char bulkPath[] = "ugtest-XXXXXX/bulk";
+  tmpDir = &(removeCmd[8]);
+  ASYS(( tmpDir == mkdtemp(tmpDir) ));
+  memcpy(path, tmpDir, strlen(tmpDir));
+  memcpy(bulkPath, tmpDir, strlen(tmpDir));
+  c = ug_createCorpus(path, 1, 4);
+  bulk = ug_createCorpus(bulkPath, 1, 4);
+  
+  A(( ug_addToCorpus(&c, testText) ));
+  A(( ug_addToCorpus(&c, testText) ));
+  entropy = ug_crossEntropy(&c, testQuery);
+  
+  /* Into an almost empty corpus, then into one with more in it than the
+   * batch. */
+  ug_beginBulkLoad(&bulk);
+  A(( ug_addToCorpus(&bulk, testText) ));
+  ug_endBulkLoad(&bulk);
+  ug_beginBulkLoad(&bulk);
+  A(( ug_addToCorpus(&bulk, testText) ));
+  /* Reads see what's been loaded so far. */
+  A(( fabs(ug_crossEntropy(&bulk, testQuery) - entropy) < 1e-12 ));
+  ug_endBulkLoad(&bulk);
+  A(( fabs(ug_crossEntropy(&bulk, testQuery) - entropy) < 1e-12 ));
+  
+  ug_closeCorpus(&bulk);
+  bulk = ug_openCorpus(bulkPath);
+  A(( fabs(ug_crossEntropy(&bulk, testQuery) - entropy) < 1e-12 ));
+  
+  /* Another handle writes during a load: the load mustn't undo that. */
+  other = ug_openCorpus(bulkPath);
+  half.length = testText.length / 2;
+  half.words = testText.words;
+  ug_beginBulkLoad(&bulk);
+  A(( ug_addToCorpus(&bulk, testText) ));
+  A(( ug_addToCorpus(&other, half) ));
+  A(( ug_endBulkLoad(&bulk) == -1 ));
+  A(( ug_addToCorpus(&c, half) ));
+  A(( fabs(ug_crossEntropy(&c, testQuery) - entropy) > 1e-12 ));
+  A(( fabs(ug_crossEntropy(&bulk, testQuery)
+           - ug_crossEntropy(&c, testQuery)) < 1e-12 ));
+  ug_closeCorpus(&other);
+  ug_closeCorpus(&bulk);
+  ug_closeCorpus(&c);
+  system(removeCmd);
+});
+
+TEST({
+  struct ug_Corpus c;
+  struct ug_Corpus old;
+  struct ug_VectorElement root;
+  double entropy = 0.0;
+  size_t order = 0;
+  char * tmpDir;
+  char removeCmd[] = "rm -rvf ugtest-XXXXXX";
+  char path[] = "ugtest-XXXXXX/corpus";
+  char oldPath[] = "ugtest-XXXXXX/old";
+  tmpDir = &(removeCmd[8]);
+  ASYS(( tmpDir == mkdtemp(tmpDir) ));
+  memcpy(path, tmpDir, strlen(tmpDir));
+  memcpy(oldPath, tmpDir, strlen(tmpDir));
+  c = ug_createCorpus(path, 1, 4);
+  A(( c.chunkFormat == ug_CHUNK_COMPACT ));
+  A(( ug_addToCorpus(&c, testText) ));
+  entropy = ug_crossEntropy(&c, testQuery);
+  
+  /* Make a corpus like the ones from before chunks were compact. */
+  old = ug_createCorpus(oldPath, 1, 4);
+  ug_beginRW(&old);
+    /* Every chunk there is gets dirtied, then written out raw. */
+    for (order = 0; order <= 4; order++) {
+      root = *ug_getElement(ug_getHGVector(ug_getAttribute(&old, 0), order), 0);
+      ug_updateElement(ug_getHGVector(ug_getAttribute(&old, 0), order), 0,
+                       root);
+    }
+    old.chunkFormat = ug_CHUNK_RAW;
+    ug_overwriteUInt64(&old, strlen("chunkFormat")+1, "chunkFormat",
+                       ug_CHUNK_RAW);
+    ug_flushChunks(&old);
+  ug_commit(&old);
+  ug_closeCorpus(&old);
+  
+  old = ug_openCorpus(oldPath);
+  A(( old.chunkFormat == ug_CHUNK_RAW ));
+  A(( ug_addToCorpus(&old, testText) ));
+  A(( fabs(ug_crossEntropy(&old, testQuery) - entropy) < 1e-12 ));
+  ug_closeCorpus(&old);
+  ug_closeCorpus(&c);
+  system(removeCmd);
+});
@@ -24,19 +24,46 @@
 #include "ug.h"
 #include "corpus.h"
 
-/* Compute the cross-entropy of a short string vs. corpus */
+/* Compute the cross-entropy of a short string vs. corpus: the mean negative
+ * natural log-probability of its words and the end of the sentence. */
 double ug_crossEntropy(struct ug_Corpus * ugc, struct ug_Gram query);
 
-/* Make a prediction */
+/* The natural log-probability of every word in query given the words before
+ * it, followed by that of the end of the sentence. */
+void ug_tokenLogprobs(struct ug_Corpus * ugc,
+                      struct ug_Gram query,
+                      double (* logprobs)[query.length+1]);
+
+/* The database's id for every word in query, or ug_VOCAB_UNKNOWN for the
+ * words it has never been trained on. */
+void ug_vocabIds(struct ug_Corpus * ugc,
+                 struct ug_Gram query,
+                 uint64_t (* ids)[query.length]);
+
+/* Make a prediction: the (at most) nPredictions most likely strings of min
+ * to max words to go between prefix and postfix, best first. Scores are
+ * natural log-probabilities. Free with ug_freePredictions. */
 struct ug_Predictions ug_predict(struct ug_Corpus * ugc,
                   struct ug_Gram prefix,
                   size_t min,
                   size_t max,
-                  struct ug_Gram postfix
+                  struct ug_Gram postfix,
+                  size_t nPredictions
                  );
 
+void ug_freePredictions(struct ug_Predictions predictions);
+
 int ug_addToCorpus(struct ug_Corpus * ugc, struct ug_GramWeighted text);
 
+/* Between these, ug_addToCorpus keeps its changes in memory. They're
+ * written out all at once, in key order, by ug_endBulkLoad, so loading a
+ * big corpus is one long sequential write instead of random inserts.
+ * ug_predict can't be used in between. Loading isn't merged with what other
+ * handles write meanwhile: if the database changed, ug_endBulkLoad discards
+ * the load and returns -1. */
+void ug_beginBulkLoad(struct ug_Corpus * ugc);
+int ug_endBulkLoad(struct ug_Corpus * ugc);
+
 struct ug_Corpus ug_openCorpus(char * path);
 
 void ug_closeCorpus(struct ug_Corpus * ugc);
@@ -46,4 +73,17 @@ struct ug_Corpus ug_createCorpus(char * path,
                                 size_t gramOrder
                                ); 
 
+/* The same as ug_openCorpus and ug_createCorpus, but the corpus is
+ * allocated, for callers that would rather not know what's in it (like
+ * unnaturalcode.ugCorpus). Close and free it with ug_closeCorpusHandle. */
+struct ug_Corpus * ug_openCorpusHandle(char * path);
+struct ug_Corpus * ug_createCorpusHandle(char * path,
+                                         ug_AttributeID nAttributes,
+                                         size_t gramOrder);
+void ug_closeCorpusHandle(struct ug_Corpus * ugc);
+
+/* Bumped every time anything (in any process) writes to the database.
+ * Scores computed at one generation are good until it changes. */
+uint64_t ug_corpusGeneration(struct ug_Corpus * ugc);
+
 #endif /* _UGAPI_H_ */
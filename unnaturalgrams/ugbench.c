@@ -0,0 +1,258 @@
+/* ugbench.c -- Benchmark driver for UnnaturalGrams
+ * 
+ * Copyright 2014 Joshua Charles Campbell
+ *
+ * This file is part of UnnaturalCode.
+ *
+ * UnnaturalCode is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ * 
+ * UnnaturalCode is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with UnnaturalCode.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/* Loads a token corpus (one sentence a line, tokens separated by
+ * whitespace, as written by benchcorpus.py) into a new corpus, then
+ * queries windows of it, and writes what it measured as JSON:
+ *
+ *   ugbench [-b] [-o order] [-q queries] [-w window] corpus.txt db out.json
+ *
+ * -b loads it with ug_beginBulkLoad/ug_endBulkLoad. */
+
+#define _POSIX_C_SOURCE 200809L
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <time.h>
+#include <sys/stat.h>
+#include "ugapi.h"
+
+struct ug_BenchSentence {
+  size_t length;
+  struct ug_Feature * features;
+};
+
+static double ug_now(void) {
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + t.tv_nsec * 1e-9;
+}
+
+static void * ug_benchAlloc(size_t size) {
+  void * p = malloc(size > 0 ? size : 1);
+  if (p == NULL) {
+    perror("ugbench");
+    exit(1);
+  }
+  return p;
+}
+
+/* Splits every line of path into features. The lines are kept (and
+ * modified) for the features to point into. */
+static size_t ug_readSentences(char * path,
+                               struct ug_BenchSentence ** sentences)
+{
+  FILE * f = NULL;
+  char * line = NULL;
+  size_t lineSize = 0;
+  size_t nSentences = 0;
+  size_t maxSentences = 1024;
+  size_t n = 0;
+  char * token = NULL;
+  char * saved = NULL;
+  struct ug_BenchSentence s;
+  
+  if ((f = fopen(path, "r")) == NULL) {
+    perror(path);
+    exit(1);
+  }
+  *sentences = ug_benchAlloc(maxSentences * sizeof(**sentences));
+  while (getline(&line, &lineSize, f) != -1) {
+    s.features = ug_benchAlloc(strlen(line) * sizeof(struct ug_Feature));
+    n = 0;
+    for (token = strtok_r(line, " \t\r\n", &saved);
+         token != NULL;
+         token = strtok_r(NULL, " \t\r\n", &saved)) {
+      s.features[n].length = strlen(token) + 1;
+      s.features[n].value = token;
+      n++;
+    }
+    if (n == 0) {
+      free(s.features);
+      continue;
+    }
+    s.length = n;
+    if (nSentences == maxSentences) {
+      maxSentences *= 2;
+      *sentences = realloc(*sentences, maxSentences * sizeof(**sentences));
+      if (*sentences == NULL) {
+        perror("ugbench");
+        exit(1);
+      }
+    }
+    (*sentences)[nSentences++] = s;
+    /* The features point into this line now. */
+    line = NULL;
+    lineSize = 0;
+  }
+  free(line);
+  fclose(f);
+  return nSentences;
+}
+
+static int ug_compareDoubles(const void * a, const void * b) {
+  double x = *((const double *) a);
+  double y = *((const double *) b);
+  return (x > y) - (x < y);
+}
+
+static double ug_percentile(double * sorted, size_t n, double p) {
+  size_t i = (size_t) (p * (n - 1) + 0.5);
+  return n > 0 ? sorted[i] : 0.0;
+}
+
+int main(int argc, char ** argv) {
+  int bulk = 0;
+  size_t order = 10;
+  size_t nQueries = 10000;
+  size_t window = 20;
+  int opt = 0;
+  struct ug_BenchSentence * sentences = NULL;
+  size_t nSentences = 0;
+  size_t nTokens = 0;
+  size_t i = 0;
+  size_t j = 0;
+  size_t k = 0;
+  size_t offset = 0;
+  struct ug_Corpus corpus;
+  struct ug_WordWeighted * train = NULL;
+  struct ug_Word * words = NULL;
+  struct ug_Gram query;
+  double * latencies = NULL;
+  double start = 0.0;
+  double loadTime = 0.0;
+  double queryTime = 0.0;
+  double entropy = 0.0;
+  char dataPath[4096];
+  struct stat st;
+  FILE * out = NULL;
+  
+  while ((opt = getopt(argc, argv, "bo:q:w:")) != -1) {
+    switch (opt) {
+      case 'b': bulk = 1; break;
+      case 'o': order = strtoul(optarg, NULL, 10); break;
+      case 'q': nQueries = strtoul(optarg, NULL, 10); break;
+      case 'w': window = strtoul(optarg, NULL, 10); break;
+      default:
+        fprintf(stderr, "usage: %s [-b] [-o order] [-q queries] [-w window]"
+                        " corpus.txt db out.json\n", argv[0]);
+        return 2;
+    }
+  }
+  if (argc - optind != 3 || order < 1 || window < 1) {
+    fprintf(stderr, "usage: %s [-b] [-o order] [-q queries] [-w window]"
+                    " corpus.txt db out.json\n", argv[0]);
+    return 2;
+  }
+  
+  nSentences = ug_readSentences(argv[optind], &sentences);
+  if (nSentences == 0) {
+    fprintf(stderr, "%s: no sentences\n", argv[optind]);
+    return 1;
+  }
+  
+  /* Ingest */
+  corpus = ug_createCorpus(argv[optind+1], 1, order);
+  start = ug_now();
+  if (bulk) {
+    ug_beginBulkLoad(&corpus);
+  }
+  for (i = 0; i < nSentences; i++) {
+    train = ug_benchAlloc(sentences[i].length * sizeof(*train));
+    for (j = 0; j < sentences[i].length; j++) {
+      train[j].nAttributes = 1;
+      train[j].weight = 1.0;
+      train[j].values = &(sentences[i].features[j]);
+    }
+    ug_addToCorpus(&corpus, (struct ug_GramWeighted) {
+      sentences[i].length,
+      train
+    });
+    free(train);
+    nTokens += sentences[i].length;
+  }
+  if (bulk) {
+    A(( ug_endBulkLoad(&corpus) == 0 ));
+  }
+  loadTime = ug_now() - start;
+  
+  /* Query windows of the corpus, in order, as a file would be checked. */
+  latencies = ug_benchAlloc(nQueries * sizeof(double));
+  words = ug_benchAlloc(window * sizeof(*words));
+  i = 0;
+  offset = 0;
+  for (k = 0; k < nQueries; k++) {
+    if (offset >= sentences[i].length) {
+      i = (i + 1) % nSentences;
+      offset = 0;
+    }
+    query.length = sentences[i].length - offset;
+    if (query.length > window) {
+      query.length = window;
+    }
+    for (j = 0; j < query.length; j++) {
+      words[j].nAttributes = 1;
+      words[j].values = &(sentences[i].features[offset + j]);
+    }
+    query.words = words;
+    start = ug_now();
+    entropy += ug_crossEntropy(&corpus, query);
+    latencies[k] = ug_now() - start;
+    queryTime += latencies[k];
+    offset++;
+  }
+  ug_closeCorpus(&corpus);
+  qsort(latencies, nQueries, sizeof(double), ug_compareDoubles);
+  
+  snprintf(dataPath, sizeof(dataPath), "%s/data.mdb", argv[optind+1]);
+  if (stat(dataPath, &st) != 0) {
+    perror(dataPath);
+    return 1;
+  }
+  
+  if ((out = fopen(argv[optind+2], "w")) == NULL) {
+    perror(argv[optind+2]);
+    return 1;
+  }
+  fprintf(out, "{\n");
+  fprintf(out, "  \"corpus\": \"%s\",\n", argv[optind]);
+  fprintf(out, "  \"order\": %zu,\n", order);
+  fprintf(out, "  \"bulk\": %s,\n", bulk ? "true" : "false");
+  fprintf(out, "  \"sentences\": %zu,\n", nSentences);
+  fprintf(out, "  \"tokens\": %zu,\n", nTokens);
+  fprintf(out, "  \"load_seconds\": %.6f,\n", loadTime);
+  fprintf(out, "  \"tokens_per_second\": %.1f,\n", nTokens / loadTime);
+  fprintf(out, "  \"window\": %zu,\n", window);
+  fprintf(out, "  \"queries\": %zu,\n", nQueries);
+  fprintf(out, "  \"query_seconds\": %.6f,\n", queryTime);
+  fprintf(out, "  \"queries_per_second\": %.1f,\n",
+          queryTime > 0.0 ? nQueries / queryTime : 0.0);
+  fprintf(out, "  \"latency_p50_ms\": %.4f,\n",
+          ug_percentile(latencies, nQueries, 0.50) * 1e3);
+  fprintf(out, "  \"latency_p99_ms\": %.4f,\n",
+          ug_percentile(latencies, nQueries, 0.99) * 1e3);
+  fprintf(out, "  \"mean_entropy\": %.6f,\n",
+          nQueries > 0 ? entropy / nQueries : 0.0);
+  fprintf(out, "  \"db_bytes\": %lld\n", (long long) st.st_size);
+  fprintf(out, "}\n");
+  fclose(out);
+  return 0;
+}
@@ -22,6 +22,7 @@
 #include "vocabulary.h"
 #include "hsuglass.h"
 #include "db.h"
+#include "cache.h"
 #include <string.h>
 
 ug_Vocab ug_mapFeatureToVocab(struct ug_Corpus * corpus,
@@ -35,14 +36,15 @@ ug_Vocab ug_mapFeatureToVocab(struct ug_Corpus * corpus,
   vkey.magic = ug_VOCAB;
   memcpy(vkey.value, v.value, v.length);
   
-  return ug_readUInt64OrZero(corpus, v.length + ug_VOCAB_KEY_PREFIX_LENGTH,
-                             &vkey);
+  return ug_readCachedUInt64OrZero(corpus,
+                                   v.length + ug_VOCAB_KEY_PREFIX_LENGTH,
+                                   &vkey);
 }
 
 ug_Vocab ug_getVocabCount(struct ug_Corpus * corpus,
                                  ug_AttributeID attr)
 {
-  struct ug_VocabCountKey key = {0, ug_VOCAB_COUNT};
+  struct ug_VocabCountKey key = {ug_VOCAB_COUNT, 0};
   key.attributeID = attr;
   return ug_readUInt64(corpus, sizeof(key), &key);
 }
@@ -50,7 +52,7 @@ ug_Vocab ug_getVocabCount(struct ug_Corpus * corpus,
 ug_Vocab ug_incrVocabCount(struct ug_Corpus * corpus,
                                  ug_AttributeID attr)
 {
-  struct ug_VocabCountKey key = {0, ug_VOCAB_COUNT};
+  struct ug_VocabCountKey key = {ug_VOCAB_COUNT, 0};
   key.attributeID = attr;
   ug_Vocab newCount = ug_getVocabCount(corpus, attr)+1;
   ug_overwriteUInt64(corpus, sizeof(key), &key, newCount);
@@ -85,8 +87,8 @@ ug_Vocab ug_mapFeatureToVocabOrCreate(struct ug_Corpus * corpus,
   vkey.magic = ug_VOCAB;
   memcpy(vkey.value, v.value, v.length);
   
-  ug_writeUInt64(corpus, v.length + ug_VOCAB_KEY_PREFIX_LENGTH,
-                             &vkey, new);
+  ug_writeCachedUInt64(corpus, v.length + ug_VOCAB_KEY_PREFIX_LENGTH,
+                       &vkey, new);
 
   /* Save the new id->word mapping */
   struct ug_VocabKey idkey = {ug_FEATURE, attr, new};
@@ -98,17 +100,37 @@ ug_Vocab ug_mapFeatureToVocabOrCreate(struct ug_Corpus * corpus,
   return new;
 }
 
+struct ug_Feature ug_mapVocabToFeature(struct ug_Corpus * corpus,
+                     ug_AttributeID attr,
+                     ug_Vocab id)
+{
+  struct ug_VocabKey idkey = {ug_FEATURE, attr, id};
+  struct ug_Feature v = {0, NULL};
+  
+  v.length = ug_readOrNull(corpus, sizeof(idkey), &idkey, (void **) &(v.value));
+  Av(( v.value != NULL ));
+  return v;
+}
+
 void ug_initVocab(struct ug_Corpus * corpus,
                                  ug_AttributeID attr)
 {
   ug_Vocab unknownId = 100;
-  struct ug_VocabCountKey key = {0, ug_VOCAB_COUNT};
+  struct ug_VocabCountKey key = {ug_VOCAB_COUNT, 0};
   char unknownString[] = "__UNKNOWN__";
   struct ug_Feature unknownFeature = {strlen(unknownString)+1, unknownString};
+  char startString[] = "<s>";
+  struct ug_Feature startFeature = {strlen(startString)+1, startString};
+  char endString[] = "</s>";
+  struct ug_Feature endFeature = {strlen(endString)+1, endString};
   key.attributeID = attr;
   ug_writeUInt64(corpus, sizeof(key), &key, 0);
   unknownId = ug_mapFeatureToVocabOrCreate(corpus, attr, unknownFeature);
-  Av((unknownId == 0));
+  Av((unknownId == ug_VOCAB_UNKNOWN));
+  Av(( ug_mapFeatureToVocabOrCreate(corpus, attr, startFeature)
+       == ug_VOCAB_START ));
+  Av(( ug_mapFeatureToVocabOrCreate(corpus, attr, endFeature)
+       == ug_VOCAB_END ));
 }
 
 void ug_mapFeaturesToVocabs(struct ug_Corpus * corpus,
@@ -30,6 +30,9 @@
 #define ug_MAX_WORD_LENGTH (511-ug_VOCAB_KEY_PREFIX_LENGTH)
 
 #define ug_VOCAB_UNKNOWN ((uint64_t) 0)
+/* Every sentence added or queried is wrapped in these. */
+#define ug_VOCAB_START ((uint64_t) 1)
+#define ug_VOCAB_END ((uint64_t) 2)
 
 struct __attribute__((packed)) ug_VocabCountKey {
   ug_KeyMagic magic; /* should be ug_VOCAB_COUNT */
@@ -62,6 +65,20 @@ ug_Vocab ug_mapFeatureToVocab(struct ug_Corpus * corpus,
                      struct ug_Feature v);
 
 
+ug_Vocab ug_getVocabCount(struct ug_Corpus * corpus,
+                                 ug_AttributeID attr);
+
+struct ug_Feature ug_mapVocabToFeature(struct ug_Corpus * corpus,
+                     ug_AttributeID attr,
+                     ug_Vocab id);
+
+void ug_mapFeaturesToVocabs(struct ug_Corpus * corpus,
+                       ug_AttributeID attr,
+                       size_t length,
+                       struct ug_Feature string[length],
+                       ug_Vocab (* ids)[length]
+                       );
+
 void ug_mapFeaturesToVocabsOrCreate(struct ug_Corpus * corpus,
                        ug_AttributeID attr,
                        size_t length,